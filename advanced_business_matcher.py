@@ -7,6 +7,8 @@ from collections import defaultdict
 import numpy as np
 import logging
 from datetime import datetime
+from scipy import sparse
+from lexicon import Lexicon
 
 # Set up logging
 logging.basicConfig(
@@ -19,10 +21,15 @@ class AdvancedBusinessMatcher:
     def __init__(self):
         """Initialize the matcher with necessary components."""
         self.nlp = None
-        self.keywords_df = None
+        self.lexicon = None
         self.sellers_df = None
         self.buyers_df = None
         self.keyword_synonyms = {}
+        self.buyer_vectors = None
+        self.seller_vectors = None
+        self.buyer_keyword_hits = None
+        self.seller_keyword_hits = None
+        self.keyword_names = []
         
     def initialize_nlp(self):
         """Initialize spaCy NLP model with error handling."""
@@ -40,24 +47,10 @@ class AdvancedBusinessMatcher:
             # Load keywords and create enhanced synonym dictionary
             path_dir = './data/'
             filePath = f"{path_dir}{keywords_path}"
-            self.keywords_df = pd.read_csv(filePath)
+            self.lexicon = Lexicon.load(filePath)
+            self.keyword_synonyms = self.lexicon.keyword_synonyms
             logger.info(f"Successfully loaded keywords from {keywords_path}")
             
-            # Create keyword dictionary with synonyms
-            for _, row in self.keywords_df.iterrows():
-                if pd.notna(row['Keyword']):
-                    synonyms = set()
-                    synonyms.add(row['Keyword'].lower())
-                    
-                    for col in [f'Synonym {i}' for i in range(1, 6)]:
-                        if pd.notna(row[col]):
-                            synonyms.add(row[col].lower())
-                            
-                    self.keyword_synonyms[row['Keyword'].lower()] = {
-                        'synonyms': synonyms,
-                        'original': row['Keyword']
-                    }
-            
             # Load buyers data
             self.buyers_df = pd.read_csv(f"{path_dir}{buyers_path}")
             logger.info(f"Successfully loaded buyer data from {buyers_path}")
@@ -67,6 +60,8 @@ class AdvancedBusinessMatcher:
             logger.info(f"Successfully loaded seller data from {sellers_path}")
             
             self._preprocess_descriptions()
+            self._compute_document_vectors()
+            self._compute_keyword_hits()
         except Exception as e:
             logger.error(f"Error loading data: {e}")
             raise
@@ -104,6 +99,50 @@ class AdvancedBusinessMatcher:
             logger.error(f"Error preprocessing descriptions: {e}")
             raise
 
+    def _document_vectors(self, texts: List[str], batch_size: int = 256) -> np.ndarray:
+        """Return L2-normalized spaCy document vectors for texts (zero rows for empty texts)."""
+        # Doc.vector only needs the static word vectors, so every pipeline component can be skipped
+        with self.nlp.select_pipes(disable=self.nlp.pipe_names):
+            docs = self.nlp.pipe((str(text)[:1000000] for text in texts), batch_size=batch_size)
+            vectors = np.zeros((len(texts), self.nlp.vocab.vectors_length), dtype=np.float32)
+            for i, doc in enumerate(docs):
+                if doc.has_vector:
+                    vectors[i] = doc.vector
+
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = np.divide(vectors, norms, out=np.zeros_like(vectors), where=norms > 0)
+        # Same convention as _calculate_semantic_similarity: empty texts score 0
+        empty = np.array([not text for text in texts], dtype=bool)
+        vectors[empty] = 0.0
+        return vectors
+
+    def _compute_document_vectors(self):
+        """Compute the document vector matrix of both sides once per run."""
+        try:
+            self.buyer_vectors = self._document_vectors(self.buyers_df['processed_description'].tolist())
+            self.seller_vectors = self._document_vectors(self.sellers_df['processed_description'].tolist())
+            logger.info(f"Computed document vectors for {len(self.buyer_vectors)} buyers and "
+                        f"{len(self.seller_vectors)} sellers")
+        except Exception as e:
+            logger.error(f"Error computing document vectors: {e}")
+            raise
+
+    def _keyword_hits(self, texts: List[str]) -> sparse.csr_matrix:
+        """Binary record x keyword matrix: 1 where any synonym of the keyword occurs in the text."""
+        return self.lexicon.hit_matrix(texts)
+
+    def _compute_keyword_hits(self):
+        """Compute the keyword hits of every record once per run (one pass over each text)."""
+        try:
+            self.keyword_names = list(self.lexicon.names)
+            self.buyer_keyword_hits = self._keyword_hits(self.buyers_df['processed_description'].tolist())
+            self.seller_keyword_hits = self._keyword_hits(self.sellers_df['processed_description'].tolist())
+            logger.info(f"Computed keyword hits: {self.buyer_keyword_hits.nnz} for buyers, "
+                        f"{self.seller_keyword_hits.nnz} for sellers")
+        except Exception as e:
+            logger.error(f"Error computing keyword hits: {e}")
+            raise
+
     def _process_text(self, text: str) -> str:
         """Process text using spaCy NLP."""
         if not text or pd.isna(text):
@@ -170,8 +209,13 @@ class AdvancedBusinessMatcher:
             
         return parts
 
-    def _calculate_match_scores(self, buyer: pd.Series, seller: pd.Series) -> Dict[str, float]:
-        """Calculate all match scores between a buyer and seller."""
+    def _calculate_match_scores(self, buyer: pd.Series, seller: pd.Series,
+                                semantic_score: float = None, keyword_score: float = None) -> Dict[str, float]:
+        """Calculate all match scores between a buyer and seller.
+
+        `semantic_score` and `keyword_score` are the precomputed scores of the
+        pair; when omitted they are computed from the two descriptions.
+        """
         try:
             # Initialize scores
             scores = {
@@ -195,22 +239,20 @@ class AdvancedBusinessMatcher:
             scores['location'] = location_matches / max(total_locations, 1)
             
             # Calculate keyword score
-            buyer_text = str(buyer['processed_description']).lower()
-            seller_text = str(seller['processed_description']).lower()
-            
-            keyword_matches = 0
-            for keyword_data in self.keyword_synonyms.values():
-                if any(syn in buyer_text for syn in keyword_data['synonyms']) and \
-                   any(syn in seller_text for syn in keyword_data['synonyms']):
-                    keyword_matches += 1
-            
-            scores['keyword'] = keyword_matches / max(len(self.keyword_synonyms), 1)
+            if keyword_score is None:
+                keyword_score = len(self._get_matching_keywords(
+                    buyer['processed_description'],
+                    seller['processed_description']
+                )) / max(len(self.keyword_synonyms), 1)
+            scores['keyword'] = keyword_score
             
             # Calculate semantic similarity
-            scores['semantic'] = self._calculate_semantic_similarity(
-                buyer['processed_description'],
-                seller['processed_description']
-            )
+            if semantic_score is None:
+                semantic_score = self._calculate_semantic_similarity(
+                    buyer['processed_description'],
+                    seller['processed_description']
+                )
+            scores['semantic'] = semantic_score
             
             return scores
             
@@ -223,10 +265,23 @@ class AdvancedBusinessMatcher:
         matches = []
         
         try:
-            for _, buyer in self.buyers_df.iterrows():
-                for _, seller in self.sellers_df.iterrows():
+            if self.buyer_vectors is None or self.seller_vectors is None:
+                self._compute_document_vectors()
+            # Semantic scores of all pairs from one matrix product
+            semantic_matrix = self.buyer_vectors @ self.seller_vectors.T
+            if self.buyer_keyword_hits is None or self.seller_keyword_hits is None:
+                self._compute_keyword_hits()
+            # Shared keywords of all pairs from one sparse product of the binary hit matrices
+            keyword_matrix = (self.buyer_keyword_hits @ self.seller_keyword_hits.T).toarray().astype(np.float64)
+            keyword_matrix /= max(len(self.keyword_synonyms), 1)
+
+            for buyer_pos, (_, buyer) in enumerate(self.buyers_df.iterrows()):
+                for seller_pos, (_, seller) in enumerate(self.sellers_df.iterrows()):
                     # Calculate scores
-                    scores = self._calculate_match_scores(buyer, seller)
+                    scores = self._calculate_match_scores(
+                        buyer, seller, float(semantic_matrix[buyer_pos, seller_pos]),
+                        float(keyword_matrix[buyer_pos, seller_pos])
+                    )
                     
                     # Calculate weighted final score
                     weights = {
@@ -246,10 +301,7 @@ class AdvancedBusinessMatcher:
                             'semantic_score': scores['semantic'],
                             'buyer_location': buyer['location (state + city)'],
                             'seller_location': seller['location'],
-                            'matching_keywords': self._get_matching_keywords(
-                                buyer['processed_description'],
-                                seller['processed_description']
-                            )
+                            'matching_keywords': self._shared_keywords(buyer_pos, seller_pos)
                         }
                         matches.append(match_info)
             
@@ -261,18 +313,25 @@ class AdvancedBusinessMatcher:
             
         return matches
 
+    def _shared_keywords(self, buyer_pos: int, seller_pos: int) -> List[str]:
+        """Matching keywords of a buyer/seller pair (row positions) from the precomputed hits."""
+        buyer_hits = self.buyer_keyword_hits
+        seller_hits = self.seller_keyword_hits
+        shared = np.intersect1d(
+            buyer_hits.indices[buyer_hits.indptr[buyer_pos]:buyer_hits.indptr[buyer_pos + 1]],
+            seller_hits.indices[seller_hits.indptr[seller_pos]:seller_hits.indptr[seller_pos + 1]],
+            assume_unique=True
+        )
+        return [self.keyword_names[keyword_id] for keyword_id in shared]
+
     def _get_matching_keywords(self, buyer_text: str, seller_text: str) -> List[str]:
         """Get list of matching keywords between buyer and seller."""
         matching_keywords = []
         
         try:
-            buyer_text = str(buyer_text).lower()
-            seller_text = str(seller_text).lower()
-            
-            for keyword, data in self.keyword_synonyms.items():
-                if any(syn in buyer_text for syn in data['synonyms']) and \
-                   any(syn in seller_text for syn in data['synonyms']):
-                    matching_keywords.append(data['original'])
+            # Same keyword hits as the precomputed hit matrices, in lexicon order
+            buyer_keywords, seller_keywords = self.lexicon.tag([buyer_text, seller_text])
+            matching_keywords = [self.lexicon.names[i] for i in sorted(buyer_keywords & seller_keywords)]
                     
         except Exception as e:
             logger.error(f"Error getting matching keywords: {e}")
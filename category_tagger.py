@@ -0,0 +1,136 @@
+import logging
+from collections import deque
+from typing import Dict, List, Set, Tuple
+
+import numpy as np
+import pandas as pd
+from rapidfuzz import fuzz, process
+
+logger = logging.getLogger(__name__)
+
+
+class AhoCorasick:
+    """
+    Aho-Corasick automaton over a fixed set of patterns.
+
+    find() reports the ids of all patterns occurring anywhere in a text
+    (substring hits, overlapping allowed) in one pass over the text,
+    independent of the number of patterns.
+    """
+
+    def __init__(self, patterns: List[str]):
+        self.patterns = list(patterns)
+        self.goto: List[Dict[str, int]] = [{}]
+        self.fail: List[int] = [0]
+        self.output: List[Set[int]] = [set()]
+        for pattern_id, pattern in enumerate(self.patterns):
+            if pattern:
+                self._insert(pattern, pattern_id)
+        self._build_failure_links()
+
+    def _insert(self, pattern: str, pattern_id: int) -> None:
+        state = 0
+        for char in pattern:
+            if char not in self.goto[state]:
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append(set())
+                self.goto[state][char] = len(self.goto) - 1
+            state = self.goto[state][char]
+        self.output[state].add(pattern_id)
+
+    def _build_failure_links(self) -> None:
+        # Failure links plus, per state, its transitions with the failure chain resolved
+        # (except the root's, which are the fallback), so find() does one lookup per char
+        self.delta: List[Dict[str, int]] = [{} for _ in self.goto]
+        queue = deque(self.goto[0].values())
+        for state in queue:
+            self.delta[state] = dict(self.goto[state])
+        while queue:
+            state = queue.popleft()
+            for char, child in self.goto[state].items():
+                queue.append(child)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(char, 0)
+                self.output[child] |= self.output[self.fail[child]]
+                self.delta[child] = {**self.delta[self.fail[child]], **self.goto[child]}
+
+    def find(self, text: str) -> Set[int]:
+        found = set()
+        state = 0
+        root, delta, output = self.goto[0], self.delta, self.output
+        for char in text:
+            state = delta[state].get(char) or root.get(char, 0)
+            if output[state]:
+                found |= output[state]
+        return found
+
+    def find_spans(self, text: str) -> List[Tuple[int, int, int]]:
+        """All (start, end, pattern_id) occurrences in text, end exclusive."""
+        spans = []
+        state = 0
+        root, delta, output = self.goto[0], self.delta, self.output
+        for end, char in enumerate(text, 1):
+            state = delta[state].get(char) or root.get(char, 0)
+            for pattern_id in output[state]:
+                spans.append((end - len(self.patterns[pattern_id]), end, pattern_id))
+        return spans
+
+
+class CategoryTagger:
+    """
+    Tags texts with business categories from keyword lists.
+
+    Exact hits of a keyword are found with one Aho-Corasick pass per text;
+    an exact hit scores partial_ratio 100, so it decides the category just
+    as the fuzzy test would. Categories without an exact hit fall back to
+    rapidfuzz partial_ratio of every remaining keyword against every text,
+    computed in one batched, multi-threaded process.cdist call. Results are
+    cached per distinct text, so each listing is tagged once.
+    """
+
+    def __init__(self, keyword_categories: Dict[str, str], threshold: int = 80):
+        self.threshold = threshold
+        self.keywords = [str(keyword).lower() for keyword in keyword_categories]
+        self.keyword_category = [keyword_categories[keyword] for keyword in keyword_categories]
+        self.category_keywords: Dict[str, List[str]] = {}
+        for keyword, category in zip(self.keywords, self.keyword_category):
+            self.category_keywords.setdefault(category, []).append(keyword)
+
+        # Only the keywords themselves: shorter (e.g. stemmed) forms would tag texts the fuzzy test rejects
+        self.automaton = AhoCorasick(self.keywords)
+        self._cache: Dict[str, frozenset] = {}
+
+    def tag_many(self, texts: List[str]) -> List[Set[str]]:
+        """Category set of every text (texts are lowercased; NaN/None give an empty set)."""
+        texts = ['' if text is None or pd.isna(text) else str(text).lower() for text in texts]
+        new_texts = [text for text in dict.fromkeys(texts) if text not in self._cache]
+
+        if new_texts:
+            found = [{self.keyword_category[p] for p in self.automaton.find(text)} for text in new_texts]
+            n_exact = sum(1 for categories in found if categories)
+
+            # Fuzzy fallback per category, only against the texts still missing that category
+            n_fuzzy = 0
+            for category, keywords in self.category_keywords.items():
+                open_rows = [i for i, categories in enumerate(found) if category not in categories]
+                if not open_rows:
+                    continue
+                scores = process.cdist(keywords, [new_texts[i] for i in open_rows],
+                                       scorer=fuzz.partial_ratio, score_cutoff=self.threshold,
+                                       dtype=np.uint8, workers=-1)
+                for col in np.flatnonzero((scores >= self.threshold).any(axis=0)):
+                    found[open_rows[col]].add(category)
+                n_fuzzy += scores.size
+
+            for text, categories in zip(new_texts, found):
+                self._cache[text] = frozenset(categories)
+            logger.debug(f"Tagged {len(new_texts)} new texts: {n_exact} with exact keyword hits, "
+                         f"{n_fuzzy} fuzzy keyword comparisons")
+
+        return [set(self._cache[text]) for text in texts]
+
+    def tag(self, text: str) -> Set[str]:
+        return self.tag_many([text])[0]
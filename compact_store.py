@@ -0,0 +1,315 @@
+import os
+import time
+import logging
+import argparse
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from embedding_cache import DEFAULT_CACHE_DIR, EmbeddingCache, slug
+
+logger = logging.getLogger(__name__)
+
+# Storage of the in-memory candidate vectors:
+#   'float32' - uncompressed (no rescoring needed)
+#   'float16' - half precision, 2x smaller
+#   'int8'    - per-dimension scalar quantization, 4x smaller
+#   'pca'     - PCA-reduced to `pca_dim` dimensions (float16)
+EMBEDDING_STORAGE = os.environ.get('MATCHER_EMBEDDING_STORAGE', 'float32')
+STORE_DIR = os.path.join(DEFAULT_CACHE_DIR, 'stores')
+
+STORAGE_MODES = ('float32', 'float16', 'int8', 'pca')
+
+
+class CompactEmbeddingStore:
+    """
+    Normalized embeddings kept in compact form for candidate generation.
+
+    The full-precision float32 vectors live in a .npy file that is opened
+    memory-mapped; only the rows of the final candidates are paged in to
+    rescore them exactly. Scores returned by the search methods are always
+    exact cosine similarities, only the candidate set is approximate.
+    """
+
+    def __init__(self, full_path: str, mode: str = EMBEDDING_STORAGE, pca_dim: int = 128,
+                 block_size: int = 8192, pca_sample: int = 20000):
+        if mode not in STORAGE_MODES:
+            raise ValueError(f"Unknown storage mode '{mode}', expected one of {STORAGE_MODES}")
+        self.full_path = full_path
+        self.mode = mode
+        self.block_size = block_size
+        self.full = np.load(full_path, mmap_mode='r')
+        self.dimension = self.full.shape[1]
+
+        self._scale = None
+        self._mean = None
+        self._components = None
+        if mode == 'float32':
+            self.compact = np.asarray(self.full, dtype=np.float32)
+        elif mode == 'float16':
+            self.compact = self._convert_blocks(lambda block: block.astype(np.float16), np.float16)
+        elif mode == 'int8':
+            # Symmetric per-dimension scale, computed in one pass over the memory-mapped rows
+            max_abs = np.zeros(self.dimension, dtype=np.float32)
+            for start in range(0, len(self.full), block_size):
+                max_abs = np.maximum(max_abs, np.abs(self.full[start:start + block_size]).max(axis=0))
+            self._scale = np.maximum(max_abs, 1e-12) / 127.0
+            self.compact = self._convert_blocks(
+                lambda block: np.clip(np.rint(block / self._scale), -127, 127).astype(np.int8), np.int8)
+        else:
+            self._fit_pca(min(pca_dim, self.dimension), pca_sample)
+            self.compact = self._convert_blocks(
+                lambda block: ((block - self._mean) @ self._components.T).astype(np.float16), np.float16,
+                width=len(self._components))
+
+        logger.info(f"Embedding store {os.path.basename(full_path)}: {len(self)} vectors, mode={mode}, "
+                    f"{self.memory_footprint()['compact_mb']:.1f} MB in memory")
+
+    @classmethod
+    def from_embeddings(cls, embeddings: np.ndarray, name: str, mode: str = EMBEDDING_STORAGE,
+                        store_dir: str = STORE_DIR, **kwargs) -> 'CompactEmbeddingStore':
+        """Persist full-precision embeddings under store_dir and build a store on top of them."""
+        os.makedirs(store_dir, exist_ok=True)
+        full_path = os.path.join(store_dir, f'{slug(name)}.npy')
+        tmp_path = full_path + '.tmp.npy'
+        np.save(tmp_path, np.ascontiguousarray(embeddings, dtype=np.float32))
+        os.replace(tmp_path, full_path)
+        return cls(full_path, mode, **kwargs)
+
+    def __len__(self) -> int:
+        return len(self.full)
+
+    # ------------------------------------------------------------------
+    # Compression
+    # ------------------------------------------------------------------
+    def _convert_blocks(self, convert, dtype, width: Optional[int] = None) -> np.ndarray:
+        out = np.empty((len(self.full), width or self.dimension), dtype=dtype)
+        for start in range(0, len(self.full), self.block_size):
+            out[start:start + self.block_size] = convert(np.asarray(self.full[start:start + self.block_size],
+                                                                    dtype=np.float32))
+        return out
+
+    def _fit_pca(self, pca_dim: int, sample_size: int) -> None:
+        n = len(self.full)
+        if n == 0:
+            self._mean = np.zeros(self.dimension, dtype=np.float32)
+            self._components = np.eye(pca_dim, self.dimension, dtype=np.float32)
+            return
+        # Fit on a random sample of rows; the principal axes of a few 10k vectors are stable
+        rng = np.random.default_rng(42)
+        rows = np.sort(rng.choice(n, size=min(sample_size, n), replace=False))
+        sample = np.asarray(self.full[rows], dtype=np.float32)
+        self._mean = sample.mean(axis=0)
+        _, _, vt = np.linalg.svd(sample - self._mean, full_matrices=False)
+        self._components = np.ascontiguousarray(vt[:pca_dim], dtype=np.float32)
+
+    def _transform_queries(self, queries: np.ndarray) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        """Map queries into the compact space; returns (queries, per-query score offset or None)."""
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        if self.mode == 'int8':
+            return queries * self._scale, None
+        if self.mode == 'pca':
+            # q.x ~= q.mean + (P q).(P (x - mean))
+            return queries @ self._components.T, queries @ self._mean
+        return queries, None
+
+    def approximate_scores(self, queries: np.ndarray, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """Approximate query x item dot products from the compact vectors (optionally for a row subset)."""
+        queries, offset = self._transform_queries(queries)
+        compact = self.compact if rows is None else self.compact[rows]
+
+        scores = np.empty((len(queries), len(compact)), dtype=np.float32)
+        for start in range(0, len(compact), self.block_size):
+            block = np.asarray(compact[start:start + self.block_size], dtype=np.float32)
+            scores[:, start:start + len(block)] = queries @ block.T
+        if offset is not None:
+            scores += offset[:, None]
+        return scores
+
+    def exact_scores(self, query: np.ndarray, rows: np.ndarray) -> np.ndarray:
+        """Exact dot products of one query against the given rows of the memory-mapped vectors."""
+        rows = np.asarray(rows, dtype=np.int64)
+        if len(rows) == 0:
+            return np.empty(0, dtype=np.float32)
+        # Read the rows in file order, then put the scores back in the requested order
+        order = np.argsort(rows, kind='stable')
+        scores = np.empty(len(rows), dtype=np.float32)
+        scores[order] = np.asarray(self.full[rows[order]], dtype=np.float32) @ np.asarray(query, dtype=np.float32)
+        return scores
+
+    # ------------------------------------------------------------------
+    # Search
+    # ------------------------------------------------------------------
+    def search(self, queries: np.ndarray, top_k: int = 10, candidates: Optional[int] = None,
+               threshold: Optional[float] = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Top-k search: `candidates` items per query are taken from the compact
+        vectors and rescored exactly. Returns flat (query_idx, item_idx, score)
+        arrays like matching_engine.blocked_matches, by descending score.
+        """
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        n_items = len(self)
+        top_k = min(top_k, n_items)
+        candidates = min(max(candidates or 4 * top_k, top_k), n_items)
+
+        query_parts, item_parts, score_parts = [], [], []
+        if top_k == 0 or len(queries) == 0:
+            empty = np.empty(0, dtype=np.int64)
+            return empty, empty, np.empty(0, dtype=np.float32)
+
+        for start in range(0, len(queries), 256):
+            block = queries[start:start + 256]
+            approx = self.approximate_scores(block)
+            if candidates < n_items:
+                cand = np.argpartition(-approx, candidates - 1, axis=1)[:, :candidates]
+            else:
+                cand = np.broadcast_to(np.arange(n_items), (len(block), n_items))
+
+            for offset, (query, cols) in enumerate(zip(block, cand)):
+                exact = approx[offset, cols] if self.mode == 'float32' else self.exact_scores(query, cols)
+                order = np.argsort(-exact, kind='stable')[:top_k]
+                cols, exact = cols[order], exact[order]
+                if threshold is not None:
+                    keep = exact >= threshold
+                    cols, exact = cols[keep], exact[keep]
+                query_parts.append(np.full(len(cols), start + offset, dtype=np.int64))
+                item_parts.append(np.asarray(cols, dtype=np.int64))
+                score_parts.append(exact)
+
+        return (np.concatenate(query_parts), np.concatenate(item_parts),
+                np.concatenate(score_parts).astype(np.float32))
+
+    def subset_matches(self, query: np.ndarray, rows: np.ndarray, threshold: float,
+                       margin: float = 0.02) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Threshold search of one query over a subset of rows (e.g. a radius
+        query result). Rows whose approximate score is within `margin` of the
+        threshold are rescored exactly. Returns (positions into rows, scores).
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        approx = self.approximate_scores(query, rows)[0]
+        if self.mode == 'float32':
+            positions = np.flatnonzero(approx >= threshold)
+            return positions, approx[positions]
+        positions = np.flatnonzero(approx >= threshold - margin)
+        exact = self.exact_scores(np.ravel(query), rows[positions])
+        keep = exact >= threshold
+        return positions[keep], exact[keep]
+
+    def pair_matches(self, queries: np.ndarray, query_idx: np.ndarray, rows: np.ndarray,
+                     threshold: float, margin: float = 0.02) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Threshold flat (query, row) pairs, e.g. the output of a spatial join,
+        with gathered row-wise dot products. Pairs within `margin` of the
+        threshold on the compact vectors are rescored exactly. Returns
+        (positions into the pair arrays, scores).
+        """
+        query_idx = np.asarray(query_idx, dtype=np.int64)
+        rows = np.asarray(rows, dtype=np.int64)
+        transformed, offset = self._transform_queries(queries)
+        approx = np.empty(len(rows), dtype=np.float32)
+        for start in range(0, len(rows), self.block_size):
+            q = query_idx[start:start + self.block_size]
+            block = np.asarray(self.compact[rows[start:start + self.block_size]], dtype=np.float32)
+            approx[start:start + len(q)] = np.einsum('ij,ij->i', transformed[q], block)
+            if offset is not None:
+                approx[start:start + len(q)] += offset[q]
+        if self.mode == 'float32':
+            positions = np.flatnonzero(approx >= threshold)
+            return positions, approx[positions]
+
+        positions = np.flatnonzero(approx >= threshold - margin)
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        exact = np.empty(len(positions), dtype=np.float32)
+        for start in range(0, len(positions), self.block_size):
+            block = positions[start:start + self.block_size]
+            order = np.argsort(rows[block], kind='stable')  # read the memory-mapped rows in file order
+            full = np.asarray(self.full[rows[block][order]], dtype=np.float32)
+            exact[start + order] = np.einsum('ij,ij->i', queries[query_idx[block][order]], full)
+        keep = exact >= threshold
+        return positions[keep], exact[keep]
+
+    # ------------------------------------------------------------------
+    # Reporting
+    # ------------------------------------------------------------------
+    def memory_footprint(self) -> Dict[str, float]:
+        """Resident size of the compact vectors vs. the full-precision file."""
+        extra = sum(a.nbytes for a in (self._scale, self._mean, self._components) if a is not None)
+        compact_bytes = self.compact.nbytes + extra
+        full_bytes = len(self) * self.dimension * 4
+        return {
+            'mode': self.mode,
+            'vectors': len(self),
+            'compact_mb': compact_bytes / 2 ** 20,
+            'full_mb': full_bytes / 2 ** 20,
+            'ratio': full_bytes / compact_bytes if compact_bytes else 0.0,
+        }
+
+    def recall(self, queries: np.ndarray, top_k: int = 10, candidates: Optional[int] = None) -> float:
+        """Recall@k of search() against exact brute-force search on the full vectors."""
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        top_k = min(top_k, len(self))
+        if len(queries) == 0 or top_k == 0:
+            return 1.0
+        query_idx, item_idx, _ = self.search(queries, top_k, candidates)
+
+        hits = 0
+        for start in range(0, len(queries), 256):
+            block = queries[start:start + 256]
+            exact = np.empty((len(block), len(self)), dtype=np.float32)
+            for item_start in range(0, len(self), self.block_size):
+                full = np.asarray(self.full[item_start:item_start + self.block_size], dtype=np.float32)
+                exact[:, item_start:item_start + len(full)] = block @ full.T
+            truth = np.argpartition(-exact, top_k - 1, axis=1)[:, :top_k]
+            for offset, expected in enumerate(truth):
+                found = item_idx[query_idx == start + offset]
+                hits += len(np.intersect1d(found, expected))
+        return hits / (len(queries) * top_k)
+
+
+def evaluate_storage(full_path: str, queries: np.ndarray, modes: List[str] = STORAGE_MODES,
+                     top_k: int = 10, pca_dim: int = 128) -> List[Dict[str, float]]:
+    """Footprint, recall@k and query time of each storage mode on the same vectors."""
+    reports = []
+    for mode in modes:
+        store = CompactEmbeddingStore(full_path, mode, pca_dim=pca_dim)
+        start = time.perf_counter()
+        store.search(queries, top_k)
+        elapsed = time.perf_counter() - start
+        report = {**store.memory_footprint(), f'recall@{top_k}': store.recall(queries, top_k),
+                  'search_seconds': elapsed}
+        logger.info(f"Storage {mode}: {report}")
+        reports.append(report)
+    return reports
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description='Compare compact embedding storage modes on cached embeddings.')
+    parser.add_argument('--model', default='paraphrase-multilingual-mpnet-base-v2',
+                        help='Embedding cache model id (see encoder_backend.encoder_id)')
+    parser.add_argument('--version', default='matching_algo_new-v2', help='Embedding cache preprocessing version')
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--top-k', type=int, default=10)
+    parser.add_argument('--pca-dim', type=int, default=128)
+    args = parser.parse_args()
+
+    cache = EmbeddingCache(args.model, args.version)
+    keys = cache.keys()
+    if not keys:
+        raise SystemExit(f"No cached embeddings in {cache.directory}")
+    embeddings = np.empty((len(keys), cache.dimension), dtype=np.float32)
+    cache.lookup(keys, out=embeddings)
+
+    full_path = CompactEmbeddingStore.from_embeddings(embeddings, f'{args.model}-{args.version}',
+                                                      'float16').full_path
+    rng = np.random.default_rng(42)
+    queries = embeddings[rng.choice(len(embeddings), size=min(args.queries, len(embeddings)), replace=False)]
+    del embeddings
+
+    for report in evaluate_storage(full_path, queries, top_k=args.top_k, pca_dim=args.pca_dim):
+        print(report)
+
+
+if __name__ == '__main__':
+    main()
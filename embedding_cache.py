@@ -0,0 +1,201 @@
+import os
+import re
+import hashlib
+import logging
+from typing import Callable, Dict, List, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = './embedding_cache'
+
+
+def text_hash(text: str) -> str:
+    """Content hash used as the cache key for a single text."""
+    if text is None:
+        text = ''
+    return hashlib.sha1(str(text).encode('utf-8')).hexdigest()
+
+
+def slug(value: str) -> str:
+    """Make a model name safe to use as a directory name."""
+    return re.sub(r'[^A-Za-z0-9._-]+', '_', value).strip('_')
+
+
+class EmbeddingCache:
+    """
+    Content-addressed on-disk embedding store.
+
+    Vectors are keyed by (model name, preprocessing version, sha1 of the text).
+    Each call that encodes new texts appends one shard of two .npy files
+    (vectors + keys); shards are opened memory-mapped so only the rows that
+    are actually looked up get paged in.
+    """
+
+    def __init__(self, model_name: str, preprocessing_version: str = 'v1',
+                 cache_dir: str = DEFAULT_CACHE_DIR, max_shards: int = 16):
+        self.model_name = model_name
+        self.preprocessing_version = preprocessing_version
+        self.directory = os.path.join(cache_dir, slug(model_name), slug(preprocessing_version))
+        self.max_shards = max_shards
+        os.makedirs(self.directory, exist_ok=True)
+
+        self._shards: List[np.ndarray] = []
+        self._index: Dict[str, Tuple[int, int]] = {}
+        self.dimension = None
+        self._load_shards()
+
+        if len(self._shards) > self.max_shards:
+            self.compact()
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._index
+
+    def keys(self) -> List[str]:
+        """Hashes of all cached texts."""
+        return list(self._index.keys())
+
+    # ------------------------------------------------------------------
+    # Shard handling
+    # ------------------------------------------------------------------
+    def _shard_paths(self, shard_id: int) -> Tuple[str, str]:
+        base = os.path.join(self.directory, f'shard_{shard_id:05d}')
+        return f'{base}.vectors.npy', f'{base}.keys.npy'
+
+    def _existing_shard_ids(self) -> List[int]:
+        ids = []
+        for name in os.listdir(self.directory):
+            match = re.match(r'shard_(\d+)\.keys\.npy$', name)
+            if match:
+                ids.append(int(match.group(1)))
+        return sorted(ids)
+
+    def _load_shards(self) -> None:
+        self._shards = []
+        self._index = {}
+        for shard_id in self._existing_shard_ids():
+            vectors_path, keys_path = self._shard_paths(shard_id)
+            if not os.path.exists(vectors_path):
+                logger.warning(f"Embedding cache shard {shard_id} has no vectors file, skipping")
+                continue
+            vectors = np.load(vectors_path, mmap_mode='r')
+            keys = np.load(keys_path)
+            if self.dimension is None:
+                self.dimension = vectors.shape[1]
+            elif vectors.shape[1] != self.dimension:
+                logger.warning(f"Embedding cache shard {shard_id} has dimension {vectors.shape[1]}, "
+                               f"expected {self.dimension}; skipping")
+                continue
+            position = len(self._shards)
+            self._shards.append(vectors)
+            for row, key in enumerate(keys):
+                self._index[key.decode('ascii')] = (position, row)
+        if self._index:
+            logger.info(f"Embedding cache {self.directory}: {len(self._index)} vectors "
+                        f"in {len(self._shards)} shard(s)")
+
+    def _write_shard(self, shard_id: int, keys: List[str], vectors: np.ndarray) -> None:
+        vectors_path, keys_path = self._shard_paths(shard_id)
+        # Write to temp files first so an interrupted run never leaves a half-written shard
+        tmp_vectors = vectors_path + '.tmp.npy'
+        tmp_keys = keys_path + '.tmp.npy'
+        np.save(tmp_vectors, np.ascontiguousarray(vectors, dtype=np.float32))
+        np.save(tmp_keys, np.array(keys, dtype='S40'))
+        os.replace(tmp_vectors, vectors_path)
+        os.replace(tmp_keys, keys_path)
+
+    def add(self, keys: List[str], vectors: np.ndarray) -> None:
+        """Store new vectors under the given keys as a fresh shard."""
+        if len(keys) == 0:
+            return
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if self.dimension is None:
+            self.dimension = vectors.shape[1]
+        elif vectors.shape[1] != self.dimension:
+            raise ValueError(f"Vector dimension {vectors.shape[1]} does not match cache dimension {self.dimension}")
+
+        existing = self._existing_shard_ids()
+        shard_id = existing[-1] + 1 if existing else 0
+        self._write_shard(shard_id, keys, vectors)
+
+        vectors_path, _ = self._shard_paths(shard_id)
+        position = len(self._shards)
+        self._shards.append(np.load(vectors_path, mmap_mode='r'))
+        for row, key in enumerate(keys):
+            self._index[key] = (position, row)
+
+    def lookup(self, keys: List[str], out: np.ndarray = None) -> np.ndarray:
+        """
+        Gather cached vectors for keys into a float32 array.
+        Returns a boolean mask of which keys were found; `out` is filled in place.
+        """
+        found = np.zeros(len(keys), dtype=bool)
+        by_shard: Dict[int, Tuple[List[int], List[int]]] = {}
+        for position, key in enumerate(keys):
+            location = self._index.get(key)
+            if location is None:
+                continue
+            found[position] = True
+            shard, row = location
+            positions, rows = by_shard.setdefault(shard, ([], []))
+            positions.append(position)
+            rows.append(row)
+
+        if out is not None:
+            for shard, (positions, rows) in by_shard.items():
+                out[positions] = self._shards[shard][rows]
+        return found
+
+    def compact(self) -> None:
+        """Merge all shards into a single one."""
+        if len(self._shards) <= 1:
+            return
+        keys = list(self._index.keys())
+        vectors = np.empty((len(keys), self.dimension), dtype=np.float32)
+        self.lookup(keys, out=vectors)
+
+        old_ids = self._existing_shard_ids()
+        new_id = old_ids[-1] + 1
+        self._write_shard(new_id, keys, vectors)
+        self._shards = []
+        for shard_id in old_ids:
+            for path in self._shard_paths(shard_id):
+                if os.path.exists(path):
+                    os.remove(path)
+        self._load_shards()
+        logger.info(f"Compacted embedding cache {self.directory} into one shard of {len(keys)} vectors")
+
+    # ------------------------------------------------------------------
+    # Encoding
+    # ------------------------------------------------------------------
+    def encode(self, texts: List[str], encode_fn: Callable[[List[str]], np.ndarray]) -> np.ndarray:
+        """
+        Return float32 embeddings for texts, calling encode_fn only for texts
+        whose hash is not in the cache yet. New vectors are persisted.
+        """
+        texts = ['' if t is None else str(t) for t in texts]
+        keys = [text_hash(t) for t in texts]
+
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in self._index and key not in missing:
+                missing[key] = text
+
+        logger.info(f"Embedding cache: {len(texts) - sum(1 for k in keys if k in missing)} cached, "
+                    f"{len(missing)} new unique texts to encode")
+
+        if missing:
+            new_keys = list(missing.keys())
+            new_vectors = np.asarray(encode_fn(list(missing.values())), dtype=np.float32)
+            self.add(new_keys, new_vectors)
+
+        if self.dimension is None:
+            return np.empty((0, 0), dtype=np.float32)
+
+        embeddings = np.empty((len(texts), self.dimension), dtype=np.float32)
+        self.lookup(keys, out=embeddings)
+        return embeddings
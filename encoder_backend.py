@@ -0,0 +1,160 @@
+import os
+import glob
+import time
+import logging
+import argparse
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+from sentence_transformers import SentenceTransformer
+
+from embedding_cache import slug
+
+logger = logging.getLogger(__name__)
+
+# Backend used by the matchers when none is passed explicitly:
+#   'torch'      - plain PyTorch SentenceTransformer (fp32)
+#   'onnx'       - ONNX Runtime export of the same model (fp32)
+#   'onnx-int8'  - ONNX Runtime export with dynamic int8 quantization
+ENCODER_BACKEND = os.environ.get('MATCHER_ENCODER_BACKEND', 'torch')
+ONNX_MODEL_DIR = os.environ.get('MATCHER_ONNX_DIR', './onnx_models')
+# Instruction set targeted by the int8 kernels: 'avx2', 'avx512' or 'avx512_vnni'
+QUANTIZATION_CONFIG = os.environ.get('MATCHER_QUANTIZATION_CONFIG', 'avx2')
+
+BACKENDS = ('torch', 'onnx', 'onnx-int8')
+
+
+def encoder_id(model_name: str, backend: Optional[str] = None) -> str:
+    """Identifier for a model/backend pair, e.g. for keying cached embeddings."""
+    backend = backend or ENCODER_BACKEND
+    if backend == 'torch':
+        return model_name
+    if backend == 'onnx-int8':
+        # Each quantization config is a different model file with different vectors
+        return f'{model_name}-onnx-int8-{QUANTIZATION_CONFIG}'
+    return f'{model_name}-{backend}'
+
+
+def _find_onnx_file(model_dir: str, file_name: str) -> Optional[str]:
+    """Locate an exported .onnx file below model_dir, relative to model_dir."""
+    matches = glob.glob(os.path.join(model_dir, '**', file_name), recursive=True)
+    if not matches:
+        return None
+    return os.path.relpath(sorted(matches)[0], model_dir)
+
+
+def _export_onnx(model_name: str, model_dir: str) -> None:
+    """Export the model to ONNX once and keep the graph next to its tokenizer/config."""
+    logger.info(f"Exporting {model_name} to ONNX in {model_dir} (one-off)...")
+    model = SentenceTransformer(model_name, backend='onnx')
+    model.save_pretrained(model_dir)
+
+
+def _export_quantized(model_dir: str, onnx_file: str) -> None:
+    from sentence_transformers import export_dynamic_quantized_onnx_model
+
+    logger.info(f"Quantizing ONNX model in {model_dir} to int8 ({QUANTIZATION_CONFIG})...")
+    model = SentenceTransformer(model_dir, backend='onnx', model_kwargs={'file_name': onnx_file})
+    export_dynamic_quantized_onnx_model(model, QUANTIZATION_CONFIG, model_dir)
+
+
+def load_encoder(model_name: str, backend: Optional[str] = None,
+                 onnx_dir: str = ONNX_MODEL_DIR) -> SentenceTransformer:
+    """
+    Load a SentenceTransformer for the requested backend.
+
+    ONNX graphs are exported on first use and cached under onnx_dir, so later
+    runs only pay the ONNX Runtime session start-up. The returned object has
+    the usual SentenceTransformer.encode interface for every backend.
+    """
+    backend = backend or ENCODER_BACKEND
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown encoder backend '{backend}', expected one of {BACKENDS}")
+
+    if backend == 'torch':
+        return SentenceTransformer(model_name)
+
+    model_dir = os.path.join(onnx_dir, slug(model_name))
+    onnx_file = _find_onnx_file(model_dir, 'model.onnx')
+    if onnx_file is None:
+        _export_onnx(model_name, model_dir)
+        onnx_file = _find_onnx_file(model_dir, 'model.onnx')
+        if onnx_file is None:
+            raise RuntimeError(f"ONNX export of {model_name} did not produce model.onnx in {model_dir}")
+
+    if backend == 'onnx-int8':
+        quantized_name = f'model_qint8_{QUANTIZATION_CONFIG}.onnx'
+        quantized_file = _find_onnx_file(model_dir, quantized_name)
+        if quantized_file is None:
+            _export_quantized(model_dir, onnx_file)
+            quantized_file = _find_onnx_file(model_dir, quantized_name)
+            if quantized_file is None:
+                raise RuntimeError(f"int8 quantization did not produce {quantized_name} in {model_dir}")
+        onnx_file = quantized_file
+
+    logger.info(f"Loading {model_name} with ONNX Runtime ({onnx_file})")
+    return SentenceTransformer(model_dir, backend='onnx', model_kwargs={'file_name': onnx_file})
+
+
+def check_parity(model_name: str, texts: List[str], backend: str = 'onnx-int8',
+                 tolerance: float = 0.02, batch_size: int = 64) -> Dict[str, float]:
+    """
+    Compare a backend against the torch reference on the same texts.
+
+    Checks both the per-text agreement (cosine between the two embeddings of
+    a text) and the pairwise cosine scores the matchers threshold on. Passes
+    when the largest pairwise score difference is within `tolerance`.
+    """
+    reference = load_encoder(model_name, 'torch')
+    candidate = load_encoder(model_name, backend)
+
+    def timed_encode(model):
+        start = time.perf_counter()
+        embeddings = model.encode(texts, batch_size=batch_size, convert_to_numpy=True,
+                                  normalize_embeddings=True, show_progress_bar=False)
+        return embeddings.astype('float32'), time.perf_counter() - start
+
+    ref_emb, ref_time = timed_encode(reference)
+    cand_emb, cand_time = timed_encode(candidate)
+
+    self_cosine = np.sum(ref_emb * cand_emb, axis=1)
+    score_diff = np.abs(ref_emb @ ref_emb.T - cand_emb @ cand_emb.T)
+
+    report = {
+        'min_self_cosine': float(self_cosine.min()),
+        'max_score_diff': float(score_diff.max()),
+        'mean_score_diff': float(score_diff.mean()),
+        'torch_seconds': ref_time,
+        f'{backend}_seconds': cand_time,
+        'speedup': ref_time / cand_time if cand_time else float('inf'),
+        'passed': bool(score_diff.max() <= tolerance),
+    }
+    logger.info(f"Parity {model_name} torch vs {backend}: {report}")
+    return report
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description='Check ONNX encoder parity against the torch backend.')
+    parser.add_argument('--model', default='paraphrase-multilingual-mpnet-base-v2')
+    parser.add_argument('--backend', default='onnx-int8', choices=[b for b in BACKENDS if b != 'torch'])
+    parser.add_argument('--data', default='./data/nexxt_change_sales_listings_20241101_005703.csv')
+    parser.add_argument('--sample', type=int, default=500)
+    parser.add_argument('--tolerance', type=float, default=0.02)
+    args = parser.parse_args()
+
+    df = pd.read_csv(args.data)
+    text_columns = [c for c in ['title', 'description', 'long_description', 'branchen'] if c in df.columns]
+    texts = df[text_columns].fillna('').astype(str).agg(' '.join, axis=1)
+    texts = texts.sample(min(args.sample, len(texts)), random_state=42).tolist()
+
+    report = check_parity(args.model, texts, args.backend, args.tolerance)
+    if not report['passed']:
+        raise SystemExit(f"Parity check failed: max score difference {report['max_score_diff']:.4f} "
+                         f"> tolerance {args.tolerance}")
+    logger.info("Parity check passed.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+import os
+import logging
+import contextlib
+import multiprocessing as mp
+from typing import List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Number of encoder processes (0/1 = encode in the calling process) and torch threads per process
+ENCODING_WORKERS = int(os.environ.get('MATCHER_ENCODING_WORKERS', '0'))
+THREADS_PER_WORKER = int(os.environ.get('MATCHER_THREADS_PER_WORKER', '2'))
+
+_worker_model = None
+_worker_batch_size = 64
+
+
+def _init_worker(model_name: str, backend: Optional[str], threads: int, batch_size: int) -> None:
+    """Load one model copy per worker process, pinned to a fixed number of threads."""
+    global _worker_model, _worker_batch_size
+    import torch
+    from encoder_backend import load_encoder
+
+    torch.set_num_threads(threads)
+    _worker_model = load_encoder(model_name, backend)
+    _worker_batch_size = batch_size
+
+
+def _encode_shard(task):
+    from text_encoding import encode_texts
+
+    start, texts = task
+    embeddings = encode_texts(texts, _worker_model, batch_size=_worker_batch_size,
+                              normalize_embeddings=True, show_progress_bar=False)
+    return start, embeddings
+
+
+class EncodingPool:
+    """
+    Pool of encoder processes for large corpora.
+
+    Each worker holds its own model copy and a fixed torch thread count, so a
+    many-core box is used by processes rather than by intra-op threads alone.
+    Texts are sharded, shards are encoded in any order and written back into
+    one preallocated float32 array at their original offsets.
+    """
+
+    def __init__(self, model_name: str, backend: Optional[str] = None, workers: Optional[int] = None,
+                 threads_per_worker: int = THREADS_PER_WORKER, shard_size: int = 512,
+                 batch_size: int = 64):
+        self.model_name = model_name
+        self.backend = backend
+        self.workers = workers or ENCODING_WORKERS or max(os.cpu_count() // threads_per_worker, 1)
+        self.threads_per_worker = threads_per_worker
+        self.shard_size = shard_size
+        self.batch_size = batch_size
+        self._pool = None
+
+    def _start(self) -> None:
+        # Started lazily: a fully cached run never pays for loading the worker models
+        ctx = mp.get_context('spawn')  # torch is not fork-safe once initialised
+        logger.info(f"Starting encoding pool: {self.workers} workers x {self.threads_per_worker} threads "
+                    f"({self.model_name})")
+        # Spawned workers re-import __main__ (and with it torch) before the initializer runs, so the
+        # thread-pool variables must already be in the environment they inherit at start
+        worker_env = {
+            'OMP_NUM_THREADS': str(self.threads_per_worker),
+            'MKL_NUM_THREADS': str(self.threads_per_worker),
+            'TOKENIZERS_PARALLELISM': 'false',
+        }
+        saved_env = {name: os.environ.get(name) for name in worker_env}
+        os.environ.update(worker_env)
+        try:
+            self._pool = ctx.Pool(
+                processes=self.workers,
+                initializer=_init_worker,
+                initargs=(self.model_name, self.backend, self.threads_per_worker, self.batch_size),
+            )
+        finally:
+            for name, value in saved_env.items():
+                if value is None:
+                    os.environ.pop(name, None)
+                else:
+                    os.environ[name] = value
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def close(self) -> None:
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        """Encode texts across the pool; returns L2-normalized float32 embeddings in input order."""
+        texts = ['' if t is None else str(t) for t in texts]
+        tasks = [(start, texts[start:start + self.shard_size])
+                 for start in range(0, len(texts), self.shard_size)]
+        if not tasks:
+            return np.empty((0, 0), dtype=np.float32)
+        if self._pool is None:
+            self._start()
+        embeddings = None
+        done = 0
+        for start, shard in self._pool.imap_unordered(_encode_shard, tasks):
+            if embeddings is None:
+                embeddings = np.empty((len(texts), shard.shape[1]), dtype=np.float32)
+            embeddings[start:start + len(shard)] = shard
+            done += len(shard)
+            logger.info(f"Encoded {done}/{len(texts)} texts")
+        return embeddings
+
+
+def encoding_pool(model_name: str, backend: Optional[str] = None, workers: Optional[int] = None):
+    """
+    Context manager yielding an EncodingPool, or None when multi-process
+    encoding is disabled (workers <= 1), so callers can fall back to the
+    in-process model.
+    """
+    workers = ENCODING_WORKERS if workers is None else workers
+    if workers <= 1:
+        return contextlib.nullcontext(None)
+    return EncodingPool(model_name, backend, workers)
@@ -0,0 +1,178 @@
+import logging
+from typing import Dict, List, Tuple, Union
+
+import numpy as np
+
+from compact_store import CompactEmbeddingStore
+
+logger = logging.getLogger(__name__)
+
+
+class EnsembleScorer:
+    """
+    Scores (buyer, seller) pairs with several embedding models at once.
+
+    The L2-normalized embeddings of every model are stacked column-wise into
+    one buyer and one seller matrix. A block of pairs is then scored for all
+    models with a single gather and element-wise product, summed per model
+    segment with np.add.reduceat, so adding a model adds encode cost and
+    matrix width but no extra Python passes over the pairs. The stacked
+    matrices can be held as float16 (dtype) to halve their memory; scores are
+    always accumulated in float32.
+
+    Models can instead be added with a CompactEmbeddingStore per model
+    (add_store): the stacked seller matrix is then made of the stores'
+    compact vectors (float16, int8 or PCA, one mode for all models), and
+    threshold_scores() rescores the pairs near the threshold exactly from
+    the stores' memory-mapped full-precision vectors.
+    """
+
+    def __init__(self, dtype=np.float32):
+        self.dtype = np.dtype(dtype)
+        self.model_names: List[str] = []
+        self._buyer_parts: List[np.ndarray] = []
+        self._seller_parts: List[np.ndarray] = []
+        self._buyers = None
+        self._sellers = None
+        self.offsets = np.zeros(1, dtype=np.int64)
+        # Store-backed models: full-precision buyer vectors and per-buyer score offsets (PCA mean term)
+        self.stores: List[CompactEmbeddingStore] = []
+        self._full_buyers: List[np.ndarray] = []
+        self._query_offsets: List[np.ndarray] = []
+        self._offset_matrix = None
+
+    def _check_aligned(self, name: str, n_buyers: int, n_sellers: int) -> None:
+        if self._buyer_parts and (n_buyers != len(self._buyer_parts[0]) or n_sellers != len(self._seller_parts[0])):
+            raise ValueError(f"Embeddings of model {name} are not aligned with the other models")
+
+    def add_model(self, name: str, buyer_embeddings: np.ndarray, seller_embeddings: np.ndarray) -> None:
+        """Register one model's buyer and seller embeddings (rows aligned with the other models)."""
+        if self.stores:
+            raise ValueError("Cannot mix in-memory models with store-backed models in one ensemble")
+        buyer_embeddings = np.asarray(buyer_embeddings, dtype=np.float32)
+        seller_embeddings = np.asarray(seller_embeddings, dtype=np.float32)
+        self._check_aligned(name, len(buyer_embeddings), len(seller_embeddings))
+        if buyer_embeddings.shape[1] != seller_embeddings.shape[1]:
+            raise ValueError(f"Buyer and seller dimensions differ for model {name}")
+        self.model_names.append(name)
+        self._buyer_parts.append(buyer_embeddings)
+        self._seller_parts.append(seller_embeddings)
+        self.offsets = np.append(self.offsets, self.offsets[-1] + buyer_embeddings.shape[1])
+        self._buyers = self._sellers = None
+
+    def add_store(self, name: str, buyer_embeddings: np.ndarray, store: CompactEmbeddingStore) -> None:
+        """Register one model's buyer embeddings and its seller CompactEmbeddingStore."""
+        if self.model_names and not self.stores:
+            raise ValueError("Cannot mix store-backed models with in-memory models in one ensemble")
+        if self.stores and store.mode != self.stores[0].mode:
+            raise ValueError(f"Store of model {name} uses mode '{store.mode}', "
+                             f"the ensemble uses '{self.stores[0].mode}'")
+        buyer_embeddings = np.asarray(buyer_embeddings, dtype=np.float32)
+        self._check_aligned(name, len(buyer_embeddings), len(store))
+        if buyer_embeddings.shape[1] != store.dimension:
+            raise ValueError(f"Buyer and seller dimensions differ for model {name}")
+        transformed, offset = store._transform_queries(buyer_embeddings)
+        self.model_names.append(name)
+        self.stores.append(store)
+        self._full_buyers.append(buyer_embeddings)
+        self._query_offsets.append(np.zeros(len(buyer_embeddings), dtype=np.float32) if offset is None
+                                   else np.asarray(offset, dtype=np.float32))
+        self._buyer_parts.append(np.asarray(transformed, dtype=np.float32))
+        self._seller_parts.append(store.compact)
+        self.offsets = np.append(self.offsets, self.offsets[-1] + store.compact.shape[1])
+        self._buyers = self._sellers = None
+
+    @property
+    def exact(self) -> bool:
+        """Whether pair_scores() are exact (no compact approximation involved)."""
+        if self.stores:
+            return self.stores[0].mode == 'float32'
+        return self.dtype == np.float32
+
+    def _stack(self) -> None:
+        if self._buyers is None:
+            if self.stores:
+                # Buyers stay float32; sellers keep the stores' compact dtype
+                self._buyers = np.hstack(self._buyer_parts)
+                self._sellers = np.hstack(self._seller_parts)
+                self._offset_matrix = np.column_stack(self._query_offsets)
+            else:
+                self._buyers = np.hstack(self._buyer_parts).astype(self.dtype, copy=False)
+                self._sellers = np.hstack(self._seller_parts).astype(self.dtype, copy=False)
+            # The stacked copies replace the per-model arrays
+            self._buyer_parts = [self._buyers[:, a:b] for a, b in zip(self.offsets[:-1], self.offsets[1:])]
+            self._seller_parts = [self._sellers[:, a:b] for a, b in zip(self.offsets[:-1], self.offsets[1:])]
+            logger.info(f"Ensemble of {len(self.model_names)} models: {self._buyers.shape[0]} buyers x "
+                        f"{self._sellers.shape[0]} sellers, {self._buyers.shape[1]} stacked dimensions "
+                        f"({self._sellers.dtype.name} sellers, "
+                        f"{(self._buyers.nbytes + self._sellers.nbytes) / 2**20:.1f} MB)")
+
+    def pair_scores(self, buyer_idx: np.ndarray, seller_idx: np.ndarray, block_size: int = 65536) -> np.ndarray:
+        """
+        Cosine similarity of every pair under every model: a (n_pairs, n_models)
+        float32 array. Approximate when the stacked matrices are compact.
+        """
+        if not self.model_names:
+            raise ValueError("No models added to the ensemble")
+        self._stack()
+        buyer_idx = np.asarray(buyer_idx, dtype=np.int64)
+        seller_idx = np.asarray(seller_idx, dtype=np.int64)
+        scores = np.empty((len(buyer_idx), len(self.model_names)), dtype=np.float32)
+        for start in range(0, len(buyer_idx), block_size):
+            block_buyers = buyer_idx[start:start + block_size]
+            buyers = self._buyers[block_buyers].astype(np.float32, copy=False)
+            sellers = self._sellers[seller_idx[start:start + block_size]].astype(np.float32, copy=False)
+            products = buyers * sellers
+            scores[start:start + len(products)] = np.add.reduceat(products, self.offsets[:-1], axis=1)
+            if self.stores:
+                scores[start:start + len(products)] += self._offset_matrix[block_buyers]
+        return scores
+
+    def exact_pair_scores(self, buyer_idx: np.ndarray, seller_idx: np.ndarray,
+                          block_size: int = 65536) -> np.ndarray:
+        """Full-precision scores of the pairs under every store-backed model, read from the stores' files."""
+        if not self.stores:
+            return self.pair_scores(buyer_idx, seller_idx, block_size)
+        buyer_idx = np.asarray(buyer_idx, dtype=np.int64)
+        seller_idx = np.asarray(seller_idx, dtype=np.int64)
+        scores = np.empty((len(buyer_idx), len(self.model_names)), dtype=np.float32)
+        for col, (store, buyers) in enumerate(zip(self.stores, self._full_buyers)):
+            for start in range(0, len(buyer_idx), block_size):
+                b = buyer_idx[start:start + block_size]
+                s = seller_idx[start:start + block_size]
+                order = np.argsort(s, kind='stable')  # read the memory-mapped rows in file order
+                full = np.asarray(store.full[s[order]], dtype=np.float32)
+                scores[start + order, col] = np.einsum('ij,ij->i', buyers[b[order]], full)
+        return scores
+
+    def _thresholds(self, threshold: Union[float, Dict[str, float]]) -> Union[float, np.ndarray]:
+        if isinstance(threshold, dict):
+            return np.array([threshold[name] for name in self.model_names], dtype=np.float32)
+        return threshold
+
+    def votes(self, scores: np.ndarray, threshold: Union[float, Dict[str, float]]) -> np.ndarray:
+        """Per-model boolean votes; threshold is one value or a per-model dict."""
+        return scores >= self._thresholds(threshold)
+
+    def threshold_scores(self, buyer_idx: np.ndarray, seller_idx: np.ndarray,
+                         threshold: Union[float, Dict[str, float]], margin: float = 0.02,
+                         block_size: int = 65536) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        (scores, votes) of every pair under every model. With compact stores,
+        pairs whose approximate score is within `margin` of the threshold for
+        any model are rescored exactly for all models, so every pair with a
+        vote carries exact scores, as in CompactEmbeddingStore.pair_matches.
+        """
+        scores = self.pair_scores(buyer_idx, seller_idx, block_size)
+        if self.exact or not self.stores:
+            return scores, self.votes(scores, threshold)
+
+        thresholds = self._thresholds(threshold)
+        candidates = np.flatnonzero((scores >= np.asarray(thresholds) - margin).any(axis=1))
+        scores[candidates] = self.exact_pair_scores(np.asarray(buyer_idx)[candidates],
+                                                    np.asarray(seller_idx)[candidates], block_size)
+        votes = np.zeros(scores.shape, dtype=bool)
+        votes[candidates] = scores[candidates] >= thresholds
+        logger.info(f"Rescored {len(candidates)} of {len(scores)} pairs exactly "
+                    f"({self.stores[0].mode} stores, margin {margin})")
+        return scores, votes
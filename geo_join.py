@@ -0,0 +1,60 @@
+import logging
+from typing import Optional, Tuple
+
+import numpy as np
+from sklearn.neighbors import BallTree
+
+logger = logging.getLogger(__name__)
+
+EARTH_RADIUS_KM = 6371.0
+
+
+def haversine_km(lat1, lon1, lat2, lon2) -> np.ndarray:
+    """Great-circle distance in km between coordinate arrays given in degrees (broadcasting)."""
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(v, dtype=np.float64)) for v in (lat1, lon1, lat2, lon2))
+    a = (np.sin((lat2 - lat1) / 2) ** 2
+         + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def build_tree(coords_deg: np.ndarray) -> BallTree:
+    """BallTree over (lat, lon) coordinates in degrees, using the haversine metric."""
+    return BallTree(np.radians(np.asarray(coords_deg, dtype=np.float64)), metric='haversine')
+
+
+def radius_join(buyer_coords: np.ndarray, seller_coords: np.ndarray, radius_km: float,
+                tree: Optional[BallTree] = None,
+                chunk_size: int = 4096) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    All (buyer, seller) pairs within radius_km of each other.
+
+    Buyer coordinates are queried against the seller tree in batched
+    query_radius calls (chunk_size buyers at a time) and the hits are
+    flattened into (buyer_idx, seller_idx, distance_km) arrays, ordered by
+    buyer and then by seller. Coordinates are (lat, lon) in degrees.
+    """
+    buyer_coords = np.asarray(buyer_coords, dtype=np.float64).reshape(-1, 2)
+    seller_coords = np.asarray(seller_coords, dtype=np.float64).reshape(-1, 2)
+    if len(buyer_coords) == 0 or len(seller_coords) == 0:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty, np.empty(0, dtype=np.float64)
+
+    tree = tree or build_tree(seller_coords)
+    radius_rad = radius_km / EARTH_RADIUS_KM
+
+    buyer_parts, seller_parts = [], []
+    for start in range(0, len(buyer_coords), chunk_size):
+        chunk = np.radians(buyer_coords[start:start + chunk_size])
+        hits = tree.query_radius(chunk, r=radius_rad)
+        counts = np.fromiter((len(h) for h in hits), dtype=np.int64, count=len(hits))
+        buyer_parts.append(np.repeat(np.arange(start, start + len(chunk)), counts))
+        seller_parts.append(np.concatenate([np.sort(h) for h in hits]).astype(np.int64))
+
+    buyer_idx = np.concatenate(buyer_parts)
+    seller_idx = np.concatenate(seller_parts)
+    distances = haversine_km(buyer_coords[buyer_idx, 0], buyer_coords[buyer_idx, 1],
+                             seller_coords[seller_idx, 0], seller_coords[seller_idx, 1])
+    logger.info(f"Radius join ({radius_km} km): {len(buyer_idx)} candidate pairs "
+                f"for {len(buyer_coords)} buyers x {len(seller_coords)} sellers")
+    return buyer_idx, seller_idx, distances
+
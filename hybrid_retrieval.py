@@ -0,0 +1,184 @@
+import os
+import re
+import logging
+from collections import Counter
+from typing import Callable, List, Optional, Tuple
+
+import numpy as np
+from scipy import sparse
+from rank_bm25 import BM25Okapi
+
+from matching_engine import blocked_matches, pair_scores
+
+logger = logging.getLogger(__name__)
+
+TOKEN_PATTERN = re.compile(r'[0-9a-zäöüß]+')
+
+# Set MATCHER_HYBRID=1 to generate the batch matchers' candidates with BM25 + dense fusion
+HYBRID_ENABLED = os.environ.get('MATCHER_HYBRID', '0') == '1'
+# Fused candidates per buyer in hybrid mode
+HYBRID_CANDIDATES = int(os.environ.get('MATCHER_HYBRID_CANDIDATES', '300'))
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased word tokens of a (normalized) listing text."""
+    if not text:
+        return []
+    return TOKEN_PATTERN.findall(str(text).lower())
+
+
+def reciprocal_rank_fusion(rankings: List[Tuple[np.ndarray, np.ndarray]], n_items: int,
+                           k: int = 60, top_n: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Fuse several ranked candidate lists with reciprocal rank fusion.
+
+    Each ranking is a pair of flat (query_idx, item_idx) arrays ordered by
+    query and then by rank, as returned by blocked_matches in top-k mode.
+    An item scores sum(1 / (k + rank)) over the lists it appears in.
+    Returns flat (query_idx, item_idx, rrf_score) arrays ordered by query and
+    descending fused score, cut to top_n items per query.
+    """
+    query_parts, item_parts, score_parts = [], [], []
+    for query_idx, item_idx in rankings:
+        query_idx = np.asarray(query_idx, dtype=np.int64)
+        if len(query_idx) == 0:
+            continue
+        # Rank within each query's run of results (1-based)
+        run_starts = np.flatnonzero(np.r_[True, query_idx[1:] != query_idx[:-1]])
+        run_lengths = np.diff(np.r_[run_starts, len(query_idx)])
+        ranks = np.arange(len(query_idx)) - np.repeat(run_starts, run_lengths) + 1
+        query_parts.append(query_idx)
+        item_parts.append(np.asarray(item_idx, dtype=np.int64))
+        score_parts.append(1.0 / (k + ranks))
+
+    if not query_parts:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty, np.empty(0, dtype=np.float64)
+
+    pair_keys = np.concatenate(query_parts) * n_items + np.concatenate(item_parts)
+    keys, inverse = np.unique(pair_keys, return_inverse=True)
+    fused = np.bincount(inverse, weights=np.concatenate(score_parts))
+    query_idx, item_idx = keys // n_items, keys % n_items
+
+    order = np.lexsort((item_idx, -fused, query_idx))
+    query_idx, item_idx, fused = query_idx[order], item_idx[order], fused[order]
+    if top_n is not None:
+        run_starts = np.flatnonzero(np.r_[True, query_idx[1:] != query_idx[:-1]])
+        run_lengths = np.diff(np.r_[run_starts, len(query_idx)])
+        position = np.arange(len(query_idx)) - np.repeat(run_starts, run_lengths)
+        keep = position < top_n
+        query_idx, item_idx, fused = query_idx[keep], item_idx[keep], fused[keep]
+    return query_idx, item_idx, fused
+
+
+class HybridRetriever:
+    """
+    Candidate generation from a lexical BM25 index and dense embeddings.
+
+    BM25 statistics (idf, document lengths) come from rank_bm25's Okapi
+    implementation; the per-document term weights are precomputed into a
+    sparse seller x term matrix so a whole block of buyer queries is scored
+    with one sparse product instead of a Python pass over the corpus per
+    query term. The lexical and dense top-N lists are fused with reciprocal
+    rank fusion into one candidate list per buyer.
+    """
+
+    def __init__(self, seller_texts: List[str], seller_embeddings: np.ndarray,
+                 tokenizer: Callable[[str], List[str]] = tokenize, k1: float = 1.5, b: float = 0.75):
+        self.tokenizer = tokenizer
+        self.seller_embeddings = np.asarray(seller_embeddings, dtype=np.float32)
+        self.n_sellers = len(seller_texts)
+        if self.n_sellers != len(self.seller_embeddings):
+            raise ValueError(f"{self.n_sellers} seller texts but {len(self.seller_embeddings)} embeddings")
+
+        corpus = [self.tokenizer(text) for text in seller_texts]
+        self.vocabulary = {}
+        self.bm25_matrix = sparse.csr_matrix((self.n_sellers, 0), dtype=np.float32)
+        if any(corpus):
+            self._build_bm25(corpus, k1, b)
+        logger.info(f"Hybrid retriever: {self.n_sellers} sellers, {len(self.vocabulary)} terms")
+
+    def _build_bm25(self, corpus: List[List[str]], k1: float, b: float) -> None:
+        # rank_bm25 rejects an empty document list but handles empty documents
+        bm25 = BM25Okapi(corpus, k1=k1, b=b)
+        self.vocabulary = {term: col for col, term in enumerate(bm25.idf)}
+        idf = np.array(list(bm25.idf.values()), dtype=np.float32)
+
+        rows, cols, tfs = [], [], []
+        for row, freqs in enumerate(bm25.doc_freqs):
+            rows.extend([row] * len(freqs))
+            cols.extend(self.vocabulary[term] for term in freqs)
+            tfs.extend(freqs.values())
+        rows = np.asarray(rows, dtype=np.int64)
+        cols = np.asarray(cols, dtype=np.int64)
+        tfs = np.asarray(tfs, dtype=np.float32)
+
+        doc_len = np.asarray(bm25.doc_len, dtype=np.float32)
+        norm = k1 * (1 - b + b * doc_len / bm25.avgdl)
+        weights = idf[cols] * tfs * (k1 + 1) / (tfs + norm[rows])
+        self.bm25_matrix = sparse.csr_matrix((weights, (rows, cols)),
+                                             shape=(self.n_sellers, len(self.vocabulary)), dtype=np.float32)
+
+    def query_matrix(self, texts: List[str]) -> sparse.csr_matrix:
+        """Sparse query x term count matrix; terms unknown to the seller corpus are dropped."""
+        rows, cols, counts = [], [], []
+        for row, text in enumerate(texts):
+            for term, count in Counter(self.tokenizer(text)).items():
+                col = self.vocabulary.get(term)
+                if col is not None:
+                    rows.append(row)
+                    cols.append(col)
+                    counts.append(count)
+        return sparse.csr_matrix((counts, (rows, cols)), shape=(len(texts), len(self.vocabulary)),
+                                 dtype=np.float32)
+
+    def lexical_search(self, texts: List[str], top_n: int = 200) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """BM25 top-n sellers per query text (only sellers sharing at least one term)."""
+        if not self.vocabulary:
+            empty = np.empty(0, dtype=np.int64)
+            return empty, empty, np.empty(0, dtype=np.float32)
+        return blocked_matches(self.query_matrix(texts), self.bm25_matrix, top_k=top_n, threshold=1e-6)
+
+    def dense_search(self, embeddings: np.ndarray, top_n: int = 200) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Cosine top-n sellers per normalized query embedding."""
+        return blocked_matches(embeddings, self.seller_embeddings, top_k=top_n)
+
+    def retrieve(self, texts: List[str], embeddings: np.ndarray, n_lexical: int = 200, n_dense: int = 200,
+                 top_n: int = 300, rrf_k: int = 60) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Fused candidates per buyer: flat (buyer_idx, seller_idx, rrf_score)
+        arrays ordered by buyer and descending fused score.
+        """
+        lexical_buyers, lexical_sellers, _ = self.lexical_search(texts, n_lexical)
+        dense_buyers, dense_sellers, _ = self.dense_search(embeddings, n_dense)
+        buyer_idx, seller_idx, fused = reciprocal_rank_fusion(
+            [(lexical_buyers, lexical_sellers), (dense_buyers, dense_sellers)],
+            self.n_sellers, k=rrf_k, top_n=top_n,
+        )
+        logger.info(f"Hybrid retrieval: {len(lexical_buyers)} lexical + {len(dense_buyers)} dense hits "
+                    f"fused into {len(buyer_idx)} candidates for {len(texts)} buyers")
+        return buyer_idx, seller_idx, fused
+
+    def candidate_matches(self, texts: List[str], embeddings: np.ndarray, threshold: Optional[float] = None,
+                          top_k: Optional[int] = None,
+                          top_n: int = HYBRID_CANDIDATES) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Drop-in for blocked_matches over the fused candidates only: flat
+        (buyer_idx, seller_idx, cosine score) arrays ordered by buyer and
+        descending score, filtered by threshold and cut to top_k per buyer.
+        """
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        buyer_idx, seller_idx, _ = self.retrieve(texts, embeddings, n_lexical=top_n, n_dense=top_n, top_n=top_n)
+        scores = pair_scores(embeddings, self.seller_embeddings, buyer_idx, seller_idx)
+        if threshold is not None:
+            keep = scores >= threshold
+            buyer_idx, seller_idx, scores = buyer_idx[keep], seller_idx[keep], scores[keep]
+
+        order = np.lexsort((seller_idx, -scores, buyer_idx))
+        buyer_idx, seller_idx, scores = buyer_idx[order], seller_idx[order], scores[order]
+        if top_k is not None and len(buyer_idx):
+            run_starts = np.flatnonzero(np.r_[True, buyer_idx[1:] != buyer_idx[:-1]])
+            run_lengths = np.diff(np.r_[run_starts, len(buyer_idx)])
+            keep = np.arange(len(buyer_idx)) - np.repeat(run_starts, run_lengths) < top_k
+            buyer_idx, seller_idx, scores = buyer_idx[keep], seller_idx[keep], scores[keep]
+        return buyer_idx, seller_idx, scores
@@ -0,0 +1,193 @@
+import io
+import os
+import re
+import pickle
+import hashlib
+import logging
+from typing import Dict, Iterable, List, Optional, Set
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from category_tagger import AhoCorasick
+from embedding_cache import DEFAULT_CACHE_DIR, slug
+
+logger = logging.getLogger(__name__)
+
+LEXICON_CACHE_DIR = os.path.join(DEFAULT_CACHE_DIR, 'lexicon')
+# Bump when the compiled format or the variant rules change
+LEXICON_VERSION = 'v1'
+
+UMLAUTS = str.maketrans({'ä': 'ae', 'ö': 'oe', 'ü': 'ue', 'ß': 'ss'})
+
+
+def normalize_term(term: str) -> str:
+    """Lowercase a keyword/synonym and collapse its whitespace."""
+    return re.sub(r'\s+', ' ', str(term).lower()).strip()
+
+
+def term_variants(term: str) -> Set[str]:
+    """Spelling variants of a normalized term: umlaut folding and joined/split hyphen compounds."""
+    variants = {term, term.translate(UMLAUTS)}
+    for variant in list(variants):
+        # Only hyphens inside a compound (kfz-werkstatt), not elisions (bau- und gartenmarkt)
+        variants.add(re.sub(r'(?<=\w)-(?=\w)', ' ', variant))
+        variants.add(re.sub(r'(?<=\w)-(?=\w)', '', variant))
+    return variants
+
+
+def _is_word_char(char: str) -> bool:
+    return char.isalnum() or char == '_'
+
+
+def _is_boundary(text: str, position: int) -> bool:
+    """Same test as the regex \\b at position."""
+    before = position > 0 and _is_word_char(text[position - 1])
+    after = position < len(text) and _is_word_char(text[position])
+    return before != after
+
+
+class Lexicon:
+    """
+    Keyword/synonym lexicon compiled from a keyword CSV.
+
+    Every row of the CSV is one keyword with its 'Synonym N' columns. All
+    terms are normalized, expanded with spelling variants (and German
+    Snowball stems when stem=True) and compiled into one Aho-Corasick
+    automaton, so a text is tagged with all its keywords in a single pass.
+    Lexicon.load() pickles the compiled lexicon under the sha1 of the CSV
+    bytes; later runs load it from disk instead of re-parsing the CSV.
+    Keywords are identified by their row position (ids index `names`).
+    All 'Synonym N' columns are read unless max_synonyms limits N.
+    """
+
+    def __init__(self, keywords_df: pd.DataFrame, stem: bool = False, max_synonyms: Optional[int] = None):
+        if 'Keyword' not in keywords_df.columns:
+            raise ValueError("Keywords CSV is missing required columns.")
+        synonym_columns = [col for col in keywords_df.columns if re.fullmatch(r'Synonym \d+', str(col))
+                           and (max_synonyms is None or int(str(col).split()[1]) <= max_synonyms)]
+
+        # Keyed by lowercased keyword; a repeated keyword replaces the earlier row's synonyms
+        rows: Dict[str, Dict] = {}
+        for record in keywords_df[['Keyword'] + synonym_columns].to_dict('records'):
+            keyword = record['Keyword']
+            if pd.isna(keyword):
+                continue
+            terms = [normalize_term(record[col]) for col in ['Keyword'] + synonym_columns if pd.notna(record[col])]
+            rows[str(keyword).lower()] = {'synonyms': {term for term in terms if term}, 'original': keyword}
+
+        self.keys: List[str] = list(rows)
+        self.names: List[str] = [data['original'] for data in rows.values()]
+        self.synonyms: List[Set[str]] = [data['synonyms'] for data in rows.values()]
+        self.stem = stem
+
+        stemmer = None
+        if stem:
+            from nltk.stem import SnowballStemmer
+            stemmer = SnowballStemmer('german')
+
+        # Every distinct term string maps to all keywords that list it
+        term_keywords: Dict[str, Set[int]] = {}
+        for keyword_id, terms in enumerate(self.synonyms):
+            for term in terms:
+                variants = term_variants(term)
+                if stemmer is not None:
+                    variants |= {' '.join(stemmer.stem(word) for word in variant.split()) for variant in variants}
+                for variant in variants:
+                    term_keywords.setdefault(variant, set()).add(keyword_id)
+        self.terms: List[str] = list(term_keywords)
+        self.term_keywords: List[frozenset] = [frozenset(term_keywords[term]) for term in self.terms]
+        self.term_ids: Dict[str, frozenset] = dict(zip(self.terms, self.term_keywords))
+        self.automaton = AhoCorasick(self.terms)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    @property
+    def keyword_synonyms(self) -> Dict[str, Dict]:
+        """The matchers' {keyword: {'synonyms': set, 'original': str}} dict."""
+        return {key: {'synonyms': set(terms), 'original': name}
+                for key, name, terms in zip(self.keys, self.names, self.synonyms)}
+
+    @classmethod
+    def load(cls, csv_path: str, stem: bool = False, cache_dir: str = LEXICON_CACHE_DIR,
+             max_synonyms: Optional[int] = None) -> 'Lexicon':
+        """Compiled lexicon of a keyword CSV file, from the on-disk cache when the CSV is unchanged."""
+        with open(csv_path, 'rb') as f:
+            data = f.read()
+        name = os.path.splitext(os.path.basename(csv_path))[0]
+        return cls._load_cached(name, data, stem, cache_dir, max_synonyms)
+
+    @classmethod
+    def from_csv_text(cls, csv_text: str, name: str = 'inline', stem: bool = False,
+                      cache_dir: str = LEXICON_CACHE_DIR, max_synonyms: Optional[int] = None) -> 'Lexicon':
+        """Compiled lexicon of keyword CSV content held in a string."""
+        return cls._load_cached(name, csv_text.strip().encode('utf-8'), stem, cache_dir, max_synonyms)
+
+    @classmethod
+    def _load_cached(cls, name: str, data: bytes, stem: bool, cache_dir: str,
+                     max_synonyms: Optional[int] = None) -> 'Lexicon':
+        digest = hashlib.sha1(data).hexdigest()[:16]
+        path = None
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+            suffix = ('-stem' if stem else '') + (f'-syn{max_synonyms}' if max_synonyms is not None else '')
+            path = os.path.join(cache_dir, f"{slug(name)}-{digest}-{LEXICON_VERSION}{suffix}.pkl")
+            if os.path.exists(path):
+                try:
+                    with open(path, 'rb') as f:
+                        lexicon = pickle.load(f)
+                    logger.info(f"Loaded lexicon {name} from cache: {len(lexicon)} keywords, "
+                                f"{len(lexicon.terms)} terms")
+                    return lexicon
+                except Exception as e:
+                    logger.warning(f"Error loading cached lexicon {path}: {e}; recompiling")
+
+        lexicon = cls(pd.read_csv(io.BytesIO(data)), stem=stem, max_synonyms=max_synonyms)
+        logger.info(f"Compiled lexicon {name}: {len(lexicon)} keywords, {len(lexicon.terms)} terms")
+        if path:
+            tmp_path = path + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(lexicon, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+        return lexicon
+
+    def tag(self, texts: Iterable[str], whole_words: bool = False) -> List[Set[int]]:
+        """
+        Keyword ids found in every text (lowercased; NaN/None give an empty set).
+
+        By default a term matches anywhere in the text, like `synonym in text`;
+        with whole_words=True only at word boundaries, like r'\\bterm\\b'.
+        """
+        texts = ['' if text is None or pd.isna(text) else str(text).lower() for text in texts]
+        found: Dict[str, Set[int]] = {}
+        for text in texts:
+            if text in found:
+                continue
+            ids = set()
+            if whole_words:
+                for start, end, term_id in self.automaton.find_spans(text):
+                    if _is_boundary(text, start) and _is_boundary(text, end):
+                        ids |= self.term_keywords[term_id]
+            else:
+                for term_id in self.automaton.find(text):
+                    ids |= self.term_keywords[term_id]
+            found[text] = ids
+        return [set(found[text]) for text in texts]
+
+    def tag_tokens(self, tokens: Iterable[str]) -> Set[int]:
+        """Keyword ids with a term equal to one of the tokens."""
+        ids = set()
+        for token in tokens:
+            ids |= self.term_ids.get(token, frozenset())
+        return ids
+
+    def hit_matrix(self, texts: Iterable[str], whole_words: bool = False) -> sparse.csr_matrix:
+        """Binary text x keyword matrix of tag()."""
+        tags = self.tag(texts, whole_words=whole_words)
+        rows = np.repeat(np.arange(len(tags)), [len(ids) for ids in tags])
+        cols = np.fromiter((keyword_id for ids in tags for keyword_id in sorted(ids)), dtype=np.int64,
+                           count=len(rows))
+        return sparse.csr_matrix((np.ones(len(rows), dtype=np.float32), (rows, cols)),
+                                 shape=(len(tags), len(self.names)))
@@ -0,0 +1,166 @@
+import os
+import json
+import logging
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from embedding_cache import text_hash, slug
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_STATE_DIR = './match_state'
+
+MATCH_COLUMNS = ['buyer_key', 'seller_key', 'score', 'stale', 'scored_at']
+
+
+def record_keys(df: pd.DataFrame, key_column: Optional[str] = None) -> np.ndarray:
+    """
+    Stable identity of each record: the value of key_column (e.g. the
+    listing url) where present, else a hash of the whole row. Repeated keys
+    get an occurrence suffix so every row has a unique key.
+    """
+    row_hashes = pd.Series([text_hash('|'.join(map(str, row))) for row in df.itertuples(index=False)],
+                           index=df.index)
+    if key_column and key_column in df.columns:
+        keys = df[key_column].where(df[key_column].notna(), row_hashes).astype(str)
+    else:
+        keys = row_hashes
+    occurrence = keys.groupby(keys).cumcount()
+    keys = keys.where(occurrence == 0, keys + '#' + occurrence.astype(str))
+    return keys.to_numpy(dtype=object)
+
+
+class StateDelta:
+    """What changed between the persisted state and the current snapshot."""
+
+    def __init__(self, new_buyers: np.ndarray, new_sellers: np.ndarray,
+                 removed_buyers: set, removed_sellers: set, full: bool):
+        self.new_buyers = new_buyers          # mask: buyer rows that are new or changed
+        self.new_sellers = new_sellers        # mask: seller rows that are new or changed
+        self.removed_buyers = removed_buyers  # keys no longer in the snapshot
+        self.removed_sellers = removed_sellers
+        self.full = full                      # no usable state: everything is recomputed
+
+    def summary(self) -> Dict[str, int]:
+        return {
+            'new_buyers': int(self.new_buyers.sum()),
+            'new_sellers': int(self.new_sellers.sum()),
+            'removed_buyers': len(self.removed_buyers),
+            'removed_sellers': len(self.removed_sellers),
+        }
+
+
+class MatchState:
+    """
+    Persisted match results of one matcher plus the record versions they
+    were scored with.
+
+    Records are identified by a key and versioned by a hash of the text
+    that is scored. A re-run only needs to score (new/changed buyers x all
+    sellers) and (all other buyers x new/changed sellers); pairs involving
+    records that disappeared from the snapshot are kept but marked stale.
+    The state is tied to a config (model, threshold, ...): when the config
+    changes, everything is recomputed.
+    """
+
+    def __init__(self, name: str, config: Dict, state_dir: str = DEFAULT_STATE_DIR):
+        self.directory = os.path.join(state_dir, slug(name))
+        self.config = json.loads(json.dumps(config))  # normalize for comparison with the saved config
+        os.makedirs(self.directory, exist_ok=True)
+        self.versions_path = os.path.join(self.directory, 'versions.json')
+        self.matches_path = os.path.join(self.directory, 'matches.csv')
+
+        self.buyer_versions: Dict[str, str] = {}
+        self.seller_versions: Dict[str, str] = {}
+        self.matches = pd.DataFrame(columns=MATCH_COLUMNS)
+        self.valid = False
+        self._load()
+
+    def _load(self) -> None:
+        if not (os.path.exists(self.versions_path) and os.path.exists(self.matches_path)):
+            logger.info(f"No match state in {self.directory}, starting from scratch")
+            return
+        try:
+            with open(self.versions_path) as f:
+                saved = json.load(f)
+            if saved.get('config') != self.config:
+                logger.info(f"Match state config changed ({saved.get('config')} -> {self.config}), recomputing all")
+                return
+            self.buyer_versions = saved['buyers']
+            self.seller_versions = saved['sellers']
+            self.matches = pd.read_csv(self.matches_path, dtype={'buyer_key': str, 'seller_key': str})
+            self.valid = True
+            logger.info(f"Loaded match state: {len(self.buyer_versions)} buyers, {len(self.seller_versions)} sellers, "
+                        f"{len(self.matches)} scored pairs")
+        except Exception as e:
+            logger.error(f"Error loading match state from {self.directory}: {e}; recomputing all")
+            self.buyer_versions, self.seller_versions = {}, {}
+            self.matches = pd.DataFrame(columns=MATCH_COLUMNS)
+
+    def diff(self, buyer_keys: np.ndarray, buyer_versions: List[str],
+             seller_keys: np.ndarray, seller_versions: List[str], full: bool = False) -> StateDelta:
+        """Compare the current snapshot with the state; `full` forces a complete recompute."""
+        full = full or not self.valid
+        if full:
+            delta = StateDelta(np.ones(len(buyer_keys), dtype=bool), np.ones(len(seller_keys), dtype=bool),
+                               set(self.buyer_versions), set(self.seller_versions), True)
+        else:
+            new_buyers = np.array([self.buyer_versions.get(k) != v for k, v in zip(buyer_keys, buyer_versions)],
+                                  dtype=bool)
+            new_sellers = np.array([self.seller_versions.get(k) != v for k, v in zip(seller_keys, seller_versions)],
+                                   dtype=bool)
+            delta = StateDelta(new_buyers, new_sellers,
+                               set(self.buyer_versions) - set(buyer_keys),
+                               set(self.seller_versions) - set(seller_keys), False)
+        logger.info(f"Match state delta: {delta.summary()}{' (full recompute)' if delta.full else ''}")
+        return delta
+
+    def update(self, delta: StateDelta, buyer_keys: np.ndarray, buyer_versions: List[str],
+               seller_keys: np.ndarray, seller_versions: List[str],
+               pair_buyer_keys: np.ndarray, pair_seller_keys: np.ndarray, pair_scores: np.ndarray) -> None:
+        """Record the newly scored pairs and the current record versions, then save."""
+        matches = self.matches
+        if delta.full:
+            matches = matches.iloc[0:0]
+        else:
+            # Pairs of new/changed records were just rescored: drop their previous results
+            rescored = (matches['buyer_key'].isin(set(np.asarray(buyer_keys)[delta.new_buyers]))
+                        | matches['seller_key'].isin(set(np.asarray(seller_keys)[delta.new_sellers])))
+            matches = matches[~rescored].copy()
+            gone = (matches['buyer_key'].isin(delta.removed_buyers)
+                    | matches['seller_key'].isin(delta.removed_sellers))
+            matches.loc[gone, 'stale'] = True
+
+        new_pairs = pd.DataFrame({
+            'buyer_key': np.asarray(pair_buyer_keys, dtype=object),
+            'seller_key': np.asarray(pair_seller_keys, dtype=object),
+            'score': np.asarray(pair_scores, dtype=np.float32),
+            'stale': False,
+            'scored_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        })
+        frames = [frame for frame in (matches, new_pairs) if len(frame)]
+        self.matches = pd.concat(frames, ignore_index=True) if frames else new_pairs
+        self.matches['stale'] = self.matches['stale'].astype(bool)
+        self.buyer_versions = dict(zip(buyer_keys, buyer_versions))
+        self.seller_versions = dict(zip(seller_keys, seller_versions))
+        self.valid = True
+        self.save()
+
+    def current_matches(self) -> pd.DataFrame:
+        """All non-stale scored pairs."""
+        return self.matches[~self.matches['stale'].astype(bool)].reset_index(drop=True)
+
+    def save(self) -> None:
+        # Matches first, versions last: a crash in between leaves versions that force a rescore
+        tmp_matches = self.matches_path + '.tmp'
+        self.matches.to_csv(tmp_matches, index=False)
+        os.replace(tmp_matches, self.matches_path)
+        tmp_versions = self.versions_path + '.tmp'
+        with open(tmp_versions, 'w') as f:
+            json.dump({'config': self.config, 'buyers': self.buyer_versions, 'sellers': self.seller_versions}, f)
+        os.replace(tmp_versions, self.versions_path)
+        logger.info(f"Saved match state to {self.directory}: {len(self.matches)} pairs "
+                    f"({int(self.matches['stale'].sum())} stale)")
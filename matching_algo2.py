@@ -1,9 +1,12 @@
 import pandas as pd
+import numpy as np
 import logging
-from typing import List, Dict, Set, Tuple
+from typing import List, Dict, Optional, Set, Tuple
 import re
 from datetime import datetime
 from difflib import SequenceMatcher
+from rapidfuzz import fuzz, process
+from lexicon import Lexicon
 
 # Set up logging
 logging.basicConfig(
@@ -15,7 +18,7 @@ logger = logging.getLogger(__name__)
 class BusinessMatcher:
     def __init__(self):
         """Initialize the matcher with necessary components."""
-        self.keywords_df = None
+        self.lexicon = None
         self.buyers_df = None
         self.sellers_df = None
         self.keyword_synonyms = {}
@@ -32,24 +35,11 @@ class BusinessMatcher:
             # Load keywords and create enhanced synonym dictionary
             path_dir = './data/'
             filePath = f"{path_dir}{keywords_path}"
-            self.keywords_df = pd.read_csv(filePath)
+            # Only Synonym 1-4, as this matcher has always read them
+            self.lexicon = Lexicon.load(filePath, max_synonyms=4)
+            self.keyword_synonyms = self.lexicon.keyword_synonyms
             logger.info(f"Successfully loaded keywords from {keywords_path}")
             
-            # Create keyword dictionary with synonyms
-            for _, row in self.keywords_df.iterrows():
-                if pd.notna(row['Keyword']):
-                    synonyms = set()
-                    synonyms.add(row['Keyword'].lower())
-                    
-                    for col in [f'Synonym {i}' for i in range(1, 5)]:
-                        if pd.notna(row[col]):
-                            synonyms.add(row[col].lower())
-                            
-                    self.keyword_synonyms[row['Keyword'].lower()] = {
-                        'synonyms': synonyms,
-                        'original': row['Keyword']
-                    }
-            
             # Load buyers data
             self.buyers_df = pd.read_csv(f"{path_dir}{buyers_path}")
             logger.info(f"Successfully loaded buyer data from {buyers_path}")
@@ -124,23 +114,19 @@ class BusinessMatcher:
         if pd.isna(text1) or pd.isna(text2):
             return matching_keywords
             
-        text1 = str(text1).lower()
-        text2 = str(text2).lower()
-        
         try:
-            for keyword, data in self.keyword_synonyms.items():
-                # Check if any synonyms appear in both texts
-                if any(syn in text1 for syn in data['synonyms']) and \
-                   any(syn in text2 for syn in data['synonyms']):
-                    matching_keywords.append(data['original'])
+            # Keywords with a synonym in both texts, in lexicon order
+            keywords1, keywords2 = self.lexicon.tag([text1, text2])
+            matching_keywords = [self.lexicon.names[i] for i in sorted(keywords1 & keywords2)]
                     
         except Exception as e:
             logger.error(f"Error finding matching keywords: {e}")
 
         return matching_keywords
 
-    def _check_keyword_match(self, buyer: pd.Series, seller: pd.Series) -> Tuple[bool, List[str]]:
-        """Check if there are matching keywords and return them."""
+    def _check_keyword_match(self, buyer: pd.Series, seller: pd.Series,
+                             industry_match: Optional[bool] = None) -> Tuple[bool, List[str]]:
+        """Check if there are matching keywords and return them (industry_match: precomputed result)."""
         try:
             # Use the correct column names for buyer and seller
             buyer_text = ' '.join(filter(pd.notna, [
@@ -159,7 +145,8 @@ class BusinessMatcher:
             ])).lower()
             
             matching_keywords = self._find_matching_keywords(buyer_text, seller_text)
-            industry_match = self._industry_match(buyer, seller)
+            if industry_match is None:
+                industry_match = self._industry_match(buyer, seller)
 
             has_match = bool(matching_keywords) and industry_match
             
@@ -169,30 +156,67 @@ class BusinessMatcher:
             logger.error(f"Error checking keyword match: {str(e)}")
             return False, []
         
-    def _industry_match(self, buyer: pd.Series, seller: pd.Series) -> bool:
-        """Check if the buyer and seller industries match using fuzzy matching."""
-        buyer_industry = ' '.join(filter(pd.notna, [
+    @staticmethod
+    def _buyer_industry_text(buyer: pd.Series) -> str:
+        return ' '.join(filter(pd.notna, [
             str(buyer.get('Industrie', '')),
             str(buyer.get('Sub-Industrie', ''))
         ])).lower()
-        
-        seller_industry = ' '.join(str(seller.get('branchen', '')).lower().split('>'))
+
+    @staticmethod
+    def _seller_industry_text(seller: pd.Series) -> str:
+        return ' '.join(str(seller.get('branchen', '')).lower().split('>'))
+
+    @staticmethod
+    def _industry_ratio_match(buyer_industry: str, seller_industry: str) -> bool:
         if not buyer_industry or not seller_industry:
             return False
         # Use SequenceMatcher to calculate similarity ratio
         ratio = SequenceMatcher(None, buyer_industry, seller_industry).ratio()
         return ratio >= 0.5  # Lowered threshold to 0.4
 
+    def _industry_match(self, buyer: pd.Series, seller: pd.Series) -> bool:
+        """Check if the buyer and seller industries match using fuzzy matching."""
+        return self._industry_ratio_match(self._buyer_industry_text(buyer), self._seller_industry_text(seller))
+
+    def _industry_match_matrix(self, buyers: List[pd.Series], sellers: List[pd.Series]) -> np.ndarray:
+        """
+        Buyer x seller industry match matrix, computed between distinct
+        industry strings only. rapidfuzz's ratio (normalized LCS) is an upper
+        bound of SequenceMatcher's ratio, so one multi-threaded cdist over the
+        unique strings discards most pairs; SequenceMatcher confirms the rest.
+        """
+        buyer_codes, buyer_industries = pd.factorize(
+            pd.Series([self._buyer_industry_text(buyer) for buyer in buyers], dtype=object))
+        seller_codes, seller_industries = pd.factorize(
+            pd.Series([self._seller_industry_text(seller) for seller in sellers], dtype=object))
+        buyer_industries, seller_industries = list(buyer_industries), list(seller_industries)
+
+        bounds = process.cdist(buyer_industries, seller_industries, scorer=fuzz.ratio,
+                               score_cutoff=49.9, dtype=np.float32, workers=-1)
+        unique_matches = np.zeros(bounds.shape, dtype=bool)
+        for i, j in zip(*np.nonzero(bounds)):
+            unique_matches[i, j] = self._industry_ratio_match(buyer_industries[i], seller_industries[j])
+        logger.info(f"Industry matching: {len(buyer_industries)} x {len(seller_industries)} distinct industries, "
+                    f"{int((bounds > 0).sum())} candidate pairs, {int(unique_matches.sum())} matches")
+        return unique_matches[buyer_codes][:, seller_codes]
+
     def find_matches(self) -> List[Dict]:
         """Find matches requiring both location and keyword matches."""
         matches = []
         
         try:
-            for _, buyer in self.buyers_df.iterrows():
-                for _, seller in self.sellers_df.iterrows():
+            buyers = [buyer for _, buyer in self.buyers_df.iterrows()]
+            sellers = [seller for _, seller in self.sellers_df.iterrows()]
+            industry_matches = self._industry_match_matrix(buyers, sellers)
+            for buyer_idx, buyer in enumerate(buyers):
+                # Only sellers in a matching industry can pass the keyword check
+                for seller_idx in np.flatnonzero(industry_matches[buyer_idx]):
+                    seller = sellers[seller_idx]
                     try:
                         # Check keyword matches
-                        has_keyword_match, matching_keywords = self._check_keyword_match(buyer, seller)
+                        has_keyword_match, matching_keywords = self._check_keyword_match(
+                            buyer, seller, industry_match=True)
                         if not has_keyword_match:
                             continue
                         # Check location matches using correct column names
@@ -3,11 +3,7 @@
 import pandas as pd
 import numpy as np
 import json
-from sentence_transformers import SentenceTransformer
-from sklearn.metrics.pairwise import cosine_similarity
-from sklearn.neighbors import BallTree
 import logging
-from geopy.distance import geodesic
 import re
 import nltk
 from nltk.corpus import stopwords
@@ -15,6 +11,13 @@ from datetime import datetime
 from nltk.stem import SnowballStemmer
 from joblib import Parallel, delayed
 import gc
+from encoder_backend import load_encoder
+from text_encoding import encode_texts, encode_unique
+from encoding_pool import encoding_pool
+from compact_store import CompactEmbeddingStore, EMBEDDING_STORAGE
+from ensemble_scorer import EnsembleScorer
+from geo_join import radius_join, EARTH_RADIUS_KM
+from matching_engine import build_match_frame
 
 # Download required NLTK data
 nltk.download('stopwords')
@@ -72,12 +75,19 @@ def combine_text_fields(row):
         row.get('branchen_preprocessed', '')
     ])
 
-def get_embedding_batch(texts, model, batch_size=64):
+def get_embedding_batch(texts, model, batch_size=64, pool=None):
     """
-    Encode texts in batches to optimize memory usage.
+    Encode texts in length-bucketed batches; long texts are chunked and pooled.
+    With an EncodingPool the texts are sharded across worker processes instead.
     """
-    embeddings = model.encode(texts, batch_size=batch_size, show_progress_bar=True, convert_to_numpy=True, normalize_embeddings=True)
-    return embeddings.astype('float32')  # Use float32 to save memory
+    def encode(unique_texts):
+        if pool is not None:
+            return pool.encode(unique_texts)
+        embeddings = encode_texts(unique_texts, model, batch_size=batch_size, normalize_embeddings=True)
+        return embeddings.astype('float32')  # Use float32 to save memory
+
+    # Flattened rows repeat a listing once per location: encode each distinct text once
+    return encode_unique(texts, encode)
 
 def is_valid_coordinate(lat, lon):
     try:
@@ -141,6 +151,8 @@ def main():
     logging.info('Filtering out invalid coordinates...')
     buyers_flat = buyers_flat[buyers_flat.apply(lambda x: is_valid_coordinate(x['latitude'], x['longitude']), axis=1)]
     sellers_flat = sellers_flat[sellers_flat.apply(lambda x: is_valid_coordinate(x['latitude'], x['longitude']), axis=1)]
+    buyers_flat = buyers_flat.reset_index(drop=True)
+    sellers_flat = sellers_flat.reset_index(drop=True)
 
     # Initialize the models
     logging.info('Loading the Sentence Transformer models...')
@@ -152,128 +164,90 @@ def main():
     for name in model_names:
         try:
             logging.info(f"Loading model: {name}")
-            model = SentenceTransformer(name)
+            model = load_encoder(name)  # backend from MATCHER_ENCODER_BACKEND
             models[name] = model
         except Exception as e:
             logging.error(f"Error loading model {name}: {e}")
 
-    # Encode sellers' combined_text with each model and store in separate arrays
-    seller_embeddings = {}
-    logging.info('Encoding sellers\' text with each model...')
+    # Encode sellers and buyers once per model into one stacked ensemble. With a compact
+    # MATCHER_EMBEDDING_STORAGE mode, sellers are kept in a compact store per model and full
+    # precision stays memory-mapped on disk; float32 (the default) keeps them in memory as is
+    ensemble = EnsembleScorer()
+    logging.info('Encoding sellers\' and buyers\' text with each model...')
     for name, model in models.items():
-        logging.info(f"Encoding sellers with model: {name}")
-        embeddings = get_embedding_batch(sellers_flat['combined_text'].tolist(), model, batch_size=64)
-        seller_embeddings[name] = embeddings
+        logging.info(f"Encoding with model: {name}")
+        # MATCHER_ENCODING_WORKERS > 1 spreads the encode over a process pool
+        with encoding_pool(name) as pool:
+            seller_embeddings = get_embedding_batch(sellers_flat['combined_text'].tolist(), model,
+                                                    batch_size=64, pool=pool)
+            buyer_embeddings = get_embedding_batch(buyers_flat['combined_text'].tolist(), model,
+                                                   batch_size=64, pool=pool)
+        if EMBEDDING_STORAGE == 'float32':
+            ensemble.add_model(name, buyer_embeddings, seller_embeddings)
+        else:
+            store = CompactEmbeddingStore.from_embeddings(seller_embeddings, f'matching_algo3-{name}')
+            logging.info(f"Seller embedding store {name}: {store.memory_footprint()}")
+            ensemble.add_store(name, buyer_embeddings, store)
+        del seller_embeddings, buyer_embeddings
         gc.collect()
 
-    # Prepare seller coordinates for BallTree (in radians)
-    logging.info('Preparing BallTree for geographic queries...')
-    seller_coords = np.radians(sellers_flat[['latitude', 'longitude']].astype(float).values)
-    ball_tree = BallTree(seller_coords, metric='haversine')
-
     similarity_threshold = 0.91
 
-    matches = []
-
-    earth_radius = 6371.0
     radius_km = 50.0
-    radius_rad = radius_km / earth_radius
-
-    total_buyers = len(buyers_flat)
-    logging.info('Starting matching process...')
-    for i, buyer_row in buyers_flat.iterrows():
-        if not is_valid_coordinate(buyer_row['latitude'], buyer_row['longitude']):
-            continue
-
-        buyer_coord = np.radians([float(buyer_row['latitude']), float(buyer_row['longitude'])]).reshape(1, -1)
-        buyer_open_to_foreign = False
-
-        if buyer_open_to_foreign:
-            current_radius_rad = np.pi
-        else:
-            current_radius_rad = radius_rad
-
-        indices = ball_tree.query_radius(buyer_coord, r=current_radius_rad)[0]
-
-        if len(indices) == 0:
-            continue
-
-        model_matches = {name: [] for name in models.keys()}
-
-        buyer_embeddings = {}
-        for name, model in models.items():
-            buyer_embedding = model.encode(buyer_row['combined_text'], convert_to_numpy=True, normalize_embeddings=True)
-            buyer_embeddings[name] = buyer_embedding.astype('float32').reshape(1, -1)
-
-        for name in models.keys():
-            seller_emb = seller_embeddings[name][indices]
-            sim_scores = cosine_similarity(buyer_embeddings[name], seller_emb)[0]
-            matching_indices = np.where(sim_scores >= similarity_threshold)[0]
-            model_matches[name] = matching_indices
-
-        all_matched_indices = set()
-        for name, indices_model in model_matches.items():
-            all_matched_indices.update(indices_model)
-
-        for seller_idx in all_matched_indices:
-            seller_real_idx = indices[seller_idx]
-            seller_row = sellers_flat.iloc[seller_real_idx]
-
-            distance = geodesic(
-                (float(buyer_row['latitude']), float(buyer_row['longitude'])),
-                (float(seller_row['latitude']), float(seller_row['longitude']))
-            ).kilometers
-
-            seller_open_to_foreign = False
-
-            matched_models = []
-            for name in models.keys():
-                if seller_idx in model_matches[name]:
-                    matched_models.append(name)
-
-            model_match_dict = {}
-            for name in models.keys():
-                model_match_dict[name] = 'Yes' if seller_idx in model_matches[name] else 'No'
-
-            match = {
-                'buyer_date': buyer_row.get('date', ''),
-                'buyer_title': buyer_row.get('title', ''),
-                'buyer_summary': buyer_row.get('description', ''),
-                'buyer_long_description': buyer_row.get('long_description', ''),
-                'buyer_location': buyer_row.get('location', ''),
-                'buyer_latitude': buyer_row['latitude'],
-                'buyer_longitude': buyer_row['longitude'],
-                'buyer_open_to_foreign': buyer_open_to_foreign,
-                'buyer_nace_code': buyer_row.get('nace_code', ''),
-                'seller_date': seller_row.get('date', ''),
-                'seller_title': seller_row.get('title', ''),
-                'seller_summary': seller_row.get('description', ''),
-                'seller_long_description': seller_row.get('long_description', ''),
-                'seller_location': seller_row.get('location', ''),
-                'seller_latitude': seller_row['latitude'],
-                'seller_longitude': seller_row['longitude'],
-                'seller_open_to_foreign': seller_open_to_foreign,
-                'seller_url': seller_row.get('url', ''),
-                'seller_nace_code': seller_row.get('nace_code', ''),
-                'distance_km': distance
-            }
-
-            for name in models.keys():
-                match[f'match_{name}'] = model_match_dict[name]
-
-            matches.append(match)
-
-        if (i + 1) % 50 == 0:
-            logging.info(f"Processed {i + 1}/{total_buyers} buyers.")
-
-        del buyer_embeddings
-        gc.collect()
+    buyer_open_to_foreign = False
+    seller_open_to_foreign = False
+
+    # Spatial join: all buyer coordinates against the seller BallTree in batched calls,
+    # with haversine distances for every (buyer, seller) pair within the radius
+    logging.info('Joining buyers and sellers within the search radius...')
+    buyer_coords = buyers_flat[['latitude', 'longitude']].astype(float).values
+    seller_coords = sellers_flat[['latitude', 'longitude']].astype(float).values
+    pair_buyers, pair_sellers, pair_distances = radius_join(
+        buyer_coords, seller_coords, np.pi * EARTH_RADIUS_KM if buyer_open_to_foreign else radius_km
+    )
 
-    logging.info('Creating matches DataFrame...')
-    matches_df = pd.DataFrame(matches)
+    # Semantic score of every candidate pair under every model in one gathered pass
+    logging.info('Scoring candidate pairs...')
+    # Compact stores: pairs near the threshold are rescored from the full-precision vectors
+    model_scores, model_votes = ensemble.threshold_scores(pair_buyers, pair_sellers, similarity_threshold)
+    matched = model_votes.any(axis=1)
+    logging.info(f'{int(matched.sum())} of {len(pair_buyers)} candidate pairs above similarity {similarity_threshold}.')
+
+    matches_df = build_match_frame(
+        buyers_flat, sellers_flat, pair_buyers[matched], pair_sellers[matched],
+        buyer_columns={
+            'buyer_date': 'date',
+            'buyer_title': 'title',
+            'buyer_summary': 'description',
+            'buyer_long_description': 'long_description',
+            'buyer_location': 'location',
+            'buyer_latitude': 'latitude',
+            'buyer_longitude': 'longitude',
+            'buyer_nace_code': 'nace_code',
+        },
+        seller_columns={
+            'seller_date': 'date',
+            'seller_title': 'title',
+            'seller_summary': 'description',
+            'seller_long_description': 'long_description',
+            'seller_location': 'location',
+            'seller_latitude': 'latitude',
+            'seller_longitude': 'longitude',
+            'seller_url': 'url',
+            'seller_nace_code': 'nace_code',
+        },
+    )
+    matches_df.insert(matches_df.columns.get_loc('buyer_nace_code'), 'buyer_open_to_foreign', buyer_open_to_foreign)
+    matches_df.insert(matches_df.columns.get_loc('seller_url'), 'seller_open_to_foreign', seller_open_to_foreign)
+    matches_df['distance_km'] = pair_distances[matched]
+    for col, name in enumerate(ensemble.model_names):
+        matches_df[f'match_{name}'] = np.where(model_votes[matched, col], 'Yes', 'No')
+        matches_df[f'score_{name}'] = model_scores[matched, col]
+    matches_df['model_votes'] = model_votes[matched].sum(axis=1)
 
     if not matches_df.empty:
-        model_columns = [f'match_{name}' for name in models.keys()]
+        model_columns = [f'{prefix}_{name}' for name in ensemble.model_names for prefix in ('match', 'score')]
+        model_columns.append('model_votes')
         other_columns = [col for col in matches_df.columns if col not in model_columns]
         matches_df = matches_df[other_columns + model_columns]
 
@@ -284,7 +258,7 @@ def main():
     else:
         logging.info('No matches found.')
 
-    del seller_embeddings
+    del ensemble
     del sellers_flat
     del buyers_flat
     gc.collect()
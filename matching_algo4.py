@@ -1,4 +1,5 @@
 import pandas as pd
+import numpy as np
 import logging
 from typing import List, Dict, Set, Tuple
 import re
@@ -212,50 +213,78 @@ class EnhancedBusinessMatcher:
     #         logger.error(f"Error finding matches: {e}")
             
     #     return matches
+    def _encode_texts(self, texts: List[str]) -> np.ndarray:
+        """Encode all texts of one side in a single batched call."""
+        return self.sentence_model.encode([str(t) for t in texts], convert_to_numpy=True,
+                                          show_progress_bar=len(texts) > 1000)
+
+    def _business_type_masks(self, type_sets: List[Set[str]]) -> np.ndarray:
+        """Encode per-record business type sets as integer bitmasks."""
+        bits = {btype: 1 << i for i, btype in enumerate(self.business_types)}
+        return np.array([sum(bits[t] for t in types) for types in type_sets], dtype=np.int64)
+
     def find_matches(self, similarity_threshold: float = 0.4) -> List[Dict]:
         """Find matches and include complete buyer and seller information."""
         matches = []
         
         try:
-            for _, buyer in self.buyers_df.iterrows():
-                buyer_text = self._get_text_summary(buyer)
-                buyer_types = self._identify_business_type(buyer_text)
-                
-                for _, seller in self.sellers_df.iterrows():
-                    seller_text = self._get_text_summary(seller)
-                    seller_types = self._identify_business_type(seller_text)
-                    
-                    matching_keywords = self._find_matching_keywords(buyer_text, seller_text)
-                    common_types = buyer_types.intersection(seller_types)
-                    similarity = self._calculate_similarity(buyer_text, seller_text)
-                    
-                    has_location_match, matching_locations = self._check_location_match(
-                        buyer['location (state + city)'],
-                        seller['location (state + city)']
-                    )
-                    
-                    if (common_types or similarity >= similarity_threshold) and has_location_match:
-                        # Create comprehensive match info including all columns
-                        match_info = {
-                            # Match metrics
-                            'semantic_similarity': round(similarity, 3),
-                            'business_types': sorted(common_types),
-                            'matching_locations': sorted(matching_locations),
-                            
-                            # Keywords matching information
-                            'matching_business_keywords': ', '.join(
-                                [f"{k}: {', '.join(v)}" for k, v in matching_keywords['business_types'].items()]
-                            ),
-                            'matching_service_keywords': ', '.join(sorted(matching_keywords['services'])),
-                            'matching_certification_keywords': ', '.join(sorted(matching_keywords['certifications'])),
-                            
-                            # Buyer information - include all columns with prefix
-                            **{f'buyer_{k}': str(v) for k, v in buyer.items()},
-                            
-                            # Seller information - include all columns with prefix
-                            **{f'seller_{k}': str(v) for k, v in seller.items()}
-                        }
-                        matches.append(match_info)
+            # Per-record work is done once per side instead of once per pair
+            buyer_texts = [self._get_text_summary(buyer) for _, buyer in self.buyers_df.iterrows()]
+            seller_texts = [self._get_text_summary(seller) for _, seller in self.sellers_df.iterrows()]
+            buyer_types = [self._identify_business_type(text) for text in buyer_texts]
+            seller_types = [self._identify_business_type(text) for text in seller_texts]
+            buyer_locations = [self._extract_location_parts(loc) for loc in self.buyers_df['location (state + city)']]
+            seller_locations = [self._extract_location_parts(loc) for loc in self.sellers_df['location (state + city)']]
+            buyer_info = [{f'buyer_{k}': str(v) for k, v in buyer.items()} for _, buyer in self.buyers_df.iterrows()]
+            seller_info = [{f'seller_{k}': str(v) for k, v in seller.items()} for _, seller in self.sellers_df.iterrows()]
+
+            # One batched encode per side and a single similarity matrix
+            logger.info(f"Encoding {len(buyer_texts)} buyers and {len(seller_texts)} sellers...")
+            similarity_matrix = cosine_similarity(self._encode_texts(buyer_texts), self._encode_texts(seller_texts))
+            seller_type_masks = self._business_type_masks(seller_types)
+            buyer_type_masks = self._business_type_masks(buyer_types)
+
+            for buyer_idx in range(len(buyer_texts)):
+                similarities = similarity_matrix[buyer_idx]
+                # Candidate sellers: shared business type or similarity above threshold
+                candidates = np.flatnonzero(
+                    ((seller_type_masks & buyer_type_masks[buyer_idx]) != 0)
+                    | (similarities >= similarity_threshold)
+                )
+                buyer_locs = buyer_locations[buyer_idx]
+
+                for seller_idx in candidates:
+                    seller_locs = seller_locations[seller_idx]
+                    matching_locations = (buyer_locs['states'] & seller_locs['states']) | \
+                                         (buyer_locs['cities'] & seller_locs['cities'])
+                    if not matching_locations:
+                        continue
+
+                    similarity = float(similarities[seller_idx])
+                    common_types = buyer_types[buyer_idx].intersection(seller_types[seller_idx])
+                    matching_keywords = self._find_matching_keywords(buyer_texts[buyer_idx], seller_texts[seller_idx])
+
+                    # Create comprehensive match info including all columns
+                    match_info = {
+                        # Match metrics
+                        'semantic_similarity': round(similarity, 3),
+                        'business_types': sorted(common_types),
+                        'matching_locations': sorted(matching_locations),
+                        
+                        # Keywords matching information
+                        'matching_business_keywords': ', '.join(
+                            [f"{k}: {', '.join(v)}" for k, v in matching_keywords['business_types'].items()]
+                        ),
+                        'matching_service_keywords': ', '.join(sorted(matching_keywords['services'])),
+                        'matching_certification_keywords': ', '.join(sorted(matching_keywords['certifications'])),
+                        
+                        # Buyer information - include all columns with prefix
+                        **buyer_info[buyer_idx],
+                        
+                        # Seller information - include all columns with prefix
+                        **seller_info[seller_idx]
+                    }
+                    matches.append(match_info)
             
             matches.sort(key=lambda x: x['semantic_similarity'], reverse=True)
             
@@ -2,16 +2,20 @@ import pandas as pd
 import logging
 from typing import List, Dict, Set, Tuple
 import re
-from sentence_transformers import SentenceTransformer
 from sklearn.metrics.pairwise import cosine_similarity
 from datetime import datetime
 import numpy as np
-from rapidfuzz import fuzz, process
 import nltk
 nltk.download('stopwords')
 nltk.download('punkt')
 from nltk.corpus import stopwords
 from nltk.stem import SnowballStemmer
+from embedding_cache import EmbeddingCache, DEFAULT_CACHE_DIR
+from encoder_backend import load_encoder, encoder_id
+from text_encoding import encode_texts, encode_unique
+from encoding_pool import encoding_pool, ENCODING_WORKERS
+from category_tagger import CategoryTagger
+from reranker import CrossEncoderReranker, listing_text, RERANK_ENABLED
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -219,28 +223,46 @@ class KeywordMatcher:
             for keyword in category.keywords:
                 self.all_keywords[keyword] = category_id
 
+        # Compiled taggers per fuzzy threshold
+        self._taggers: Dict[int, CategoryTagger] = {}
+
+    def _tagger(self, threshold: int) -> CategoryTagger:
+        if threshold not in self._taggers:
+            self._taggers[threshold] = CategoryTagger(self.all_keywords, threshold)
+        return self._taggers[threshold]
+
     def find_categories(self, text: str, threshold: int = 80) -> Set[str]:
-        if pd.isna(text):
-            return set()
-        text = str(text).lower()
-        found_categories = set()
-        
-        for keyword, category_id in self.all_keywords.items():
-            # Use partial_ratio for flexibility
-            if fuzz.partial_ratio(keyword, text) >= threshold:
-                found_categories.add(category_id)
-        
-        return found_categories
+        # Exact keyword hits first, partial_ratio >= threshold for the rest; cached per text
+        return self._tagger(threshold).tag(text)
+
+    def find_categories_batch(self, texts: List[str], threshold: int = 80) -> List[Set[str]]:
+        """find_categories for many texts with one batched fuzzy pass"""
+        return self._tagger(threshold).tag_many(texts)
 
 class EnhancedBusinessMatcher:
-    def __init__(self):
+    # Bump whenever _normalize_text / _get_*_text_content change so cached embeddings are not reused
+    PREPROCESSING_VERSION = 'algo5-nltk-v2'
+
+    def __init__(self, model_name: str = 'paraphrase-multilingual-mpnet-base-v2',
+                 embedding_cache_dir: str = DEFAULT_CACHE_DIR, encoder_backend: str = None,
+                 encoding_workers: int = ENCODING_WORKERS):
         self.keyword_matcher = KeywordMatcher()
+        self.model_name = model_name
+        self.encoder_backend = encoder_backend
+        self.encoding_workers = encoding_workers
         try:
-            self.sentence_model = SentenceTransformer('paraphrase-multilingual-mpnet-base-v2')
+            # encoder_backend: 'torch', 'onnx' or 'onnx-int8' (defaults to MATCHER_ENCODER_BACKEND)
+            self.sentence_model = load_encoder(model_name, encoder_backend)
             logger.info("Successfully loaded NLP model")
         except Exception as e:
             logger.error(f"Error loading NLP model: {e}")
             raise
+
+        # Persistent embedding store; pass embedding_cache_dir=None to always re-encode
+        self.embedding_cache = None
+        if embedding_cache_dir:
+            self.embedding_cache = EmbeddingCache(encoder_id(model_name, encoder_backend),
+                                                  self.PREPROCESSING_VERSION, embedding_cache_dir)
         
         # Initialize German stop words and stemmer
         self.german_stop_words = set(stopwords.words('german'))
@@ -338,83 +360,145 @@ class EnhancedBusinessMatcher:
             logger.error(f"Error calculating similarity: {e}")
             return 0.0
 
+    def _encode_texts(self, texts: List[str], pool=None) -> np.ndarray:
+        """Encode texts, reusing cached embeddings for texts seen in earlier runs"""
+        def encode(batch: List[str]) -> np.ndarray:
+            if pool is not None:
+                return pool.encode(batch)
+            # Length-bucketed batches; long descriptions are chunked instead of truncated
+            return encode_texts(batch, self.sentence_model)
+
+        # Identical texts are encoded once and scattered back to all rows
+        if self.embedding_cache is None:
+            return encode_unique(texts, encode)
+        return encode_unique(texts, lambda unique_texts: self.embedding_cache.encode(unique_texts, encode))
+
+    def _seller_locations(self, seller: Dict) -> Dict[str, Set[str]]:
+        """Parsed states/cities of a seller's 'location' and 'standort' fields combined"""
+        locations = self._parse_location(seller.get('location', ''))
+        standort = self._parse_location(seller.get('standort', ''))
+        locations['states'].update(standort['states'])
+        locations['cities'].update(standort['cities'])
+        return locations
+
+    @staticmethod
+    def _build_inverted_index(token_sets: List[Set[str]]) -> Dict[str, np.ndarray]:
+        """Map each token to the sorted ids of the records containing it"""
+        postings: Dict[str, List[int]] = {}
+        for record_id, tokens in enumerate(token_sets):
+            for token in tokens:
+                postings.setdefault(token, []).append(record_id)
+        return {token: np.asarray(ids, dtype=np.int64) for token, ids in postings.items()}
+
     def find_matches(self, buyers_data: List[Dict], sellers_data: List[Dict], 
-                    min_similarity: float = 0.75) -> List[Dict]:
-        """Find matches between buyers and sellers"""
+                    min_similarity: float = 0.75, reranker: CrossEncoderReranker = None,
+                    rerank_threshold: float = 0.5) -> List[Dict]:
+        """
+        Find matches between buyers and sellers. With a reranker, each buyer's
+        top candidates above min_similarity are rescored by the cross-encoder
+        and kept only if that score reaches rerank_threshold.
+        """
         matches = []
-        seen_matches = set()  # Track unique matches
         
         # Precompute embeddings for all buyers and sellers
         logger.info("Precomputing embeddings for buyers and sellers...")
         buyer_texts = [self._get_buyer_text_content(b) for b in buyers_data]
         seller_texts = [self._get_seller_text_content(s) for s in sellers_data]
-        buyer_embeddings = self.sentence_model.encode(buyer_texts, convert_to_tensor=False, show_progress_bar=True)
-        seller_embeddings = self.sentence_model.encode(seller_texts, convert_to_tensor=False, show_progress_bar=True)
+        with encoding_pool(self.model_name, self.encoder_backend, self.encoding_workers) as pool:
+            buyer_embeddings = self._encode_texts(buyer_texts, pool)
+            seller_embeddings = self._encode_texts(seller_texts, pool)
         logger.info("Embeddings precomputed successfully.")
         
-        # Compute cosine similarity matrix
-        logger.info("Calculating cosine similarity matrix...")
-        similarity_matrix = cosine_similarity(buyer_embeddings, seller_embeddings)
-        logger.info("Cosine similarity matrix calculated.")
+        # Parse every location once and index sellers by state and city
+        buyer_locations = [self._parse_location(b.get('location', '')) for b in buyers_data]
+        seller_locations = [self._seller_locations(s) for s in sellers_data]
+        state_index = self._build_inverted_index([loc['states'] for loc in seller_locations])
+        city_index = self._build_inverted_index([loc['cities'] for loc in seller_locations])
         
+        n_candidates = 0
+        pair_buyers, pair_sellers, pair_scores = [], [], []
         for buyer_idx, buyer in enumerate(buyers_data):
-            buyer_text = buyer_texts[buyer_idx]
-            buyer_categories = self.keyword_matcher.find_categories(buyer_text)
+            # Candidate sellers share at least one state or city with the buyer
+            postings = [state_index[state] for state in buyer_locations[buyer_idx]['states'] if state in state_index]
+            postings += [city_index[city] for city in buyer_locations[buyer_idx]['cities'] if city in city_index]
+            if not postings:
+                continue
+            candidates = np.unique(np.concatenate(postings))
+            n_candidates += len(candidates)
             
-            for seller_idx, seller in enumerate(sellers_data):
-                # Create unique match identifier using indices
-                match_id = f"{buyer_idx}-{seller_idx}"
-                if match_id in seen_matches:
-                    continue
-                
-                # Check for category match
-                seller_text = seller_texts[seller_idx]
-                seller_categories = self.keyword_matcher.find_categories(seller_text)
-                common_categories = buyer_categories.intersection(seller_categories)
-
-                # Check location match
-                has_location_match, matching_locations = self._check_location_match(
-                    buyer.get('location', ''),
-                    {'location': seller.get('location', ''), 'standort': seller.get('standort', '')}
-                )
-                
-                if not has_location_match:
-                    continue
-                
-                # Retrieve precomputed similarity score
-                similarity = similarity_matrix[buyer_idx][seller_idx]
-                if similarity < min_similarity:
-                    continue
-                
-                match_info = {
-                    'match_score': round(similarity, 3),
-                    'matching_categories': sorted(common_categories),
-                    'matching_locations': sorted(matching_locations),
-                    'buyer_info': {
-                        'date': buyer.get('date', ''),
-                        'location': buyer.get('location', ''),
-                        'title': buyer.get('title', ''),
-                        'summary': buyer.get('description', ''),
-                        'description': buyer.get('long_description', ''),
-                        'contact': buyer.get('contact details', '')
-                    },
-                    'seller_info': {
-                        'date': seller.get('date', ''),
-                        'location': seller.get('location', ''),
-                        'standort': seller.get('standort', ''),
-                        'title': seller.get('title', ''),
-                        'summary': seller.get('description', ''),
-                        'long_description': seller.get('long_description', ''),
-                        'url': seller.get('url', ''),
-                        'employees': seller.get('mitarbeiter', ''),
-                        'revenue': seller.get('jahresumsatz', ''),
-                        'price': seller.get('preisvorstellung', ''),
-                        'international': seller.get('international', '')
-                    }
+            # Similarity of the buyer against its candidates only (embeddings are normalized)
+            similarities = seller_embeddings[candidates] @ buyer_embeddings[buyer_idx]
+            keep = similarities >= min_similarity
+            pair_buyers.append(np.full(int(keep.sum()), buyer_idx, dtype=np.int64))
+            pair_sellers.append(candidates[keep])
+            pair_scores.append(similarities[keep])
+        
+        logger.info(f"Scored {n_candidates} location-matched pairs out of "
+                    f"{len(buyers_data) * len(sellers_data)} buyer/seller combinations.")
+        if not pair_buyers:
+            return matches
+        pair_buyers = np.concatenate(pair_buyers)
+        pair_sellers = np.concatenate(pair_sellers)
+        pair_scores = np.concatenate(pair_scores)
+        
+        rerank_scores = np.full(len(pair_buyers), np.nan, dtype=np.float32)
+        if reranker is not None:
+            keep, rerank_scores = reranker.rerank(
+                [listing_text(b) for b in buyers_data], [listing_text(s) for s in sellers_data],
+                pair_buyers, pair_sellers, pair_scores, rerank_threshold
+            )
+            pair_buyers, pair_sellers = pair_buyers[keep], pair_sellers[keep]
+            pair_scores, rerank_scores = pair_scores[keep], rerank_scores[keep]
+        
+        # Categories are computed once per record, and only for records that end up in a match
+        matched_buyers = np.unique(pair_buyers).tolist()
+        matched_sellers = np.unique(pair_sellers).tolist()
+        buyer_categories = dict(zip(matched_buyers, self.keyword_matcher.find_categories_batch(
+            [buyer_texts[i] for i in matched_buyers])))
+        seller_categories = dict(zip(matched_sellers, self.keyword_matcher.find_categories_batch(
+            [seller_texts[j] for j in matched_sellers])))
+        
+        for buyer_idx, seller_idx, similarity, rerank_score in zip(pair_buyers, pair_sellers,
+                                                                   pair_scores, rerank_scores):
+            buyer = buyers_data[buyer_idx]
+            seller = sellers_data[seller_idx]
+            common_categories = buyer_categories[buyer_idx].intersection(seller_categories[seller_idx])
+            
+            matching_locations = (
+                buyer_locations[buyer_idx]['states'] & seller_locations[seller_idx]['states']
+            ) | (
+                buyer_locations[buyer_idx]['cities'] & seller_locations[seller_idx]['cities']
+            )
+            
+            match_info = {
+                'match_score': round(float(similarity), 3),
+                'rerank_score': None if np.isnan(rerank_score) else round(float(rerank_score), 3),
+                'matching_categories': sorted(common_categories),
+                'matching_locations': sorted(matching_locations),
+                'buyer_info': {
+                    'date': buyer.get('date', ''),
+                    'location': buyer.get('location', ''),
+                    'title': buyer.get('title', ''),
+                    'summary': buyer.get('description', ''),
+                    'description': buyer.get('long_description', ''),
+                    'contact': buyer.get('contact details', '')
+                },
+                'seller_info': {
+                    'date': seller.get('date', ''),
+                    'location': seller.get('location', ''),
+                    'standort': seller.get('standort', ''),
+                    'title': seller.get('title', ''),
+                    'summary': seller.get('description', ''),
+                    'long_description': seller.get('long_description', ''),
+                    'url': seller.get('url', ''),
+                    'employees': seller.get('mitarbeiter', ''),
+                    'revenue': seller.get('jahresumsatz', ''),
+                    'price': seller.get('preisvorstellung', ''),
+                    'international': seller.get('international', '')
                 }
-                
-                matches.append(match_info)
-                seen_matches.add(match_id)
+            }
+            
+            matches.append(match_info)
         
         # Sort matches by score
         matches.sort(key=lambda x: x['match_score'], reverse=True)
@@ -436,6 +520,7 @@ class EnhancedBusinessMatcher:
             for match in matches:
                 record = {
                     'Match Score': match['match_score'],
+                    'Rerank Score': match.get('rerank_score'),
                     'Matching Categories': ', '.join(match['matching_categories'] or []),
                     'Matching Locations': ', '.join(match['matching_locations'] or []),
                     'Buyer Date': match['buyer_info'].get('date', ''),
@@ -513,7 +598,8 @@ def main():
         
         # Initialize matcher and find matches
         matcher = EnhancedBusinessMatcher()
-        matches = matcher.find_matches(buyers_data, sellers_data)
+        reranker = CrossEncoderReranker() if RERANK_ENABLED else None
+        matches = matcher.find_matches(buyers_data, sellers_data, reranker=reranker)
         
         # Export results
         matcher.export_matches(matches)
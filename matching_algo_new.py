@@ -1,11 +1,10 @@
 import pandas as pd
 import numpy as np
-from sentence_transformers import SentenceTransformer, CrossEncoder
+from sentence_transformers import CrossEncoder
 from sklearn.preprocessing import normalize
 from sklearn.decomposition import PCA
 from sklearn.metrics.pairwise import cosine_similarity
 from sklearn.neighbors import BallTree
-from geopy.distance import geodesic
 import faiss
 import re
 import nltk
@@ -16,6 +15,12 @@ import gc
 import logging
 import json
 import spacy
+from embedding_cache import EmbeddingCache, slug
+from encoder_backend import load_encoder, encoder_id
+from text_encoding import encode_texts, encode_unique
+from encoding_pool import encoding_pool
+from seller_index import SellerIndex, listing_ids, content_hashes
+from geo_join import haversine_km
 
 # -------------------------------
 # Setup Logging
@@ -151,9 +156,20 @@ def combine_seller_text(row):
     ])
     return combined
 
-def get_embedding_batch(texts, model, batch_size=64):
-    embeddings = model.encode(texts, batch_size=batch_size, show_progress_bar=True, convert_to_numpy=True, normalize_embeddings=True)
-    return embeddings.astype('float32')  # Use float32 to save memory
+def get_embedding_batch(texts, model, batch_size=64, cache=None, pool=None):
+    def encode(batch_texts):
+        # Shard across worker processes when an EncodingPool is given
+        if pool is not None:
+            return pool.encode(batch_texts)
+        # Length-bucketed batches; long texts are split into passages and pooled
+        embeddings = encode_texts(batch_texts, model, batch_size=batch_size, normalize_embeddings=True)
+        return embeddings.astype('float32')  # Use float32 to save memory
+
+    # With an EmbeddingCache only texts not seen in a previous run are encoded
+    if cache is not None:
+        return encode_unique(texts, lambda unique_texts: cache.encode(unique_texts, encode))
+    # Identical texts (repeated listings, one row per location) are encoded once
+    return encode_unique(texts, encode)
 
 # -------------------------------
 # Industry Mapping Function (Optional)
@@ -233,14 +249,18 @@ def main():
     # Example: 'distilbert-base-german-cased'
     model_name = 'distilbert-base-german-cased'
     logging.info(f"Loading model: {model_name}")
-    model = SentenceTransformer(model_name)
+    model = load_encoder(model_name)  # backend from MATCHER_ENCODER_BACKEND
+    embedding_cache = EmbeddingCache(encoder_id(model_name), preprocessing_version='matching_algo_new-v2')
 
-    # Generate embeddings
-    logging.info("Generating embeddings for buyers...")
-    buyer_embeddings = get_embedding_batch(buyers_flat['combined_text'].tolist(), model)
+    # Generate embeddings (MATCHER_ENCODING_WORKERS > 1 spreads the encode over a process pool)
+    with encoding_pool(model_name) as pool:
+        logging.info("Generating embeddings for buyers...")
+        buyer_embeddings = get_embedding_batch(buyers_flat['combined_text'].tolist(), model,
+                                               cache=embedding_cache, pool=pool)
 
-    logging.info("Generating embeddings for sellers...")
-    seller_embeddings = get_embedding_batch(sellers_flat['combined_text'].tolist(), model)
+        logging.info("Generating embeddings for sellers...")
+        seller_embeddings = get_embedding_batch(sellers_flat['combined_text'].tolist(), model,
+                                                cache=embedding_cache, pool=pool)
 
     # Optional: Apply PCA for dimensionality reduction (if needed)
     # Here, we skip PCA as it might not be necessary with a single model and manageable embedding size
@@ -249,12 +269,23 @@ def main():
     # buyer_embeddings = normalize(buyer_embeddings, norm='l2')
     # seller_embeddings = normalize(seller_embeddings, norm='l2')
 
-    # Create FAISS index for efficient similarity search
-    logging.info("Creating FAISS index for sellers...")
+    # Persistent seller index stored next to the data (flat/HNSW/IVF, see MATCHER_SELLER_INDEX).
+    # Sellers are keyed by url, so across snapshots only new or changed listings are added
+    # and listings that disappeared are removed.
+    logging.info("Updating persistent seller index...")
     dimension = buyer_embeddings.shape[1]
-    index = faiss.IndexFlatIP(dimension)  # Inner Product is equivalent to cosine similarity since embeddings are normalized
     faiss.normalize_L2(seller_embeddings)  # Ensure normalization
-    index.add(seller_embeddings)  # Add seller embeddings to the index
+    seller_keys = sellers_flat['combined_text']
+    if 'url' in sellers_flat.columns:
+        seller_keys = sellers_flat['url'].where(sellers_flat['url'].notna(), seller_keys)
+    seller_index_ids = listing_ids(seller_keys.astype(str).tolist())
+    index_path = f'./data/seller_index_{slug(encoder_id(model_name))}.faiss'
+    index = SellerIndex.open(index_path, dimension, expected_size=len(sellers_flat))
+    index.sync(seller_index_ids, seller_embeddings, content_hashes(sellers_flat['combined_text']))
+    index.save(index_path)
+    # Index id -> row of this snapshot (the index keeps the last row of duplicated keys)
+    seller_row_of_id = pd.Series(np.arange(len(sellers_flat)), index=seller_index_ids)
+    seller_row_of_id = seller_row_of_id[~seller_row_of_id.index.duplicated(keep='last')]
 
     # Matching Parameters
     similarity_threshold = 0.75     # Adjust as needed
@@ -279,10 +310,18 @@ def main():
         buyer_batch = buyers_flat.iloc[start_idx:end_idx]
         buyer_embeddings_batch = buyer_embeddings[start_idx:end_idx]
 
-        # Perform FAISS search
-        D, I = index.search(buyer_embeddings_batch, max_matches_per_buyer)  # D: similarities, I: indices
+        # Perform index search
+        D, I = index.search(buyer_embeddings_batch, max_matches_per_buyer)  # D: similarities, I: seller index ids
 
-        for i, buyer_row in buyer_batch.iterrows():
+        # Seller rows of all hits and their haversine distances for the whole batch in one call
+        valid_hits = I >= 0
+        hit_rows = np.zeros(I.shape, dtype=np.int64)
+        hit_rows[valid_hits] = seller_row_of_id.loc[I[valid_hits]].to_numpy()
+        buyer_batch_coords = buyer_batch[['latitude', 'longitude']].apply(pd.to_numeric, errors='coerce').to_numpy(dtype=float)
+        batch_distances = haversine_km(buyer_batch_coords[:, [0]], buyer_batch_coords[:, [1]],
+                                       seller_coords[hit_rows, 0], seller_coords[hit_rows, 1])
+
+        for i, (_, buyer_row) in enumerate(buyer_batch.iterrows()):
             buyer_id = buyer_row['buyer_id']
             buyer_lat = buyer_row['latitude']
             buyer_lon = buyer_row['longitude']
@@ -290,10 +329,10 @@ def main():
             if not is_valid_coordinate(buyer_lat, buyer_lon):
                 continue  # Skip invalid buyer coordinates
 
-            buyer_coord = (float(buyer_lat), float(buyer_lon))
-
             for rank in range(len(I[i])):
-                seller_idx = I[i][rank]
+                if not valid_hits[i][rank]:
+                    continue  # Fewer indexed sellers than requested matches
+                seller_idx = hit_rows[i][rank]
                 similarity = D[i][rank]
 
                 if similarity < similarity_threshold:
@@ -308,9 +347,7 @@ def main():
                 matched_pairs.add(pair_key)
 
                 seller_row = sellers_flat.iloc[seller_idx]
-                seller_lat = float(seller_row['latitude'])
-                seller_lon = float(seller_row['longitude'])
-                distance = geodesic(buyer_coord, (seller_lat, seller_lon)).kilometers
+                distance = float(batch_distances[i][rank])
 
                 # Optional: Apply search radius constraint
                 if distance > search_radius_km:
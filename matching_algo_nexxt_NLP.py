@@ -1,10 +1,10 @@
 import pandas as pd
 from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
 import numpy as np
 import logging
 import sys
 from datetime import datetime
+from matching_engine import build_match_frame, pair_scores, sparse_matches
 
 # Configure logging
 logging.basicConfig(
@@ -69,53 +69,55 @@ except Exception as e:
     logging.error(f"Error during vectorization: {e}")
     sys.exit(1)
 
-# Compute similarity matrices
-combined_text_similarity = cosine_similarity(purchase_combined_tfidf, sales_combined_tfidf)
-branchen_similarity = cosine_similarity(purchase_branchen_tfidf, sales_branchen_tfidf)
-
 # Define thresholds
 COMBINED_TEXT_THRESHOLD = 0.5
 BRANCHEN_THRESHOLD = 0.5
 
-# Find valid matches based on dual thresholds and date validation
-matches = []
-for i in range(combined_text_similarity.shape[0]):
-    for j in range(combined_text_similarity.shape[1]):
-        combined_score = combined_text_similarity[i, j]
-        branchen_score = branchen_similarity[i, j]
-        
-        # Get purchase and sale dates
-        purchase_date = purchase_df.loc[i, 'date']
-        sale_date = sales_df.loc[j, 'date']
-        
-        # Check if the sale date is earlier than or equal to the purchase date and apply similarity thresholds
-        if combined_score > COMBINED_TEXT_THRESHOLD and branchen_score > BRANCHEN_THRESHOLD:
-            if pd.notna(purchase_date) and pd.notna(sale_date) and sale_date <= purchase_date:
-                match = {
-                    "Purchase Date": purchase_date,
-                    "Purchase Title": purchase_df.loc[i, "title"],
-                    "Purchase Location": purchase_df.loc[i, "location"],
-                    "Purchase Industry": purchase_df.loc[i, "branchen"],
-                    "Purchase Long Description": purchase_df.loc[i, "long_description"],
-                    "Sale Date": sale_date,
-                    "Sale Title": sales_df.loc[j, "title"],
-                    "Sale Location": sales_df.loc[j, "location"],
-                    "Sale Industry": sales_df.loc[j, "branchen"],
-                    "Sale Long Description": sales_df.loc[j, "long_description"],
-                    "Combined Text Similarity Score": combined_score,
-                    "Industry (Branchen) Similarity Score": branchen_score
-                }
-                matches.append(match)
-            else:
-                logging.info(f"Invalid match due to date: Purchase Date {purchase_date}, Sale Date {sale_date}")
+# Score the combined text sparse x sparse (TF-IDF rows are L2-normalized, so
+# the dot product is the cosine similarity); only pairs sharing a term and
+# above the threshold are materialized. The branchen similarity is computed
+# for those surviving pairs only.
+candidate_i, candidate_j, candidate_combined = sparse_matches(
+    purchase_combined_tfidf, sales_combined_tfidf, threshold=COMBINED_TEXT_THRESHOLD, strict=True
+)
+candidate_branchen = pair_scores(purchase_branchen_tfidf, sales_branchen_tfidf, candidate_i, candidate_j)
+logging.info(f"{len(candidate_i)} candidate pairs above the combined text threshold.")
+
+# Joint mask: both similarity thresholds, then the sale date must be on or before the purchase date
+similarity_ok = candidate_branchen > BRANCHEN_THRESHOLD
+purchase_dates = purchase_df['date'].to_numpy()[candidate_i]
+sale_dates = sales_df['date'].to_numpy()[candidate_j]
+dates_known = ~(pd.isna(purchase_dates) | pd.isna(sale_dates))
+date_ok = dates_known & (sale_dates <= purchase_dates)
+valid = similarity_ok & date_ok
+
+logging.info(f"Rejected {int((~similarity_ok).sum())} pairs below the branchen threshold, "
+             f"{int((similarity_ok & ~dates_known).sum())} pairs with a missing date and "
+             f"{int((similarity_ok & dates_known & ~date_ok).sum())} pairs with a sale date after the purchase date.")
+
+match_i, match_j = candidate_i[valid], candidate_j[valid]
+matches_df = build_match_frame(purchase_df, sales_df, match_i, match_j, {
+    "Purchase Date": "date",
+    "Purchase Title": "title",
+    "Purchase Location": "location",
+    "Purchase Industry": "branchen",
+    "Purchase Long Description": "long_description",
+}, {
+    "Sale Date": "date",
+    "Sale Title": "title",
+    "Sale Location": "location",
+    "Sale Industry": "branchen",
+    "Sale Long Description": "long_description",
+})
+matches_df["Combined Text Similarity Score"] = candidate_combined[valid]
+matches_df["Industry (Branchen) Similarity Score"] = candidate_branchen[valid]
 
 # Check the number of matches and log
-num_matches = len(matches)
+num_matches = len(matches_df)
 logging.info(f"Number of high-quality matches found: {num_matches}")
 
 # Save matches to Excel
 try:
-    matches_df = pd.DataFrame(matches)
     matches_df.to_excel("./matches/high_quality_matches.xlsx", index=False)
     logging.info("Matches exported successfully to 'high_quality_matches.xlsx'")
 except Exception as e:
@@ -3,6 +3,7 @@ import re
 from collections import defaultdict
 from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.metrics.pairwise import cosine_similarity
+from lexicon import Lexicon
 
 # ----------------------------------
 # Step 1: Load Data
@@ -68,7 +69,7 @@ buyer_df['processed_text'] = buyer_df[buyer_text_columns].apply(
 
 # Define the keywords and synonyms
 keywords_csv = """
-Keyword,Synonym 1,Synonym 2,Synonym 3,Synonym 4,Synonym 5
+Keyword,Synonym 1,Synonym 2,Synonym 3,Synonym 4,Synonym 5,Synonym 6
 Tischlerei,Schreinerei,Möbelbau,Tischlermeister,Schreinermeister,Möbelwerkstatt
 Zimmerei,Zimmerer,Holzbau,Dachstuhl,Zimmermann,Dachdecker
 Hausverwaltung,Immobilienverwaltung,Mietsverwaltung,WEG Verwaltung,Property Management,Immobilienmanagement
@@ -230,50 +231,19 @@ Medienunternehmen,Medienhaus,Rundfunkanstalt,Fernsehsender,Hörfunksender,Medien
 Nachrichtenagentur,Presseagentur,News Agency,Pressedienst,Pressebüro,Nachrichtendienst
 """
 
-# Parse the keywords CSV string into a dictionary
-from io import StringIO
-
-keywords_dict = {}
-keywords_lines = keywords_csv.strip().split('\n')
-header = keywords_lines[0].split(',')
-
-for line in keywords_lines[1:]:
-    # Skip empty lines
-    if not line.strip():
-        continue
-    tokens = [token.strip() for token in line.split(',')]
-    keyword = tokens[0]
-    synonyms = tokens[1:]  # Include all remaining tokens as synonyms
-    if keyword:
-        keywords_dict[keyword.lower()] = [syn.lower() for syn in synonyms if syn]
-
-# Create a mapping from synonyms to keywords and a set of all synonyms
-synonym_to_keyword = {}
-all_keywords_synonyms = set()
-for keyword, synonyms in keywords_dict.items():
-    all_terms = [keyword] + synonyms
-    for term in all_terms:
-        term_lower = term.lower()
-        synonym_to_keyword[term_lower] = keyword
-        all_keywords_synonyms.add(term_lower)
-
-# Build a regex pattern to match any of the synonyms
-# Sort synonyms by length to match longer phrases first
-sorted_synonyms = sorted(all_keywords_synonyms, key=lambda x: -len(x))
-escaped_synonyms = [re.escape(synonym) for synonym in sorted_synonyms]
-pattern = r'\b(' + '|'.join(escaped_synonyms) + r')\b'
+# Compile the keywords and synonyms into a lexicon (cached on disk by content hash)
+lexicon = Lexicon.from_csv_text(keywords_csv, name='matching_algo_test_keywords')
 
 def classify_industry(text):
-    matched_keywords = set(re.findall(pattern, text))
-    industries = set()
-    for term in matched_keywords:
-        keyword = synonym_to_keyword[term]
-        industries.add(keyword)
-    return list(industries)
+    return classify_industries([text])[0]
+
+def classify_industries(texts):
+    # Whole-word matches of any keyword or synonym, like r'\b(term|...)\b'
+    return [[lexicon.keys[i] for i in sorted(ids)] for ids in lexicon.tag(texts, whole_words=True)]
 
 # Classify industries for buyers and sellers
-seller_df['industries'] = seller_df['processed_text'].apply(classify_industry)
-buyer_df['industries'] = buyer_df['processed_text'].apply(classify_industry)
+seller_df['industries'] = classify_industries(seller_df['processed_text'])
+buyer_df['industries'] = classify_industries(buyer_df['processed_text'])
 
 # Remove entries with no industry classification
 # seller_df = seller_df[seller_df['industries'].apply(len) > 0]
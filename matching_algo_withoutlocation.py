@@ -16,6 +16,8 @@ import spacy
 from nltk.corpus import stopwords
 from nltk.tokenize import word_tokenize
 import string
+from text_encoding import encode_unique
+from reranker import CrossEncoderReranker, listing_texts, RERANK_ENABLED
 
 # Setup logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -145,7 +147,9 @@ def combine_seller_text(row):
     ])
 
 def get_embedding_batch(texts, model, batch_size=64):
-    embeddings = model.encode(texts, batch_size=batch_size, show_progress_bar=True, convert_to_numpy=True, normalize_embeddings=True)
+    # Flattened rows repeat a listing once per location: encode each distinct text once
+    embeddings = encode_unique(texts, lambda unique_texts: model.encode(
+        unique_texts, batch_size=batch_size, show_progress_bar=True, convert_to_numpy=True, normalize_embeddings=True))
     return embeddings.astype('float32')  # Use float32 to save memory
 
 def main():
@@ -243,7 +247,10 @@ def main():
     # search_radius_km = 50.0          # Can be adjusted as needed
     # search_radius_rad = search_radius_km / 6371.0  # Earth's radius in km
 
+    rerank_threshold = 0.5           # Minimum cross-encoder score when reranking is enabled
+
     matches = []
+    match_rows = []                  # (buyer row, seller row) of every match, for reranking
     matched_pairs = set()            # To ensure unique buyer-seller pairs
 
     total_buyers = len(buyers_flat)
@@ -357,6 +364,7 @@ def main():
             }
 
             matches.append(match)
+            match_rows.append((i, match_idx))
             match_count += 1
 
             # if match_count >= max_matches_per_buyer:
@@ -370,6 +378,17 @@ def main():
         if (i + 1) % 1000 == 0:
             gc.collect()
 
+    # Optional second stage (MATCHER_RERANK=1): cross-encoder rerank of each buyer's top candidates
+    if RERANK_ENABLED and matches:
+        match_buyers, match_sellers = (np.asarray(rows, dtype=np.int64) for rows in zip(*match_rows))
+        keep, rerank_scores = CrossEncoderReranker().rerank(
+            listing_texts(buyers_flat), listing_texts(sellers_flat), match_buyers, match_sellers,
+            np.array([match['similarity_score'] for match in matches]), rerank_threshold
+        )
+        for match, rerank_score in zip(matches, rerank_scores):
+            match['rerank_score'] = rerank_score
+        matches = [match for match, kept in zip(matches, keep) if kept]
+
     logging.info("Creating matches DataFrame...")
     matches_df = pd.DataFrame(matches)
 
@@ -401,6 +420,8 @@ def main():
             'similarity_score',
             # 'composite_score'
         ]
+        if RERANK_ENABLED:
+            required_columns.append('rerank_score')
         # Ensure all required columns are present
         for col in required_columns:
             if col not in matches_df.columns:
@@ -0,0 +1,213 @@
+import os
+import logging
+from typing import Dict, Iterable, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+logger = logging.getLogger(__name__)
+
+# Default block shape of the scoring kernel; one float32 score block is
+# BUYER_BLOCK_SIZE x SELLER_BLOCK_SIZE x 4 bytes (128 MB with the defaults)
+BUYER_BLOCK_SIZE = int(os.environ.get('MATCHER_BUYER_BLOCK_SIZE', '1024'))
+SELLER_BLOCK_SIZE = int(os.environ.get('MATCHER_SELLER_BLOCK_SIZE', '32768'))
+
+
+def _block_scores(buyers, sellers) -> np.ndarray:
+    """Dense float32 score block for dense or scipy.sparse inputs."""
+    scores = buyers @ sellers.T
+    if sparse.issparse(scores):
+        scores = scores.toarray()
+    return np.asarray(scores, dtype=np.float32)
+
+
+def _as_matrix(embeddings):
+    if sparse.issparse(embeddings):
+        return sparse.csr_matrix(embeddings, dtype=np.float32)
+    return np.asarray(embeddings, dtype=np.float32)
+
+
+def blocked_matches(buyer_embeddings, seller_embeddings,
+                    threshold: Optional[float] = None, top_k: Optional[int] = None,
+                    block_size: int = BUYER_BLOCK_SIZE,
+                    seller_block_size: Optional[int] = SELLER_BLOCK_SIZE) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Score all buyers against all sellers in fixed-size buyer x seller blocks.
+
+    Embeddings are expected to be L2-normalized (dense arrays or scipy.sparse
+    matrices such as TF-IDF rows), so the dot product is the cosine
+    similarity. Scores are computed in float32 and peak memory is bounded
+    by one block_size x seller_block_size score block (None = all sellers
+    in one block). Returns flat (buyer_idx, seller_idx, score)
+    arrays ordered by buyer, then seller (threshold mode) or by descending
+    score (top-k mode). With both threshold and top_k, the top-k hits are
+    further filtered by the threshold.
+    """
+    if threshold is None and top_k is None:
+        raise ValueError("Either threshold or top_k must be given")
+
+    buyer_embeddings = _as_matrix(buyer_embeddings)
+    seller_embeddings = _as_matrix(seller_embeddings)
+    n_buyers, n_sellers = buyer_embeddings.shape[0], seller_embeddings.shape[0]
+    seller_block_size = seller_block_size or n_sellers
+
+    buyer_parts, seller_parts, score_parts = [], [], []
+    if n_buyers == 0 or n_sellers == 0:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty, np.empty(0, dtype=np.float32)
+
+    if top_k is not None:
+        top_k = min(top_k, n_sellers)
+
+    for start in range(0, n_buyers, block_size):
+        end = min(start + block_size, n_buyers)
+        buyers = buyer_embeddings[start:end]
+        # Running per-buyer top-k over the seller blocks seen so far
+        best_cols = np.empty((end - start, 0), dtype=np.int64)
+        best_scores = np.empty((end - start, 0), dtype=np.float32)
+        hit_rows, hit_cols, hit_scores = [], [], []
+
+        for seller_start in range(0, n_sellers, seller_block_size):
+            seller_end = min(seller_start + seller_block_size, n_sellers)
+            scores = _block_scores(buyers, seller_embeddings[seller_start:seller_end])
+
+            if top_k is not None:
+                cols = np.broadcast_to(np.arange(seller_start, seller_end), scores.shape)
+                cols = np.concatenate([best_cols, cols], axis=1)
+                scores = np.concatenate([best_scores, scores], axis=1)
+                if top_k < cols.shape[1]:
+                    keep = np.argpartition(-scores, top_k - 1, axis=1)[:, :top_k]
+                    cols = np.take_along_axis(cols, keep, axis=1)
+                    scores = np.take_along_axis(scores, keep, axis=1)
+                best_cols, best_scores = cols, scores
+            else:
+                rows, cols = np.nonzero(scores >= threshold)
+                hit_rows.append(rows + start)
+                hit_cols.append(cols + seller_start)
+                hit_scores.append(scores[rows, cols])
+
+        if top_k is not None:
+            order = np.argsort(-best_scores, axis=1, kind='stable')
+            cols = np.take_along_axis(best_cols, order, axis=1).ravel()
+            top_scores = np.take_along_axis(best_scores, order, axis=1).ravel()
+            rows = np.repeat(np.arange(start, end), top_k)
+            if threshold is not None:
+                keep = top_scores >= threshold
+                rows, cols, top_scores = rows[keep], cols[keep], top_scores[keep]
+            buyer_parts.append(rows)
+            seller_parts.append(cols)
+            score_parts.append(top_scores)
+        else:
+            rows, cols, hits = np.concatenate(hit_rows), np.concatenate(hit_cols), np.concatenate(hit_scores)
+            if len(hit_rows) > 1:
+                # Restore buyer-then-seller order across the seller blocks
+                order = np.lexsort((cols, rows))
+                rows, cols, hits = rows[order], cols[order], hits[order]
+            buyer_parts.append(rows)
+            seller_parts.append(cols)
+            score_parts.append(hits)
+
+        logger.info(f"Scored buyers {start + 1}-{end}/{n_buyers}")
+
+    return (np.concatenate(buyer_parts).astype(np.int64),
+            np.concatenate(seller_parts).astype(np.int64),
+            np.concatenate(score_parts).astype(np.float32))
+
+
+def sparse_matches(buyer_matrix, seller_matrix, threshold: float, block_size: int = BUYER_BLOCK_SIZE,
+                   strict: bool = False) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Threshold matches for sparse, L2-normalized rows (e.g. TF-IDF) without
+    densifying: each buyer block is multiplied sparse x sparse, so only
+    pairs that share a term are materialized, and only entries above the
+    threshold (> with strict, else >=) are kept. Returns flat
+    (buyer_idx, seller_idx, score) arrays ordered by buyer, then seller.
+    """
+    buyer_matrix = sparse.csr_matrix(buyer_matrix, dtype=np.float32)
+    seller_t = sparse.csr_matrix(seller_matrix, dtype=np.float32).T.tocsc()
+    n_buyers = buyer_matrix.shape[0]
+
+    buyer_parts, seller_parts, score_parts = [], [], []
+    for start in range(0, n_buyers, block_size):
+        scores = (buyer_matrix[start:start + block_size] @ seller_t).tocoo()
+        keep = scores.data > threshold if strict else scores.data >= threshold
+        rows, cols, values = scores.row[keep], scores.col[keep], scores.data[keep]
+        order = np.lexsort((cols, rows))
+        buyer_parts.append(rows[order].astype(np.int64) + start)
+        seller_parts.append(cols[order].astype(np.int64))
+        score_parts.append(values[order])
+
+    if not buyer_parts:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty, np.empty(0, dtype=np.float32)
+    return (np.concatenate(buyer_parts), np.concatenate(seller_parts),
+            np.concatenate(score_parts).astype(np.float32))
+
+
+def pair_scores(buyer_embeddings, seller_embeddings, buyer_idx: np.ndarray, seller_idx: np.ndarray,
+                block_size: int = 65536) -> np.ndarray:
+    """
+    Row-wise dot products for the given (buyer, seller) pairs only, for dense
+    or scipy.sparse inputs, without building the full score matrix.
+    """
+    buyer_embeddings = _as_matrix(buyer_embeddings)
+    seller_embeddings = _as_matrix(seller_embeddings)
+    scores = np.empty(len(buyer_idx), dtype=np.float32)
+    for start in range(0, len(buyer_idx), block_size):
+        buyers = buyer_embeddings[buyer_idx[start:start + block_size]]
+        sellers = seller_embeddings[seller_idx[start:start + block_size]]
+        if sparse.issparse(buyers):
+            products = np.asarray(buyers.multiply(sellers).sum(axis=1)).ravel()
+        else:
+            products = np.einsum('ij,ij->i', buyers, sellers)
+        scores[start:start + len(products)] = products
+    return scores
+
+
+def shared_token_pairs(buyer_tokens: Iterable[Iterable[str]],
+                       seller_tokens: Iterable[Iterable[str]]) -> sparse.csr_matrix:
+    """
+    Buyer x seller matrix counting the tokens (location parts, industry
+    terms, ...) each pair shares. Records are joined through an inverted
+    index over the seller tokens, so only pairs with a shared token are
+    ever materialized.
+    """
+    seller_tokens, buyer_tokens = list(seller_tokens), list(buyer_tokens)
+    vocabulary: Dict[str, int] = {}
+    seller_rows, seller_cols = [], []
+    for row, tokens in enumerate(seller_tokens):
+        for token in set(tokens):
+            seller_rows.append(row)
+            seller_cols.append(vocabulary.setdefault(token, len(vocabulary)))
+    buyer_rows, buyer_cols = [], []
+    for row, tokens in enumerate(buyer_tokens):
+        for token in set(tokens):
+            if token in vocabulary:
+                buyer_rows.append(row)
+                buyer_cols.append(vocabulary[token])
+
+    buyers = sparse.csr_matrix((np.ones(len(buyer_rows), dtype=np.int32), (buyer_rows, buyer_cols)),
+                               shape=(len(buyer_tokens), len(vocabulary)))
+    sellers = sparse.csr_matrix((np.ones(len(seller_rows), dtype=np.int32), (seller_rows, seller_cols)),
+                                shape=(len(seller_tokens), len(vocabulary)))
+    return (buyers @ sellers.T).tocsr()
+
+
+def build_match_frame(buyers_df: pd.DataFrame, sellers_df: pd.DataFrame,
+                      buyer_idx: np.ndarray, seller_idx: np.ndarray,
+                      buyer_columns: Dict[str, str], seller_columns: Dict[str, str]) -> pd.DataFrame:
+    """
+    Build the output table for matched pairs with positional gathers instead
+    of per-row dicts. `buyer_columns` / `seller_columns` map output column
+    names to source columns; missing source columns become ''.
+    """
+    data = {}
+    for df, idx, columns in ((buyers_df, buyer_idx, buyer_columns),
+                             (sellers_df, seller_idx, seller_columns)):
+        for out_col, src_col in columns.items():
+            if src_col in df.columns:
+                data[out_col] = df[src_col].to_numpy()[idx]
+            else:
+                data[out_col] = np.full(len(idx), '', dtype=object)
+    return pd.DataFrame(data)
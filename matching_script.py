@@ -1,10 +1,11 @@
 import pandas as pd
 import re
 from sentence_transformers import SentenceTransformer
-import torch
 import numpy as np
 import spacy
 from sklearn.preprocessing import LabelEncoder
+from category_tagger import AhoCorasick
+from matching_engine import pair_scores, shared_token_pairs
 
 # ----------------------------------
 # Step 1: Load Data
@@ -322,18 +323,17 @@ nace_mapping = {
 }
 
 
+# Compile all industry terms into one automaton; each text is scanned once for all terms
+industry_terms = list(nace_mapping.keys())
+industry_automaton = AhoCorasick(industry_terms)
+
 def extract_industry_keywords(text):
-    industry_terms = list(nace_mapping.keys())
-    industries = []
-    text_lower = text.lower()
-    for term in industry_terms:
-        if term in text_lower:
-            industries.append(term)
-    return industries
+    # Terms occurring anywhere in the text, in nace_mapping order
+    return [industry_terms[i] for i in sorted(industry_automaton.find(text.lower()))]
 
 # Apply to seller and buyer dataframes
-seller_df['extracted_industries'] = seller_df['processed_text'].apply(extract_industry_keywords)
-buyer_df['extracted_industries'] = buyer_df['processed_text'].apply(extract_industry_keywords)
+seller_df['extracted_industries'] = [extract_industry_keywords(text) for text in seller_df['processed_text']]
+buyer_df['extracted_industries'] = [extract_industry_keywords(text) for text in buyer_df['processed_text']]
 
 
 # ----------------------------------
@@ -387,62 +387,56 @@ buyer_df['locations'] = buyer_df['locations'].apply(standardize_location_names)
 # Step 6: Matching Algorithm
 # ----------------------------------
 
-from torch.nn.functional import cosine_similarity
-
 # Load the model for semantic similarity
 model = SentenceTransformer('distiluse-base-multilingual-cased-v2')
 
-# Encode the texts
+# Encode the texts (L2-normalized, so cosine similarity is a dot product)
 print("Encoding seller texts...")
-seller_embeddings = model.encode(seller_df['processed_text'].tolist(), convert_to_tensor=True, show_progress_bar=True)
+seller_embeddings = model.encode(seller_df['processed_text'].tolist(), normalize_embeddings=True, show_progress_bar=True)
 
 print("Encoding buyer texts...")
-buyer_embeddings = model.encode(buyer_df['processed_text'].tolist(), convert_to_tensor=True, show_progress_bar=True)
+buyer_embeddings = model.encode(buyer_df['processed_text'].tolist(), normalize_embeddings=True, show_progress_bar=True)
 
 # Set a similarity threshold
 SIMILARITY_THRESHOLD = 0.5  # Adjust as needed
 
 matches_list = []
 
-# Matching loop
+# Candidate pairs share at least one location and one industry term; both are
+# joined through inverted indexes, so non-candidate pairs are never visited
 print("Finding matches...")
-for buyer_idx in range(len(buyer_df)):
-    buyer_info = buyer_df.iloc[buyer_idx]
-    buyer_locations = set(buyer_info['locations'])
-    buyer_nace_codes = set(buyer_info['extracted_industries'])
-    if not buyer_nace_codes:
-        continue  # Skip if no industry codes
-    for seller_idx in range(len(seller_df)):
-        seller_info = seller_df.iloc[seller_idx]
-        seller_locations = set(seller_info['locations'])
-        seller_nace_codes = set(seller_info['extracted_industries'])
-        if not seller_nace_codes:
-            continue  # Skip if no industry codes
-        # Check for exact location match
-        location_match = buyer_locations.intersection(seller_locations)
-        if location_match:
-            # Check for industry code match
-            industry_match = buyer_nace_codes.intersection(seller_nace_codes)
-            if industry_match:
-                # Compute semantic similarity
-                similarity_score = cosine_similarity(
-                    buyer_embeddings[buyer_idx].unsqueeze(0),
-                    seller_embeddings[seller_idx].unsqueeze(0)
-                ).item()
-                if similarity_score >= SIMILARITY_THRESHOLD:
-                    matches_list.append({
-                        'buyer_idx': buyer_idx,
-                        'seller_idx': seller_idx,
-                        'similarity_score': similarity_score,
-                        'matched_locations': ', '.join(location_match),
-                        'buyer_locations': ', '.join(buyer_locations),
-                        'seller_locations': ', '.join(seller_locations),
-                        'matched_industries': ', '.join(industry_match),
-                        'buyer_nace_codes': ', '.join(buyer_nace_codes),
-                        'seller_nace_codes': ', '.join(seller_nace_codes),
-                        'buyer_data': buyer_info.to_dict(),
-                        'seller_data': seller_info.to_dict()
-                    })
+shared_locations = shared_token_pairs(buyer_df['locations'], seller_df['locations'])
+shared_industries = shared_token_pairs(buyer_df['extracted_industries'], seller_df['extracted_industries'])
+candidates = shared_locations.multiply(shared_industries).tocoo()
+order = np.lexsort((candidates.col, candidates.row))
+candidate_buyers = candidates.row[order].astype(np.int64)
+candidate_sellers = candidates.col[order].astype(np.int64)
+print(f"Scoring {len(candidate_buyers)} candidate pairs out of {len(buyer_df) * len(seller_df)}")
+
+# Semantic similarity of the candidate pairs only, in one batch
+similarity_scores = pair_scores(buyer_embeddings, seller_embeddings, candidate_buyers, candidate_sellers)
+keep = similarity_scores >= SIMILARITY_THRESHOLD
+match_buyers, match_sellers = candidate_buyers[keep], candidate_sellers[keep]
+
+buyer_locations = buyer_df['locations'].tolist()
+seller_locations = seller_df['locations'].tolist()
+buyer_industries = buyer_df['extracted_industries'].tolist()
+seller_industries = seller_df['extracted_industries'].tolist()
+for buyer_idx, seller_idx, similarity_score in zip(match_buyers, match_sellers, similarity_scores[keep]):
+    seller_location_set, seller_industry_set = set(seller_locations[seller_idx]), set(seller_industries[seller_idx])
+    location_match = [loc for loc in buyer_locations[buyer_idx] if loc in seller_location_set]
+    industry_match = [term for term in buyer_industries[buyer_idx] if term in seller_industry_set]
+    matches_list.append({
+        'buyer_idx': int(buyer_idx),
+        'seller_idx': int(seller_idx),
+        'similarity_score': float(similarity_score),
+        'matched_locations': ', '.join(location_match),
+        'buyer_locations': ', '.join(buyer_locations[buyer_idx]),
+        'seller_locations': ', '.join(seller_locations[seller_idx]),
+        'matched_industries': ', '.join(industry_match),
+        'buyer_nace_codes': ', '.join(buyer_industries[buyer_idx]),
+        'seller_nace_codes': ', '.join(seller_industries[seller_idx]),
+    })
 
 # ----------------------------------
 # Step 7: Output Results
@@ -453,12 +447,12 @@ if matches_list:
     # Create a DataFrame from matches_list
     matches_df = pd.DataFrame(matches_list)
     
-    # Expand buyer and seller data columns
-    buyer_data_df = pd.DataFrame(matches_df['buyer_data'].tolist()).add_prefix('buyer_')
-    seller_data_df = pd.DataFrame(matches_df['seller_data'].tolist()).add_prefix('seller_')
+    # Gather the buyer and seller data columns of every match
+    buyer_data_df = buyer_df.iloc[match_buyers].reset_index(drop=True).add_prefix('buyer_')
+    seller_data_df = seller_df.iloc[match_sellers].reset_index(drop=True).add_prefix('seller_')
     
     # Combine all data into a single DataFrame
-    final_df = pd.concat([matches_df.drop(['buyer_data', 'seller_data'], axis=1), buyer_data_df, seller_data_df], axis=1)
+    final_df = pd.concat([matches_df, buyer_data_df, seller_data_df], axis=1)
     
     # Reorder columns for better readability
     columns_order = [
@@ -0,0 +1,269 @@
+import os
+import json
+import time
+import logging
+import argparse
+import threading
+import socketserver
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from embedding_cache import EmbeddingCache
+from encoder_backend import load_encoder, encoder_id
+from matching_engine import blocked_matches
+from hybrid_retrieval import HybridRetriever
+from text_encoding import encode_texts
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+PREPROCESSING_VERSION = 'matching_server-v1'
+# A reload encodes new listings in chunks of this many texts; queries waiting to encode go first
+RELOAD_ENCODE_CHUNK = int(os.environ.get('MATCHER_RELOAD_CHUNK_SIZE', '256'))
+
+DEFAULT_BUYER_FIELDS = ['title', 'description', 'long_description', 'Industrie', 'Sub-Industrie', 'branchen']
+DEFAULT_SELLER_FIELDS = ['title', 'description', 'long_description', 'branchen']
+DEFAULT_OUTPUT_FIELDS = ['date', 'title', 'description', 'location', 'standort', 'branchen', 'url',
+                         'mitarbeiter', 'jahresumsatz', 'preisvorstellung', 'nace_code']
+
+
+def combine_fields(record: Dict, fields: List[str]) -> str:
+    """Join the non-empty text fields of a record into one string."""
+    parts = []
+    for field in fields:
+        value = record.get(field)
+        if value is None or (isinstance(value, float) and np.isnan(value)):
+            continue
+        value = str(value).strip()
+        if value:
+            parts.append(value)
+    return ' '.join(parts)
+
+
+class SellerSnapshot:
+    """A seller CSV with its normalized embedding matrix and hybrid (BM25 + dense) retriever."""
+
+    def __init__(self, path: str, sellers_df: pd.DataFrame, embeddings: np.ndarray, texts: List[str]):
+        self.path = path
+        self.sellers_df = sellers_df
+        self.embeddings = embeddings
+        self.retriever = HybridRetriever(texts, embeddings)
+        self.loaded_at = time.strftime('%Y-%m-%d %H:%M:%S')
+
+
+class MatchingService:
+    """
+    Keeps the encoder and the current seller snapshot in memory and answers
+    top-k queries. Reloading builds the new snapshot off to the side (new
+    listings only are encoded thanks to the embedding cache) and swaps it in
+    atomically, so queries keep being served during a reload.
+    """
+
+    def __init__(self, sellers_path: str, model_name: str = 'paraphrase-multilingual-mpnet-base-v2',
+                 seller_fields: List[str] = None, buyer_fields: List[str] = None,
+                 output_fields: List[str] = None):
+        self.model_name = model_name
+        self.seller_fields = seller_fields or DEFAULT_SELLER_FIELDS
+        self.buyer_fields = buyer_fields or DEFAULT_BUYER_FIELDS
+        self.output_fields = output_fields or DEFAULT_OUTPUT_FIELDS
+
+        logger.info(f"Loading model {model_name}...")
+        self.model = load_encoder(model_name)
+        self.cache = EmbeddingCache(encoder_id(model_name), PREPROCESSING_VERSION)
+        self._encode_lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+        # Number of queries waiting for (or holding) the encoder; reload chunks wait for it to drop to 0
+        self._waiting_queries = 0
+        self._queries_idle = threading.Condition()
+        self.snapshot: Optional[SellerSnapshot] = None
+        self.reload(sellers_path)
+
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        # One model instance is shared by all request threads
+        with self._queries_idle:
+            self._waiting_queries += 1
+        try:
+            with self._encode_lock:
+                return encode_texts(texts, self.model, show_progress_bar=False)
+        finally:
+            with self._queries_idle:
+                self._waiting_queries -= 1
+                self._queries_idle.notify_all()
+
+    def _encode_snapshot(self, texts: List[str]) -> np.ndarray:
+        """
+        Encode a reload's new listings in small chunks, taking the encoder
+        only while no query is waiting for it, so a query waits for at most
+        one chunk instead of the whole snapshot.
+        """
+        parts = []
+        for start in range(0, len(texts), RELOAD_ENCODE_CHUNK):
+            with self._queries_idle:
+                self._queries_idle.wait_for(lambda: self._waiting_queries == 0)
+            with self._encode_lock:
+                parts.append(encode_texts(texts[start:start + RELOAD_ENCODE_CHUNK], self.model,
+                                          show_progress_bar=False))
+        if not parts:
+            return encode_texts([], self.model, show_progress_bar=False)
+        return np.concatenate(parts)
+
+    def reload(self, sellers_path: Optional[str] = None) -> Dict:
+        """Load a (new) seller snapshot and swap it in."""
+        with self._reload_lock:
+            path = sellers_path or self.snapshot.path
+            logger.info(f"Loading seller snapshot {path}...")
+            sellers_df = pd.read_csv(path).reset_index(drop=True)
+            texts = [combine_fields(record, self.seller_fields) for record in sellers_df.to_dict('records')]
+            embeddings = self.cache.encode(texts, self._encode_snapshot)
+            self.snapshot = SellerSnapshot(path, sellers_df, embeddings, texts)
+            logger.info(f"Seller snapshot ready: {len(sellers_df)} sellers from {path}")
+            return self.status()
+
+    def status(self) -> Dict:
+        snapshot = self.snapshot
+        return {
+            'model': self.model_name,
+            'sellers_path': snapshot.path,
+            'sellers': len(snapshot.sellers_df),
+            'loaded_at': snapshot.loaded_at,
+        }
+
+    def match(self, buyer: Optional[Dict] = None, text: Optional[str] = None,
+              top_k: int = 10, threshold: Optional[float] = None, hybrid: bool = False,
+              candidates: int = 300) -> List[Dict]:
+        """
+        Return the top-k sellers for a buyer record (or a raw query text).
+
+        With hybrid=True, BM25 and dense top lists are fused with reciprocal
+        rank fusion into `candidates` sellers, which are ranked by fused score
+        (`rrf_score`); `threshold` still applies to the cosine `score`.
+        """
+        if text is None:
+            text = combine_fields(buyer or {}, self.buyer_fields)
+        if not text:
+            raise ValueError("Buyer record has no text to match on")
+
+        snapshot = self.snapshot  # keep one consistent snapshot for the whole query
+        query = self._encode([text])
+        rrf_scores = None
+        if hybrid:
+            _, seller_idx, rrf_scores = snapshot.retriever.retrieve([text], query, top_n=candidates)
+            scores = snapshot.embeddings[seller_idx] @ query[0]
+            if threshold is not None:
+                keep = scores >= threshold
+                seller_idx, scores, rrf_scores = seller_idx[keep], scores[keep], rrf_scores[keep]
+            seller_idx, scores, rrf_scores = seller_idx[:top_k], scores[:top_k], rrf_scores[:top_k]
+        else:
+            _, seller_idx, scores = blocked_matches(query, snapshot.embeddings, threshold=threshold, top_k=top_k)
+
+        columns = [c for c in self.output_fields if c in snapshot.sellers_df.columns]
+        rows = snapshot.sellers_df.iloc[seller_idx][columns]
+        results = []
+        for rank, (row_idx, score, record) in enumerate(zip(seller_idx, scores, rows.to_dict('records'))):
+            record = {k: (None if isinstance(v, float) and np.isnan(v) else v) for k, v in record.items()}
+            result = {'seller_index': int(row_idx), 'score': round(float(score), 4)}
+            if rrf_scores is not None:
+                result['rrf_score'] = round(float(rrf_scores[rank]), 6)
+            results.append({**result, **record})
+        return results
+
+
+class MatchingRequestHandler(BaseHTTPRequestHandler):
+    service: MatchingService = None
+
+    def address_string(self):
+        # Unix socket clients have no (host, port) address
+        if isinstance(self.client_address, tuple) and self.client_address:
+            return str(self.client_address[0])
+        return 'unix'
+
+    def _send_json(self, status: int, payload) -> None:
+        body = json.dumps(payload, ensure_ascii=False, default=str).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_json(self) -> Dict:
+        length = int(self.headers.get('Content-Length') or 0)
+        if not length:
+            return {}
+        return json.loads(self.rfile.read(length).decode('utf-8'))
+
+    def do_GET(self):
+        if self.path == '/health':
+            self._send_json(200, {'status': 'ok', **self.service.status()})
+        else:
+            self._send_json(404, {'error': f'Unknown endpoint {self.path}'})
+
+    def do_POST(self):
+        try:
+            payload = self._read_json()
+            if self.path == '/match':
+                start = time.perf_counter()
+                matches = self.service.match(
+                    buyer=payload.get('buyer'),
+                    text=payload.get('text'),
+                    top_k=int(payload.get('top_k', 10)),
+                    threshold=payload.get('threshold'),
+                    hybrid=bool(payload.get('hybrid', False)),
+                    candidates=int(payload.get('candidates', 300)),
+                )
+                elapsed_ms = (time.perf_counter() - start) * 1000
+                self._send_json(200, {'matches': matches, 'elapsed_ms': round(elapsed_ms, 1)})
+            elif self.path == '/reload':
+                self._send_json(200, self.service.reload(payload.get('sellers_path')))
+            else:
+                self._send_json(404, {'error': f'Unknown endpoint {self.path}'})
+        except (ValueError, KeyError) as e:
+            self._send_json(400, {'error': str(e)})
+        except Exception as e:
+            logger.error(f"Error handling {self.path}: {e}")
+            self._send_json(500, {'error': str(e)})
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def server_bind(self):
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+        socketserver.UnixStreamServer.server_bind(self)
+        self.server_name = 'localhost'
+        self.server_port = 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Resident matching server with a warm model and seller index.')
+    parser.add_argument('--sellers', default='./data/nexxt_change_sales_listings_20241101_005703.csv')
+    parser.add_argument('--model', default='paraphrase-multilingual-mpnet-base-v2')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--socket', default=None, help='Serve on this Unix socket path instead of TCP')
+    args = parser.parse_args()
+
+    MatchingRequestHandler.service = MatchingService(args.sellers, args.model)
+
+    if args.socket:
+        server = ThreadingUnixHTTPServer(args.socket, MatchingRequestHandler)
+        logger.info(f"Matching server listening on unix:{args.socket}")
+    else:
+        server = ThreadingHTTPServer((args.host, args.port), MatchingRequestHandler)
+        logger.info(f"Matching server listening on http://{args.host}:{args.port}")
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("Shutting down matching server")
+    finally:
+        server.server_close()
+        if args.socket and os.path.exists(args.socket):
+            os.remove(args.socket)
+
+
+if __name__ == '__main__':
+    main()
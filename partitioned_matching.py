@@ -0,0 +1,129 @@
+import os
+import shutil
+import logging
+import tempfile
+import multiprocessing as mp
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from matching_engine import blocked_matches
+
+logger = logging.getLogger(__name__)
+
+# Number of matching processes (0 = one per core, 1 = match in the calling process)
+PARTITION_WORKERS = int(os.environ.get('MATCHER_PARTITION_WORKERS', '0'))
+# Partitions with more buyer x seller pairs than this are split into buyer chunks
+MAX_PAIRS_PER_TASK = int(os.environ.get('MATCHER_MAX_PAIRS_PER_TASK', '20000000'))
+
+_worker_buyers = None
+_worker_sellers = None
+
+
+def _init_worker(buyer_path: str, seller_path: str) -> None:
+    """Open the shared embedding files memory-mapped once per worker process."""
+    global _worker_buyers, _worker_sellers
+    _worker_buyers = np.load(buyer_path, mmap_mode='r')
+    _worker_sellers = np.load(seller_path, mmap_mode='r')
+
+
+def _match_task(task):
+    task_id, buyer_rows, seller_rows, threshold = task
+    b, s, scores = blocked_matches(_worker_buyers[buyer_rows], _worker_sellers[seller_rows], threshold=threshold)
+    return task_id, buyer_rows[b], seller_rows[s], scores
+
+
+def partition_tasks(buyer_keys, seller_keys,
+                    max_pairs: int = MAX_PAIRS_PER_TASK) -> List[Tuple[int, np.ndarray, np.ndarray]]:
+    """
+    Group buyers and sellers by partition key (e.g. 'state > city') into
+    (partition_rank, buyer_rows, seller_rows) tasks.
+
+    Partitions are ranked by first appearance among the buyers. Partitions
+    larger than max_pairs are split into buyer chunks, and tasks are returned
+    largest first so big partitions (Bayern, NRW) start early and do not
+    become stragglers at the end of the run.
+    """
+    buyer_keys = np.asarray(buyer_keys, dtype=object)
+    seller_keys = np.asarray(seller_keys, dtype=object)
+    seller_rows_of = {}
+    for row, key in enumerate(seller_keys):
+        seller_rows_of.setdefault(key, []).append(row)
+    buyer_rows_of = {}
+    for row, key in enumerate(buyer_keys):
+        buyer_rows_of.setdefault(key, []).append(row)
+
+    tasks = []
+    for rank, (key, buyer_rows) in enumerate(buyer_rows_of.items()):
+        seller_rows = seller_rows_of.get(key)
+        if not seller_rows:
+            continue
+        buyer_rows = np.asarray(buyer_rows, dtype=np.int64)
+        seller_rows = np.asarray(seller_rows, dtype=np.int64)
+        chunk = max(max_pairs // len(seller_rows), 1)
+        for start in range(0, len(buyer_rows), chunk):
+            tasks.append((rank, buyer_rows[start:start + chunk], seller_rows))
+    tasks.sort(key=lambda task: len(task[1]) * len(task[2]), reverse=True)
+    return tasks
+
+
+def partitioned_matches(buyer_keys, seller_keys, buyer_embeddings: np.ndarray, seller_embeddings: np.ndarray,
+                        threshold: float, workers: Optional[int] = None,
+                        max_pairs: int = MAX_PAIRS_PER_TASK) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Threshold matches between buyers and sellers that share a partition key.
+
+    Each partition is scored with the blocked kernel. With more than one
+    worker the embeddings are written once to .npy files that every worker
+    opens memory-mapped, and tasks are scheduled largest first onto a
+    process pool. Returns flat (buyer_idx, seller_idx, score) arrays ordered
+    like the serial per-partition loop: by partition, then buyer, then seller.
+    """
+    workers = PARTITION_WORKERS if workers is None else workers
+    workers = workers or os.cpu_count()
+    tasks = partition_tasks(buyer_keys, seller_keys, max_pairs)
+    n_pairs = sum(len(b) * len(s) for _, b, s in tasks)
+    logger.info(f"Partitioned matching: {len(tasks)} tasks, {n_pairs} candidate pairs, "
+                f"{min(workers, max(len(tasks), 1))} workers")
+
+    results = []
+    if workers <= 1 or len(tasks) <= 1:
+        buyer_embeddings = np.asarray(buyer_embeddings, dtype=np.float32)
+        seller_embeddings = np.asarray(seller_embeddings, dtype=np.float32)
+        for task_id, (_, buyer_rows, seller_rows) in enumerate(tasks):
+            b, s, scores = blocked_matches(buyer_embeddings[buyer_rows], seller_embeddings[seller_rows],
+                                           threshold=threshold)
+            results.append((task_id, buyer_rows[b], seller_rows[s], scores))
+    else:
+        shared_dir = tempfile.mkdtemp(prefix='partitioned_matching_')
+        try:
+            buyer_path = os.path.join(shared_dir, 'buyers.npy')
+            seller_path = os.path.join(shared_dir, 'sellers.npy')
+            np.save(buyer_path, np.asarray(buyer_embeddings, dtype=np.float32))
+            np.save(seller_path, np.asarray(seller_embeddings, dtype=np.float32))
+
+            ctx = mp.get_context('spawn')  # the caller may hold torch, which is not fork-safe
+            with ctx.Pool(processes=min(workers, len(tasks)), initializer=_init_worker,
+                          initargs=(buyer_path, seller_path)) as pool:
+                payload = [(task_id, buyer_rows, seller_rows, threshold)
+                           for task_id, (_, buyer_rows, seller_rows) in enumerate(tasks)]
+                # chunksize=1: tasks are already sorted largest first, idle workers pull the next one
+                for done, result in enumerate(pool.imap_unordered(_match_task, payload, chunksize=1), 1):
+                    results.append(result)
+                    logger.info(f"Finished partition task {done}/{len(tasks)}")
+        except Exception as e:
+            logger.error(f"Error in partitioned matching: {e}")
+            raise
+        finally:
+            shutil.rmtree(shared_dir, ignore_errors=True)
+
+    if not results:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty, np.empty(0, dtype=np.float32)
+
+    ranks = np.concatenate([np.full(len(b), tasks[task_id][0], dtype=np.int64) for task_id, b, _, _ in results])
+    buyer_idx = np.concatenate([b for _, b, _, _ in results]).astype(np.int64)
+    seller_idx = np.concatenate([s for _, _, s, _ in results]).astype(np.int64)
+    scores = np.concatenate([sc for _, _, _, sc in results]).astype(np.float32)
+    order = np.lexsort((seller_idx, buyer_idx, ranks))
+    return buyer_idx[order], seller_idx[order], scores[order]
@@ -311,13 +311,14 @@
 # # Save valid matches
 # valid_matches.to_csv('./matches/valid_matches.csv', index=False)
 import pandas as pd
-import numpy as np
 import re
 import nltk
 from nltk.corpus import stopwords
-from sentence_transformers import SentenceTransformer
-from sklearn.metrics.pairwise import cosine_similarity
 import logging
+from encoder_backend import load_encoder
+from text_encoding import encode_texts
+from matching_engine import build_match_frame
+from partitioned_matching import partitioned_matches
 
 # Ensure nltk stopwords are downloaded
 nltk.download('stopwords')
@@ -385,61 +386,34 @@ def main():
     # Initialize the model
     logging.info('Loading the Sentence Transformer model...')
     model_name = 'paraphrase-multilingual-MiniLM-L12-v2'
-    model = SentenceTransformer(model_name)
+    model = load_encoder(model_name)  # backend from MATCHER_ENCODER_BACKEND
     
     # Set similarity threshold
     similarity_threshold = 0.8
     
-    # Initialize matches list
-    matches = []
+    # Encode every buyer and seller once; matching only compares records within the same state_city
+    logging.info('Encoding buyers\' and sellers\' text...')
+    buyer_embeddings = encode_texts(buyers_df['combined_text'].tolist(), model)
+    seller_embeddings = encode_texts(sellers_df['combined_text'].tolist(), model)
     
-    # Get unique state_city values
-    state_city_list = buyers_df['state_city'].unique()
-    
-    for state_city in state_city_list:
-        logging.info(f'Processing location: {state_city}')
-        # Get buyers and sellers with this state_city
-        buyers_subset = buyers_df[buyers_df['state_city'] == state_city].reset_index(drop=True)
-        sellers_subset = sellers_df[sellers_df['state_city'] == state_city].reset_index(drop=True)
-        
-        if buyers_subset.empty or sellers_subset.empty:
-            logging.info('No matching buyers or sellers for this location.')
-            continue  # No matching sellers or buyers for this location
-        
-        # Encode sellers' combined_text once for this state_city
-        logging.info('Encoding sellers\' text...')
-        sellers_embeddings_subset = model.encode(sellers_subset['combined_text'].tolist(), convert_to_tensor=True)
-        
-        for i, buyer_row in buyers_subset.iterrows():
-            logging.info(f'Processing buyer {i+1}/{len(buyers_subset)} in location {state_city}')
-            buyer_embedding = model.encode(buyer_row['combined_text'], convert_to_tensor=True)
-            
-            # Compute cosine similarity between buyer and all sellers in this state_city
-            similarity_scores = cosine_similarity(buyer_embedding.cpu().numpy().reshape(1, -1), sellers_embeddings_subset.cpu().numpy())[0]
-            
-            # Find indices where similarity is above threshold
-            matching_sellers_indices = np.where(similarity_scores >= similarity_threshold)[0]
-            
-            for idx in matching_sellers_indices:
-                seller_row = sellers_subset.iloc[idx]
-                similarity = similarity_scores[idx]
-                # Store the match
-                match = {
-                    'buyer_title': buyer_row['title'],
-                    'buyer_summary': buyer_row['description'],
-                    'buyer_long_description': buyer_row['long_description'],
-                    'seller_title': seller_row['title'],
-                    'seller_summary': seller_row['description'],
-                    'seller_long_description': seller_row['long_description'],
-                    # 'similarity': similarity  # Optional
-                }
-                matches.append(match)
+    # Score the state_city partitions in parallel (MATCHER_PARTITION_WORKERS processes)
+    buyer_idx, seller_idx, _ = partitioned_matches(
+        buyers_df['state_city'].to_numpy(), sellers_df['state_city'].to_numpy(),
+        buyer_embeddings, seller_embeddings, threshold=similarity_threshold)
     
     # Create DataFrame from matches
-    matches_df = pd.DataFrame(matches)
+    matches_df = build_match_frame(buyers_df, sellers_df, buyer_idx, seller_idx, {
+        'buyer_title': 'title',
+        'buyer_summary': 'description',
+        'buyer_long_description': 'long_description',
+    }, {
+        'seller_title': 'title',
+        'seller_summary': 'description',
+        'seller_long_description': 'long_description',
+    })
     
     # Save to CSV
-    logging.info('Saving valid matches to CSV...', len(matches_df))
+    logging.info(f'Saving {len(matches_df)} valid matches to CSV...')
     matches_df.to_csv('./matches/valid_matches.csv', index=False)
     logging.info('Done.')
 
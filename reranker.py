@@ -0,0 +1,164 @@
+import os
+import time
+import shelve
+import logging
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from embedding_cache import DEFAULT_CACHE_DIR, text_hash, slug
+
+logger = logging.getLogger(__name__)
+
+# Set MATCHER_RERANK=1 to rerank the matchers' candidates with a cross-encoder
+RERANK_ENABLED = os.environ.get('MATCHER_RERANK', '0') == '1'
+# Multilingual (incl. German) cross-encoder trained on mMARCO
+RERANKER_MODEL = os.environ.get('MATCHER_RERANKER_MODEL', 'cross-encoder/mmarco-mMiniLMv2-L12-H384-v1')
+# Candidates per buyer that are reranked, and the wall-clock budget (seconds) of one run
+RERANK_TOP_N = int(os.environ.get('MATCHER_RERANK_TOP_N', '20'))
+RERANK_BUDGET_SECONDS = float(os.environ.get('MATCHER_RERANK_BUDGET', '600'))
+RERANK_CACHE_DIR = os.path.join(DEFAULT_CACHE_DIR, 'rerank')
+
+
+def listing_text(record: Dict, fields: Sequence[str] = ('title', 'description', 'long_description')) -> str:
+    """Raw (unstemmed) listing text for the cross-encoder: the non-empty fields joined as sentences."""
+    parts = []
+    for field in fields:
+        value = record.get(field, '')
+        if value is not None and not pd.isna(value) and str(value).strip():
+            parts.append(str(value).strip())
+    return '. '.join(parts)
+
+
+def listing_texts(df: pd.DataFrame, fields: Sequence[str] = ('title', 'description', 'long_description')) -> List[str]:
+    """listing_text for every row of a DataFrame."""
+    return [listing_text(record, fields) for record in df.to_dict('records')]
+
+
+def rank_within_buyer(buyer_idx: np.ndarray, scores: np.ndarray) -> np.ndarray:
+    """0-based rank of every pair among its buyer's pairs, by descending score."""
+    buyer_idx = np.asarray(buyer_idx, dtype=np.int64)
+    order = np.lexsort((-np.asarray(scores, dtype=np.float64), buyer_idx))
+    sorted_buyers = buyer_idx[order]
+    run_starts = np.flatnonzero(np.r_[True, sorted_buyers[1:] != sorted_buyers[:-1]]) if len(order) else order
+    run_lengths = np.diff(np.r_[run_starts, len(order)])
+    ranks = np.empty(len(order), dtype=np.int64)
+    ranks[order] = np.arange(len(order)) - np.repeat(run_starts, run_lengths)
+    return ranks
+
+
+class CrossEncoderReranker:
+    """
+    Second-stage precision filter for bi-encoder candidates.
+
+    Only each buyer's top_n candidates (by bi-encoder score) are scored with
+    a cross-encoder. Pairs are scored in rank order across all buyers (every
+    buyer's best candidate first, then every second best, ...) in shared
+    batches, and scoring stops once the run's time budget is spent; pairs
+    that were not reached keep their bi-encoder decision. Cross-encoder
+    scores are cached on disk per model, keyed by the hashes of both texts.
+    """
+
+    def __init__(self, model_name: str = RERANKER_MODEL, top_n: int = RERANK_TOP_N,
+                 time_budget: float = RERANK_BUDGET_SECONDS, batch_size: int = 64,
+                 max_length: int = 512, cache_dir: Optional[str] = RERANK_CACHE_DIR):
+        self.model_name = model_name
+        self.top_n = top_n
+        self.time_budget = time_budget
+        self.batch_size = batch_size
+        self.max_length = max_length
+        self.cache_path = None
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+            self.cache_path = os.path.join(cache_dir, slug(model_name))
+        self.time_spent = 0.0
+        self._model = None
+
+    def _load_model(self):
+        if self._model is None:
+            from sentence_transformers import CrossEncoder
+
+            logger.info(f"Loading cross-encoder {self.model_name}...")
+            self._model = CrossEncoder(self.model_name, max_length=self.max_length)
+        return self._model
+
+    def score_pairs(self, buyer_texts: List[str], seller_texts: List[str],
+                    buyer_idx: np.ndarray, seller_idx: np.ndarray) -> np.ndarray:
+        """
+        Cross-encoder scores of the given pairs, in the given priority order;
+        NaN for pairs not reached within the remaining time budget.
+        """
+        buyer_hashes = {i: text_hash(buyer_texts[i]) for i in set(buyer_idx.tolist())}
+        seller_hashes = {j: text_hash(seller_texts[j]) for j in set(seller_idx.tolist())}
+        keys = [f'{buyer_hashes[i]}:{seller_hashes[j]}' for i, j in zip(buyer_idx.tolist(), seller_idx.tolist())]
+        scores = np.full(len(keys), np.nan, dtype=np.float32)
+
+        cache = shelve.open(self.cache_path) if self.cache_path else {}
+        try:
+            # Identical text pairs are scored once; first occurrence keeps the priority
+            missing: Dict[str, List[int]] = {}
+            for position, key in enumerate(keys):
+                cached = cache.get(key)
+                if cached is not None:
+                    scores[position] = cached
+                else:
+                    missing.setdefault(key, []).append(position)
+            logger.info(f"Reranking {len(keys)} pairs: {len(keys) - sum(map(len, missing.values()))} cached, "
+                        f"{len(missing)} to score")
+
+            pending = list(missing.items())
+            scored = 0
+            for start in range(0, len(pending), self.batch_size):
+                if self.time_spent >= self.time_budget:
+                    logger.warning(f"Rerank time budget of {self.time_budget:g}s spent: "
+                                   f"{len(pending) - scored} pairs keep their bi-encoder decision")
+                    break
+                batch = pending[start:start + self.batch_size]
+                started = time.perf_counter()
+                first = [positions[0] for _, positions in batch]
+                batch_scores = self._load_model().predict(
+                    [(buyer_texts[buyer_idx[p]], seller_texts[seller_idx[p]]) for p in first],
+                    batch_size=self.batch_size, show_progress_bar=False,
+                )
+                for (key, positions), score in zip(batch, np.asarray(batch_scores, dtype=np.float32).ravel()):
+                    scores[positions] = score
+                    cache[key] = float(score)
+                scored += len(batch)
+                self.time_spent += time.perf_counter() - started
+        finally:
+            if self.cache_path:
+                cache.close()
+        return scores
+
+    def rerank(self, buyer_texts: List[str], seller_texts: List[str], buyer_idx: np.ndarray,
+               seller_idx: np.ndarray, scores: np.ndarray, threshold: float) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Rerank flat candidate pairs (indices into buyer_texts / seller_texts).
+
+        Returns (keep, rerank_scores) aligned with the input pairs: pairs
+        outside their buyer's top_n are dropped, reranked pairs are kept if
+        their cross-encoder score is >= threshold, and pairs not reached
+        within the time budget are kept (rerank score NaN).
+        """
+        buyer_idx = np.asarray(buyer_idx, dtype=np.int64)
+        seller_idx = np.asarray(seller_idx, dtype=np.int64)
+        rerank_scores = np.full(len(buyer_idx), np.nan, dtype=np.float32)
+        if len(buyer_idx) == 0:
+            return np.zeros(0, dtype=bool), rerank_scores
+
+        ranks = rank_within_buyer(buyer_idx, scores)
+        selected = np.flatnonzero(ranks < self.top_n)
+        # Every buyer's best candidate first, so a spent budget degrades evenly across buyers
+        selected = selected[np.lexsort((-np.asarray(scores)[selected], ranks[selected]))]
+        rerank_scores[selected] = self.score_pairs(buyer_texts, seller_texts,
+                                                   buyer_idx[selected], seller_idx[selected])
+
+        keep = np.zeros(len(buyer_idx), dtype=bool)
+        keep[selected] = True
+        reranked = ~np.isnan(rerank_scores)
+        keep[reranked] = rerank_scores[reranked] >= threshold
+        logger.info(f"Rerank: {len(selected)}/{len(buyer_idx)} candidates in the top {self.top_n} per buyer, "
+                    f"{int(reranked.sum())} scored, {int(keep.sum())} kept "
+                    f"({self.time_spent:.1f}s of {self.time_budget:g}s budget used)")
+        return keep, rerank_scores
@@ -0,0 +1,284 @@
+import os
+import json
+import hashlib
+import logging
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import faiss
+
+logger = logging.getLogger(__name__)
+
+# Index used when none is passed explicitly:
+#   'flat' - exact inner-product search (brute force)
+#   'hnsw' - HNSW graph, no training, good recall at low latency
+#   'ivf'  - inverted lists over k-means cells, lowest memory per vector
+#   'auto' - 'flat' up to EXACT_MAX_SIZE vectors, 'hnsw' above
+SELLER_INDEX_TYPE = os.environ.get('MATCHER_SELLER_INDEX', 'auto')
+INDEX_TYPES = ('flat', 'hnsw', 'ivf')
+EXACT_MAX_SIZE = 50000
+
+
+def listing_ids(values: Iterable) -> np.ndarray:
+    """Stable int64 ids for listings, derived from a key such as the listing url."""
+    ids = []
+    for value in values:
+        digest = hashlib.sha1(str(value).encode('utf-8')).digest()
+        # 63 bits keep the id positive; -1 is faiss' "no result" marker
+        ids.append(int.from_bytes(digest[:8], 'little') & 0x7FFFFFFFFFFFFFFF)
+    return np.asarray(ids, dtype=np.int64)
+
+
+def content_hashes(texts: Iterable[str]) -> np.ndarray:
+    """sha1 hex digests of the indexed texts, used to detect changed listings."""
+    return np.array([hashlib.sha1(str(t).encode('utf-8')).hexdigest() for t in texts], dtype='S40')
+
+
+class SellerIndex:
+    """
+    Persistent nearest-neighbour index over normalized seller embeddings,
+    keyed by seller id (inner product = cosine similarity).
+
+    Vectors can be added and removed incrementally as listings appear and
+    disappear. The HNSW graph cannot delete vectors in place, so it stores
+    sequential labels mapped to seller ids; removed labels are kept as
+    tombstones, filtered out of results, and the graph is rebuilt once more
+    than `max_tombstones` have accumulated.
+
+    Recall/latency knobs: `ef_search` (HNSW) and `nprobe` (IVF); higher
+    values give better recall at higher query cost.
+    """
+
+    def __init__(self, dimension: int, index_type: str = SELLER_INDEX_TYPE, expected_size: int = 0,
+                 hnsw_m: int = 32, ef_construction: int = 200, ef_search: int = 128,
+                 nlist: Optional[int] = None, nprobe: int = 16, max_tombstones: int = 1024):
+        if index_type == 'auto':
+            index_type = 'flat' if expected_size <= EXACT_MAX_SIZE else 'hnsw'
+        if index_type not in INDEX_TYPES:
+            raise ValueError(f"Unknown index type '{index_type}', expected one of {INDEX_TYPES} or 'auto'")
+
+        self.dimension = dimension
+        self.index_type = index_type
+        self.params = {
+            'hnsw_m': hnsw_m,
+            'ef_construction': ef_construction,
+            'ef_search': ef_search,
+            # ~sqrt(N) cells is the usual starting point for IVF
+            'nlist': nlist or max(int(np.sqrt(max(expected_size, 1))), 1),
+            'nprobe': nprobe,
+            'max_tombstones': max_tombstones,
+        }
+        self.index = self._new_index()
+        self.content: Dict[int, bytes] = {}   # seller id -> content hash of the indexed text
+        # HNSW only: internal label -> seller id, seller id -> live label, removed labels
+        self.label_ids: List[int] = []
+        self.labels: Dict[int, int] = {}
+        self.tombstones = set()
+
+    # ------------------------------------------------------------------
+    # Construction
+    # ------------------------------------------------------------------
+    def _new_index(self):
+        if self.index_type == 'flat':
+            base = faiss.IndexFlatIP(self.dimension)
+        elif self.index_type == 'hnsw':
+            index = faiss.IndexHNSWFlat(self.dimension, self.params['hnsw_m'], faiss.METRIC_INNER_PRODUCT)
+            index.hnsw.efConstruction = self.params['ef_construction']
+            self._apply_search_params(index)
+            return index
+        else:
+            self._quantizer = faiss.IndexFlatIP(self.dimension)
+            base = faiss.IndexIVFFlat(self._quantizer, self.dimension, self.params['nlist'],
+                                      faiss.METRIC_INNER_PRODUCT)
+        index = faiss.IndexIDMap2(base)
+        self._apply_search_params(index)
+        return index
+
+    def _apply_search_params(self, index) -> None:
+        if self.index_type == 'hnsw':
+            index.hnsw.efSearch = self.params['ef_search']
+        elif self.index_type == 'ivf':
+            faiss.extract_index_ivf(index).nprobe = self.params['nprobe']
+
+    def _train(self, vectors: np.ndarray) -> None:
+        ivf = faiss.extract_index_ivf(self.index)
+        if ivf.is_trained:
+            return
+        # k-means wants ~40 points per cell; shrink nlist for small first batches
+        nlist = min(self.params['nlist'], max(len(vectors) // 39, 1))
+        if nlist != self.params['nlist']:
+            self.params['nlist'] = nlist
+            self.index = self._new_index()
+            ivf = faiss.extract_index_ivf(self.index)
+        logger.info(f"Training IVF seller index with {nlist} cells on {len(vectors)} vectors")
+        ivf.train(vectors)
+
+    def __len__(self) -> int:
+        return len(self.content)
+
+    def __contains__(self, seller_id: int) -> bool:
+        return int(seller_id) in self.content
+
+    # ------------------------------------------------------------------
+    # Updates
+    # ------------------------------------------------------------------
+    def add(self, ids: np.ndarray, vectors: np.ndarray, hashes: Optional[np.ndarray] = None) -> None:
+        """Add (or replace) vectors for the given seller ids."""
+        ids = np.asarray(ids, dtype=np.int64)
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        if len(ids) == 0:
+            return
+        if vectors.shape[1] != self.dimension:
+            raise ValueError(f"Vector dimension {vectors.shape[1]} does not match index dimension {self.dimension}")
+        # Last occurrence wins for duplicate ids within one call
+        _, last = np.unique(ids[::-1], return_index=True)
+        keep = np.sort(len(ids) - 1 - last)
+        ids, vectors = ids[keep], vectors[keep]
+        hashes = hashes[keep] if hashes is not None else np.full(len(ids), b'', dtype='S40')
+
+        self.remove([i for i in ids if int(i) in self.content])
+        if self.index_type == 'hnsw':
+            first_label = len(self.label_ids)
+            self.index.add(vectors)
+            for offset, seller_id in enumerate(ids):
+                self.label_ids.append(int(seller_id))
+                self.labels[int(seller_id)] = first_label + offset
+        else:
+            if self.index_type == 'ivf':
+                self._train(vectors)
+            self.index.add_with_ids(vectors, ids)
+        for seller_id, content_hash in zip(ids, hashes):
+            self.content[int(seller_id)] = bytes(content_hash)
+
+    def remove(self, ids: Iterable[int]) -> int:
+        """Remove seller ids from the index; returns the number removed."""
+        ids = [int(i) for i in ids if int(i) in self.content]
+        if not ids:
+            return 0
+        for seller_id in ids:
+            del self.content[seller_id]
+        if self.index_type == 'hnsw':
+            self.tombstones.update(self.labels.pop(seller_id) for seller_id in ids)
+            if len(self.tombstones) > self.params['max_tombstones']:
+                self.rebuild()
+        else:
+            self.index.remove_ids(np.asarray(ids, dtype=np.int64))
+        return len(ids)
+
+    def rebuild(self) -> None:
+        """Rebuild the HNSW graph from its live vectors, dropping tombstones."""
+        if self.index_type != 'hnsw':
+            return  # flat and IVF indexes delete in place
+        ids = list(self.labels.keys())
+        vectors = np.empty((len(ids), self.dimension), dtype=np.float32)
+        for row, seller_id in enumerate(ids):
+            vectors[row] = self.index.reconstruct(self.labels[seller_id])
+        logger.info(f"Rebuilding HNSW seller index with {len(ids)} vectors ({len(self.tombstones)} removed)")
+        self.index = self._new_index()
+        self.label_ids = []
+        self.labels = {}
+        self.tombstones = set()
+        if ids:
+            self.index.add(vectors)
+            self.label_ids = ids
+            self.labels = {seller_id: label for label, seller_id in enumerate(ids)}
+
+    def sync(self, ids: np.ndarray, vectors: np.ndarray, hashes: np.ndarray) -> Dict[str, int]:
+        """
+        Bring the index in line with a seller snapshot: add new ids, re-add
+        ids whose content hash changed and remove ids no longer present.
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        wanted = set(int(i) for i in ids)
+        removed = self.remove([i for i in list(self.content) if i not in wanted])
+        changed = np.array([self.content.get(int(i)) != bytes(h) for i, h in zip(ids, hashes)], dtype=bool)
+        self.add(ids[changed], np.asarray(vectors)[changed], np.asarray(hashes)[changed])
+        counts = {'added': int(changed.sum()), 'removed': removed, 'total': len(self)}
+        logger.info(f"Seller index sync: {counts}")
+        return counts
+
+    # ------------------------------------------------------------------
+    # Search
+    # ------------------------------------------------------------------
+    def search(self, queries: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Return (scores, seller_ids), both of shape (n_queries, k), best
+        first. Missing results are padded with score -inf and id -1.
+        """
+        queries = np.ascontiguousarray(np.atleast_2d(queries), dtype=np.float32)
+        scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        ids = np.full((len(queries), k), -1, dtype=np.int64)
+        if len(self) == 0 or len(queries) == 0 or k <= 0:
+            return scores, ids
+
+        # Over-fetch by the number of tombstones so k live results survive the filter
+        fetch = min(k + len(self.tombstones), self.index.ntotal)
+        found_scores, found_ids = self.index.search(queries, fetch)
+        if self.index_type == 'hnsw':
+            labels = found_ids
+            dead = labels < 0
+            if self.tombstones:
+                dead |= np.isin(labels, np.fromiter(self.tombstones, dtype=np.int64))
+            found_ids = np.where(dead, -1, np.asarray(self.label_ids, dtype=np.int64)[np.maximum(labels, 0)])
+            found_scores = np.where(dead, -np.inf, found_scores)
+            order = np.argsort(-found_scores, axis=1, kind='stable')
+            found_ids = np.take_along_axis(found_ids, order, axis=1)
+            found_scores = np.take_along_axis(found_scores, order, axis=1)
+
+        width = min(k, fetch)
+        scores[:, :width] = found_scores[:, :width]
+        ids[:, :width] = found_ids[:, :width]
+        scores[ids < 0] = -np.inf
+        return scores, ids
+
+    # ------------------------------------------------------------------
+    # Persistence
+    # ------------------------------------------------------------------
+    def save(self, path: str) -> None:
+        """Write the index to `path` plus a .meta.json / .ids.npz next to it."""
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        faiss.write_index(self.index, path + '.tmp')
+        os.replace(path + '.tmp', path)
+        ids = np.fromiter(self.content.keys(), dtype=np.int64, count=len(self.content))
+        hashes = np.array(list(self.content.values()), dtype='S40')
+        np.savez(path + '.ids.tmp.npz', ids=ids, hashes=hashes,
+                 label_ids=np.asarray(self.label_ids, dtype=np.int64),
+                 tombstones=np.fromiter(self.tombstones, dtype=np.int64, count=len(self.tombstones)))
+        os.replace(path + '.ids.tmp.npz', path + '.ids.npz')
+        with open(path + '.meta.json', 'w') as f:
+            json.dump({'dimension': self.dimension, 'index_type': self.index_type, 'params': self.params}, f)
+        logger.info(f"Saved {self.index_type} seller index with {len(self)} sellers to {path}")
+
+    @classmethod
+    def load(cls, path: str, **overrides) -> 'SellerIndex':
+        """Load a saved index; keyword overrides (e.g. ef_search, nprobe) replace saved search params."""
+        with open(path + '.meta.json') as f:
+            meta = json.load(f)
+        params = {**meta['params'], **overrides}
+        seller_index = cls(meta['dimension'], meta['index_type'], **params)
+        seller_index.index = faiss.read_index(path)
+        seller_index._apply_search_params(seller_index.index)
+        stored = np.load(path + '.ids.npz')
+        seller_index.content = {int(i): bytes(h) for i, h in zip(stored['ids'], stored['hashes'])}
+        seller_index.label_ids = [int(i) for i in stored['label_ids']]
+        seller_index.tombstones = set(int(i) for i in stored['tombstones'])
+        seller_index.labels = {seller_id: label for label, seller_id in enumerate(seller_index.label_ids)
+                               if label not in seller_index.tombstones}
+        logger.info(f"Loaded {seller_index.index_type} seller index with {len(seller_index)} sellers from {path}")
+        return seller_index
+
+    @classmethod
+    def open(cls, path: str, dimension: int, **kwargs) -> 'SellerIndex':
+        """Load the index at `path` if it exists and matches `dimension`, else create an empty one."""
+        if os.path.exists(path) and os.path.exists(path + '.meta.json'):
+            try:
+                seller_index = cls.load(path)
+                if seller_index.dimension == dimension:
+                    return seller_index
+                logger.warning(f"Seller index {path} has dimension {seller_index.dimension}, "
+                               f"expected {dimension}; rebuilding")
+            except Exception as e:
+                logger.error(f"Error loading seller index {path}: {e}; rebuilding")
+        return cls(dimension, **kwargs)
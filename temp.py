@@ -6,6 +6,7 @@ from datetime import datetime
 import nltk
 from nltk.tokenize import word_tokenize
 from nltk.stem import WordNetLemmatizer
+from lexicon import Lexicon
 
 # Download necessary NLTK data files
 nltk.download('punkt')
@@ -21,7 +22,7 @@ logger = logging.getLogger(__name__)
 class BusinessMatcher:
     def __init__(self):
         """Initialize the matcher with necessary components."""
-        self.keywords_df = None
+        self.lexicon = None
         self.buyers_df = None
         self.sellers_df = None
         self.keyword_synonyms = {}
@@ -37,34 +38,10 @@ class BusinessMatcher:
         """Load and prepare the data with error handling."""
         try:
             # Load keywords and create enhanced synonym dictionary
-            self.keywords_df = pd.read_csv(keywords_path)
+            self.lexicon = Lexicon.load(keywords_path)
+            self.keyword_synonyms = self.lexicon.keyword_synonyms
             logger.info(f"Successfully loaded keywords from {keywords_path}")
             
-            # Validate required columns in keywords
-            required_keyword_columns = {'Keyword'}
-            if not required_keyword_columns.issubset(self.keywords_df.columns):
-                logger.error("Keywords CSV is missing required columns.")
-                raise ValueError("Keywords CSV is missing required columns.")
-            
-            # Create keyword dictionary with synonyms
-            for _, row in self.keywords_df.iterrows():
-                keyword = row['Keyword']
-                if pd.notna(keyword):
-                    synonyms = set()
-                    synonyms.add(keyword.lower())
-                    
-                    # Iterate through possible synonym columns
-                    for i in range(1, 7):  # Adjusted to handle up to 6 synonyms based on sample data
-                        synonym = row.get(f'Synonym {i}', None)
-                        if pd.notna(synonym):
-                            synonyms.add(synonym.lower())
-                    
-                    # Assign synonyms to the keyword
-                    self.keyword_synonyms[keyword.lower()] = {
-                        'synonyms': synonyms,
-                        'original': keyword
-                    }
-            
             # Load and validate buyers data
             self.buyers_df = pd.read_csv(buyers_path)
             required_buyer_columns = {
@@ -169,11 +146,9 @@ class BusinessMatcher:
 
     def _find_matching_keywords(self, buyer_tokens: Set[str], seller_tokens: Set[str]) -> List[str]:
         """Find matching keywords between two sets of tokens."""
-        matching_keywords = []
-        
-        for keyword, data in self.keyword_synonyms.items():
-            if data['synonyms'].intersection(buyer_tokens) and data['synonyms'].intersection(seller_tokens):
-                matching_keywords.append(data['original'])
+        # Keywords with a synonym among both token sets, in lexicon order
+        shared = self.lexicon.tag_tokens(buyer_tokens) & self.lexicon.tag_tokens(seller_tokens)
+        matching_keywords = [self.lexicon.names[i] for i in sorted(shared)]
                 
         return matching_keywords
 
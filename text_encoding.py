@@ -0,0 +1,133 @@
+import logging
+from typing import Callable, List, Tuple
+
+import numpy as np
+from tqdm import tqdm
+
+logger = logging.getLogger(__name__)
+
+
+def _model_max_tokens(model) -> int:
+    """Max sequence length of a SentenceTransformer, excluding [CLS]/[SEP]-style special tokens."""
+    max_length = getattr(model, 'max_seq_length', None) or model.tokenizer.model_max_length
+    special = model.tokenizer.num_special_tokens_to_add(pair=False)
+    return max(int(max_length) - special, 1)
+
+
+def split_into_passages(texts: List[str], tokenizer, max_tokens: int,
+                        stride: int = 32) -> Tuple[List[str], np.ndarray, np.ndarray]:
+    """
+    Split texts longer than max_tokens into overlapping token windows.
+
+    Returns (passages, owner, token_counts): owner[i] is the index of the
+    text passage i came from. Texts that fit are passed through unchanged.
+    """
+    stride = min(stride, max_tokens - 1) if max_tokens > 1 else 0
+    step = max_tokens - stride
+    token_ids = tokenizer(texts, add_special_tokens=False, truncation=False)['input_ids']
+
+    passages, owner, counts = [], [], []
+    for text_idx, (text, ids) in enumerate(zip(texts, token_ids)):
+        if len(ids) <= max_tokens:
+            passages.append(text)
+            owner.append(text_idx)
+            counts.append(len(ids))
+            continue
+        for start in range(0, len(ids), step):
+            window = ids[start:start + max_tokens]
+            passages.append(tokenizer.decode(window, skip_special_tokens=True))
+            owner.append(text_idx)
+            counts.append(len(window))
+            if start + max_tokens >= len(ids):
+                break
+    return passages, np.asarray(owner, dtype=np.int64), np.asarray(counts, dtype=np.int64)
+
+
+def deduplicate_texts(texts: List[str]) -> Tuple[List[str], np.ndarray]:
+    """
+    Return the unique texts (in first-seen order) and an index array such
+    that unique[inverse[i]] == texts[i].
+    """
+    positions = {}
+    inverse = np.empty(len(texts), dtype=np.int64)
+    for i, text in enumerate(texts):
+        text = '' if text is None else str(text)
+        inverse[i] = positions.setdefault(text, len(positions))
+    return list(positions), inverse
+
+
+def encode_unique(texts: List[str], encode_fn: Callable[[List[str]], np.ndarray]) -> np.ndarray:
+    """
+    Call encode_fn once per distinct text and scatter the vectors back to
+    every row, e.g. for listings repeated across snapshots or flattened
+    once per location.
+    """
+    unique, inverse = deduplicate_texts(texts)
+    if len(unique) < len(inverse):
+        logger.info(f"Encoding {len(unique)} unique texts for {len(inverse)} rows")
+    embeddings = np.asarray(encode_fn(unique))
+    if len(unique) == 0:
+        return embeddings
+    return embeddings[inverse]
+
+
+def encode_texts(texts: List[str], model, batch_size: int = 64, normalize_embeddings: bool = True,
+                 chunk_long_texts: bool = True, stride: int = 32,
+                 show_progress_bar: bool = True) -> np.ndarray:
+    """
+    Encode texts with length-bucketed batches and chunked long texts.
+
+    Passages are sorted by token count and encoded in batches of similar
+    length, so little compute is spent on padding; the result is returned in
+    the original order. Texts longer than the model's max sequence length are
+    split into overlapping passages (instead of being truncated) and their
+    passage embeddings are averaged, weighted by token count, into one vector.
+    Passage embeddings are always L2-normalized before pooling.
+    """
+    texts = ['' if t is None else str(t) for t in texts]
+    if not texts:
+        dim = model.get_sentence_embedding_dimension()
+        return np.empty((0, dim), dtype=np.float32)
+
+    max_tokens = _model_max_tokens(model)
+    if chunk_long_texts:
+        passages, owner, counts = split_into_passages(texts, model.tokenizer, max_tokens, stride)
+    else:
+        passages = texts
+        owner = np.arange(len(texts))
+        counts = np.asarray([len(ids) for ids in model.tokenizer(
+            texts, add_special_tokens=False, truncation=False)['input_ids']], dtype=np.int64)
+        counts = np.minimum(counts, max_tokens)
+
+    n_chunked = len(passages) - len(texts)
+    if n_chunked:
+        logger.info(f"Split long texts into {n_chunked} extra passages (max {max_tokens} tokens, stride {stride})")
+
+    # Bucket by token length; each model.encode call then pads to a near-uniform length
+    order = np.argsort(counts, kind='stable')
+    passage_embeddings = None
+    batches = range(0, len(order), batch_size)
+    for start in tqdm(batches, desc='Encoding', disable=not show_progress_bar):
+        batch_idx = order[start:start + batch_size]
+        batch = model.encode([passages[i] for i in batch_idx], batch_size=len(batch_idx),
+                             convert_to_numpy=True, normalize_embeddings=True,
+                             show_progress_bar=False)
+        if passage_embeddings is None:
+            passage_embeddings = np.empty((len(passages), batch.shape[1]), dtype=np.float32)
+        passage_embeddings[batch_idx] = batch
+
+    if len(passages) == len(texts):
+        embeddings = passage_embeddings
+    else:
+        # Pool passages back into one vector per text, weighted by passage length
+        weights = np.maximum(counts, 1).astype(np.float32)[:, None]
+        embeddings = np.zeros((len(texts), passage_embeddings.shape[1]), dtype=np.float32)
+        np.add.at(embeddings, owner, passage_embeddings * weights)
+        totals = np.zeros(len(texts), dtype=np.float32)
+        np.add.at(totals, owner, weights[:, 0])
+        embeddings /= totals[:, None]
+
+    if normalize_embeddings:
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        embeddings = embeddings / np.maximum(norms, 1e-12)
+    return embeddings.astype(np.float32)
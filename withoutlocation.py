@@ -1,8 +1,6 @@
 import pandas as pd
 import numpy as np
 import json
-from sentence_transformers import SentenceTransformer
-from sklearn.metrics.pairwise import cosine_similarity
 import logging
 import re
 import nltk
@@ -11,6 +9,11 @@ from datetime import datetime
 from nltk.stem import SnowballStemmer
 from joblib import Parallel, delayed
 import gc
+from matching_engine import blocked_matches, build_match_frame
+from encoder_backend import load_encoder
+from text_encoding import encode_texts, encode_unique
+from reranker import CrossEncoderReranker, listing_texts, RERANK_ENABLED
+from hybrid_retrieval import HybridRetriever, HYBRID_ENABLED
 
 # Download required NLTK data
 nltk.download('stopwords')
@@ -69,10 +72,12 @@ def combine_text_fields(row):
 
 def get_embedding_batch(texts, model, batch_size=64):
     """
-    Encode texts in batches to optimize memory usage.
+    Encode texts in length-bucketed batches; long texts are chunked and pooled.
+    Identical texts are encoded once and scattered back to all rows.
     """
-    embeddings = model.encode(texts, batch_size=batch_size, show_progress_bar=True, 
-                              convert_to_numpy=True, normalize_embeddings=True)
+    embeddings = encode_unique(
+        texts, lambda unique_texts: encode_texts(unique_texts, model, batch_size=batch_size, normalize_embeddings=True)
+    )
     return embeddings.astype('float32')  # Use float32 to save memory
 
 def analyze_matches(matches_df, buyers_df, sellers_df):
@@ -147,7 +152,8 @@ def main():
     logging.info('Loading the Sentence Transformer model...')
     model_name = 'paraphrase-multilingual-mpnet-base-v2'
     try:
-        model = SentenceTransformer(model_name)
+        # Backend (torch / onnx / onnx-int8) comes from MATCHER_ENCODER_BACKEND
+        model = load_encoder(model_name)
     except Exception as e:
         logging.error(f"Error loading model {model_name}: {e}")
         return
@@ -162,89 +168,92 @@ def main():
     similarity_threshold = 0.95  
     # Optional text length filter
     min_text_length = 50
+    # Set to an int to keep only each buyer's top-k sellers
+    max_matches_per_buyer = None
+    # Minimum cross-encoder score when reranking is enabled
+    rerank_threshold = 0.5
+
+    # Only buyers with enough text and a truthy NACE code take part in matching (NaN is truthy, as before)
+    if 'assigned_nace_code' in buyers_flat.columns:
+        buyer_nace = buyers_flat['assigned_nace_code']
+    else:
+        buyer_nace = pd.Series('', index=buyers_flat.index)
+    buyer_mask = (
+        (buyers_flat['combined_text'].str.len() >= min_text_length)
+        & buyer_nace.astype(bool)
+    ).to_numpy()
+    eligible_buyers = np.flatnonzero(buyer_mask)
+    logging.info(f'{len(eligible_buyers)}/{len(buyers_flat)} buyers pass text length and NACE filters.')
+
+    # Encode all eligible buyers in batches
+    logging.info("Encoding buyers' text...")
+    buyer_texts = buyers_flat['combined_text'].to_numpy()[eligible_buyers].tolist()
+    buyer_embeddings = get_embedding_batch(buyer_texts, model, batch_size=64)
 
-    matches = []
-    confidence_scores = []
-
-    total_buyers = len(buyers_flat)
     logging.info('Starting matching process...')
-    for i, buyer_row in buyers_flat.iterrows():
-        buyer_text = buyer_row['combined_text']
-        
-        # Check text length filter
-        if len(buyer_text) < min_text_length:
-            continue
-
-        # NACE code for buyer
-        buyer_nace = buyer_row.get('assigned_nace_code', '')
-
-        # Only proceed if buyer has a valid NACE code
-        if not buyer_nace:
-            continue
-
-        # Encode buyer text
-        buyer_embedding = model.encode(buyer_text, convert_to_numpy=True, normalize_embeddings=True).reshape(1, -1)
-
-        # Calculate similarity scores to all sellers
-        sim_scores = cosine_similarity(buyer_embedding, seller_embeddings)[0]
-
-        # Indices above threshold
-        matching_indices = np.where(sim_scores >= similarity_threshold)[0]
-
-        for seller_idx in matching_indices:
-            seller_row = sellers_flat.iloc[seller_idx]
-            
-            # Check text length
-            if len(seller_row['combined_text']) < min_text_length:
-                continue
-
-            # NACE code for seller
-            seller_nace = seller_row.get('nace_code', '')
-
-            # =======================
-            # NACE CODE MUST MATCH
-            # =======================
-            if buyer_nace != seller_nace:
-                continue  # Skip if NACE codes differ
-
-            confidence_score = sim_scores[seller_idx]
-            if confidence_score < similarity_threshold:
-                continue
-
-            confidence_scores.append(confidence_score)
-
-            match = {
-                'buyer_date': buyer_row.get('date', ''),
-                'buyer_title': buyer_row.get('title', ''),
-                'buyer_description': buyer_row.get('description', ''),
-                'buyer_long_description': buyer_row.get('long_description', ''),
-                'buyer_location': buyer_row.get('location', ''),
-                'buyer_latitude': buyer_row['latitude'],
-                'buyer_longitude': buyer_row['longitude'],
-                'buyer_nace_code': buyer_nace,
-
-                'seller_date': seller_row.get('date', ''),
-                'seller_title': seller_row.get('title', ''),
-                'seller_description': seller_row.get('description', ''),
-                'seller_long_description': seller_row.get('long_description', ''),
-                'seller_location': seller_row.get('location', ''),
-                'seller_latitude': seller_row['latitude'],
-                'seller_longitude': seller_row['longitude'],
-                'seller_nace_code': seller_nace,
-                
-                'similarity_score': confidence_score
-            }
-            matches.append(match)
-
-        # Progress logging
-        if (i + 1) % 50 == 0:
-            logging.info(f"Processed {i+1}/{total_buyers} buyers.")
+    if HYBRID_ENABLED:
+        # MATCHER_HYBRID=1: score only each buyer's BM25 + dense fused candidates
+        retriever = HybridRetriever(seller_texts, seller_embeddings)
+        buyer_idx, seller_idx, confidence_scores = retriever.candidate_matches(
+            buyer_texts, buyer_embeddings,
+            threshold=similarity_threshold, top_k=max_matches_per_buyer
+        )
+    else:
+        buyer_idx, seller_idx, confidence_scores = blocked_matches(
+            buyer_embeddings, seller_embeddings,
+            threshold=similarity_threshold, top_k=max_matches_per_buyer
+        )
+    buyer_idx = eligible_buyers[buyer_idx]
+
+    # Check seller text length and require matching NACE codes
+    seller_nace = sellers_flat['nace_code'].to_numpy() if 'nace_code' in sellers_flat.columns \
+        else np.full(len(sellers_flat), '', dtype=object)
+    keep = (
+        (sellers_flat['combined_text'].str.len().to_numpy()[seller_idx] >= min_text_length)
+        & (buyer_nace.to_numpy()[buyer_idx] == seller_nace[seller_idx])
+    )
+    buyer_idx, seller_idx, confidence_scores = buyer_idx[keep], seller_idx[keep], confidence_scores[keep]
+
+    # Optional second stage (MATCHER_RERANK=1): cross-encoder rerank of each buyer's top candidates
+    rerank_scores = None
+    if RERANK_ENABLED:
+        keep, rerank_scores = CrossEncoderReranker().rerank(
+            listing_texts(buyers_flat), listing_texts(sellers_flat),
+            buyer_idx, seller_idx, confidence_scores, rerank_threshold
+        )
+        buyer_idx, seller_idx, confidence_scores = buyer_idx[keep], seller_idx[keep], confidence_scores[keep]
+        rerank_scores = rerank_scores[keep]
 
     logging.info('Creating matches DataFrame...')
-    matches_df = pd.DataFrame(matches)
+    matches_df = build_match_frame(
+        buyers_flat, sellers_flat, buyer_idx, seller_idx,
+        buyer_columns={
+            'buyer_date': 'date',
+            'buyer_title': 'title',
+            'buyer_description': 'description',
+            'buyer_long_description': 'long_description',
+            'buyer_location': 'location',
+            'buyer_latitude': 'latitude',
+            'buyer_longitude': 'longitude',
+            'buyer_nace_code': 'assigned_nace_code',
+        },
+        seller_columns={
+            'seller_date': 'date',
+            'seller_title': 'title',
+            'seller_description': 'description',
+            'seller_long_description': 'long_description',
+            'seller_location': 'location',
+            'seller_latitude': 'latitude',
+            'seller_longitude': 'longitude',
+            'seller_nace_code': 'nace_code',
+        }
+    )
 
     if not matches_df.empty:
+        matches_df['similarity_score'] = confidence_scores
         matches_df['confidence_score'] = confidence_scores
+        if rerank_scores is not None:
+            matches_df['rerank_score'] = rerank_scores
 
         # Sort by confidence score
         matches_df = matches_df.sort_values('confidence_score', ascending=False)
@@ -267,7 +276,7 @@ def main():
         logging.info('No matches found.')
 
     # Final memory cleanup
-    del seller_embeddings, buyers_flat, sellers_flat
+    del seller_embeddings, buyer_embeddings, buyers_flat, sellers_flat
     gc.collect()
 
 if __name__ == '__main__':
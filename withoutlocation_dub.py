@@ -4,10 +4,15 @@ import logging
 import nltk
 from nltk.corpus import stopwords
 from datetime import datetime
-from sentence_transformers import SentenceTransformer
-from sklearn.metrics.pairwise import cosine_similarity
 import gc
 import re
+from embedding_cache import EmbeddingCache
+from encoder_backend import load_encoder, encoder_id
+from text_encoding import encode_texts, encode_unique
+from matching_engine import blocked_matches, build_match_frame
+from match_state import MatchState, record_keys
+from embedding_cache import text_hash
+from reranker import CrossEncoderReranker, listing_texts, RERANK_ENABLED
 
 # Ensure NLTK data is available (stopwords, punkt, etc.)
 nltk.download('stopwords')
@@ -68,19 +73,26 @@ def combine_seller_text_fields(row):
     ])
     return combined.strip()
 
-def get_embedding_batch(texts, model, batch_size=64):
+def get_embedding_batch(texts, model, batch_size=64, cache=None):
     """
     Encode texts in batches to optimize memory usage.
     - normalize_embeddings=True to use cosine similarity effectively
+    - batches are bucketed by token length; long descriptions are chunked and pooled
+    - if an EmbeddingCache is given, only texts not encoded in a previous run hit the model
     """
-    embeddings = model.encode(
-        texts,
-        batch_size=batch_size,
-        show_progress_bar=True,
-        convert_to_numpy=True,
-        normalize_embeddings=True
-    )
-    return embeddings.astype('float32')  # use float32 to save memory
+    def encode(batch_texts):
+        embeddings = encode_texts(
+            batch_texts,
+            model,
+            batch_size=batch_size,
+            normalize_embeddings=True
+        )
+        return embeddings.astype('float32')  # use float32 to save memory
+
+    # Identical texts are encoded once and scattered back to all rows
+    if cache is not None:
+        return encode_unique(texts, lambda unique_texts: cache.encode(unique_texts, encode))
+    return encode_unique(texts, encode)
 
 def analyze_matches(matches_df, buyers_df, sellers_df):
     """
@@ -149,17 +161,21 @@ def main():
     model_name = 'paraphrase-multilingual-mpnet-base-v2'
     # model_name = 'all-MiniLM-L6-v2'
     try:
-        model = SentenceTransformer(model_name)
+        # Backend (torch / onnx / onnx-int8) comes from MATCHER_ENCODER_BACKEND
+        model = load_encoder(model_name)
     except Exception as e:
         logging.error(f"Error loading model {model_name}: {e}")
         return
 
+    # On-disk embedding store, keyed by model + text hash (see embedding_cache.py)
+    embedding_cache = EmbeddingCache(encoder_id(model_name), preprocessing_version='withoutlocation_dub-v2')
+
     # ---------------------------
     # D) ENCODE SELLERS
     # ---------------------------
     logging.info("Encoding sellers' text...")
     seller_texts = sellers_df['combined_text'].tolist()
-    seller_embeddings = get_embedding_batch(seller_texts, model, batch_size=64)
+    seller_embeddings = get_embedding_batch(seller_texts, model, batch_size=64, cache=embedding_cache)
     logging.info("Sellers' embeddings generated.")
 
     # ---------------------------
@@ -167,90 +183,108 @@ def main():
     # ---------------------------
     similarity_threshold = 0.8 
     min_text_length = 50  # skip if buyer text is too short
+    max_matches_per_buyer = None  # set to an int to keep only each buyer's top-k sellers
+    rerank_threshold = 0.5  # minimum cross-encoder score when reranking is enabled
+
+    logging.info("Encoding buyers' text...")
+    buyer_texts = buyers_df['combined_text'].fillna('').tolist()
+    buyer_embeddings = get_embedding_batch(buyer_texts, model, batch_size=64, cache=embedding_cache)
+    logging.info("Buyers' embeddings generated.")
+
+    # Persisted match state: only (new buyers x all sellers) and (other buyers x new sellers)
+    # are scored; pairs of delisted records are kept as stale. Top-k mode is not incremental
+    # (a new seller can displace an old top-k hit), so it always recomputes everything.
+    match_state = MatchState('withoutlocation_dub', config={
+        'model': encoder_id(model_name),
+        'preprocessing': 'withoutlocation_dub-v2',
+        'threshold': similarity_threshold,
+        'top_k': max_matches_per_buyer,
+    })
+    buyer_keys = record_keys(buyers_df, 'url')
+    seller_keys = record_keys(sellers_df, 'url')
+    buyer_versions = [text_hash(t) for t in buyer_texts]
+    seller_versions = [text_hash(t) for t in seller_texts]
+    delta = match_state.diff(buyer_keys, buyer_versions, seller_keys, seller_versions,
+                             full=max_matches_per_buyer is not None)
 
-    matches = []
-    confidence_scores = []
-
-    total_buyers = len(buyers_df)
     logging.info('Starting matching process...')
-
-    for i, buyer_row in buyers_df.iterrows():
-        buyer_text = buyer_row['combined_text'] or ''
-        
-        # (1) Check text length
-        # if len(buyer_text) < min_text_length:
-        #     continue
-
-        # (2) Buyer NACE
-        buyer_nace = buyer_row.get('nace_code', '')
-        # if not buyer_nace:
-        #     # If there's no assigned NACE for buyer, skip
-        #     continue
-
-        # (3) Encode buyer text
-        buyer_embedding = model.encode(
-            buyer_text,
-            convert_to_numpy=True,
-            normalize_embeddings=True
-        ).reshape(1, -1)
-
-        # (4) Calculate similarity to all sellers
-        sim_scores = cosine_similarity(buyer_embedding, seller_embeddings)[0]
-
-        # (5) Indices where sim >= threshold
-        matching_indices = np.where(sim_scores >= similarity_threshold)[0]
-
-        for seller_idx in matching_indices:
-            seller_row = sellers_df.iloc[seller_idx]
-
-            # # Check text length for seller
-            # if len(seller_row['combined_text']) < min_text_length:
-            #     continue
-
-            seller_nace = seller_row.get('nace_code', '')
-
-            # (6) Ensure buyer's NACE code matches seller's NACE
-            # if buyer_nace != seller_nace:
-            #     continue
-
-            confidence_score = sim_scores[seller_idx]
-            if confidence_score < similarity_threshold:
-                continue
-
-            confidence_scores.append(confidence_score)
-
-            match = {
-                'buyer_date': buyer_row.get('date', ''),
-                'buyer_title': buyer_row.get('title', ''),
-                'buyer_description': buyer_row.get('description', ''),
-                'buyer_long_description': buyer_row.get('long_description', ''),
-                'buyer_location': buyer_row.get('location', ''),
-                'buyer_latitude': buyer_row.get('latitude', ''),
-                'buyer_longitude': buyer_row.get('longitude', ''),
-                'buyer_nace_code': buyer_nace,
-
-                'seller_date': seller_row.get('date', ''),
-                'seller_title': seller_row.get('title', ''),
-                'seller_description': seller_row.get('description', ''),
-                'seller_long_description': seller_row.get('long_description', ''),
-                'seller_location': seller_row.get('location', ''),
-                'seller_latitude': seller_row.get('latitude', ''),
-                'seller_longitude': seller_row.get('longitude', ''),
-                'seller_nace_code': seller_nace,
-                
-                'similarity_score': confidence_score
-            }
-            matches.append(match)
-
-        # Progress logging every 50 buyers
-        if (i + 1) % 50 == 0:
-            logging.info(f"Processed {i + 1}/{total_buyers} buyers...")
+    new_buyers = np.flatnonzero(delta.new_buyers)
+    old_buyers = np.flatnonzero(~delta.new_buyers)
+    new_sellers = np.flatnonzero(delta.new_sellers)
+    b_new, s_all, scores_new = blocked_matches(
+        buyer_embeddings[new_buyers], seller_embeddings,
+        threshold=similarity_threshold, top_k=max_matches_per_buyer
+    )
+    b_old, s_new, scores_old = blocked_matches(
+        buyer_embeddings[old_buyers], seller_embeddings[new_sellers],
+        threshold=similarity_threshold, top_k=max_matches_per_buyer
+    )
+    pair_buyers = np.concatenate([new_buyers[b_new], old_buyers[b_old]])
+    pair_sellers = np.concatenate([s_all, new_sellers[s_new]])
+    pair_scores = np.concatenate([scores_new, scores_old])
+    logging.info(f"Scored {len(new_buyers)} buyers x {len(sellers_df)} sellers and "
+                 f"{len(old_buyers)} buyers x {len(new_sellers)} sellers: {len(pair_scores)} new pairs")
+
+    match_state.update(delta, buyer_keys, buyer_versions, seller_keys, seller_versions,
+                       buyer_keys[pair_buyers], seller_keys[pair_sellers], pair_scores)
+
+    # All current (non-stale) matches, mapped back to rows of this snapshot
+    current = match_state.current_matches()
+    buyer_row = pd.Series(np.arange(len(buyer_keys)), index=buyer_keys)
+    seller_row = pd.Series(np.arange(len(seller_keys)), index=seller_keys)
+    buyer_idx = buyer_row.loc[current['buyer_key']].to_numpy()
+    seller_idx = seller_row.loc[current['seller_key']].to_numpy()
+    confidence_scores = current['score'].to_numpy(dtype=np.float32)
+
+    # Optional second stage (MATCHER_RERANK=1): cross-encoder rerank of each buyer's top candidates
+    rerank_scores = None
+    if RERANK_ENABLED:
+        keep, rerank_scores = CrossEncoderReranker().rerank(
+            listing_texts(buyers_df), listing_texts(sellers_df),
+            buyer_idx, seller_idx, confidence_scores, rerank_threshold
+        )
+        buyer_idx, seller_idx, confidence_scores = buyer_idx[keep], seller_idx[keep], confidence_scores[keep]
+        rerank_scores = rerank_scores[keep]
+
+    # (1) Check text length
+    # keep = buyers_df['combined_text'].str.len().to_numpy()[buyer_idx] >= min_text_length
+    # buyer_idx, seller_idx, confidence_scores = buyer_idx[keep], seller_idx[keep], confidence_scores[keep]
+
+    # (2) Ensure buyer's NACE code matches seller's NACE
+    # if 'nace_code' in buyers_df.columns and 'nace_code' in sellers_df.columns:
+    #     same_nace = buyers_df['nace_code'].to_numpy()[buyer_idx] == sellers_df['nace_code'].to_numpy()[seller_idx]
+    #     buyer_idx, seller_idx, confidence_scores = buyer_idx[same_nace], seller_idx[same_nace], confidence_scores[same_nace]
 
     logging.info('Creating matches DataFrame...')
-    matches_df = pd.DataFrame(matches)
+    matches_df = build_match_frame(
+        buyers_df, sellers_df, buyer_idx, seller_idx,
+        buyer_columns={
+            'buyer_date': 'date',
+            'buyer_title': 'title',
+            'buyer_description': 'description',
+            'buyer_long_description': 'long_description',
+            'buyer_location': 'location',
+            'buyer_latitude': 'latitude',
+            'buyer_longitude': 'longitude',
+            'buyer_nace_code': 'nace_code',
+        },
+        seller_columns={
+            'seller_date': 'date',
+            'seller_title': 'title',
+            'seller_description': 'description',
+            'seller_long_description': 'long_description',
+            'seller_location': 'location',
+            'seller_latitude': 'latitude',
+            'seller_longitude': 'longitude',
+            'seller_nace_code': 'nace_code',
+        }
+    )
 
     if not matches_df.empty:
+        matches_df['similarity_score'] = confidence_scores
         matches_df['confidence_score'] = confidence_scores
+        if rerank_scores is not None:
+            matches_df['rerank_score'] = rerank_scores
 
         # Sort by confidence score desc
         matches_df = matches_df.sort_values('confidence_score', ascending=False)
@@ -273,7 +307,7 @@ def main():
         logging.info('No matches found.')
 
     # Cleanup
-    del seller_embeddings
+    del seller_embeddings, buyer_embeddings
     gc.collect()
 
 if __name__ == '__main__':